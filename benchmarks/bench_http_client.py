@@ -0,0 +1,81 @@
+'''Poll/command round-trip times: per-request clients vs the shared client
+
+Times variables.html polls and command.html posts against the mock MPC-HC
+both ways.
+
+    python benchmarks/bench_http_client.py [-n 500] [-o results.json]
+'''
+import os
+import sys
+import time
+import argparse
+
+import tornado.ioloop
+from tornado import gen
+from tornado import httpclient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vlchc.mpc_http import MpcHttpClient  # noqa
+from mock_mpc import MockMpc  # noqa
+from benchutil import summarize, write_results  # noqa
+
+
+@gen.coroutine
+def per_request(url, n, **kwargs):
+    times = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        client = httpclient.AsyncHTTPClient(force_instance=True)
+        try:
+            yield client.fetch(url, **kwargs)
+        finally:
+            client.close()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+@gen.coroutine
+def pooled(client, path, n, **kwargs):
+    times = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        yield client.fetch(client.request(path, **kwargs))
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+@gen.coroutine
+def run(n):
+    mock = MockMpc()
+    port = mock.start()
+    client = MpcHttpClient('127.0.0.1', port)
+    # a harmless command: volume stays where it is
+    post = dict(method='POST', body='wm_command=-2&volume=80')
+
+    results = {}
+    results['poll_before'] = summarize(
+        (yield per_request(client.url('variables.html'), n)))
+    results['poll_after'] = summarize(
+        (yield pooled(client, 'variables.html', n)))
+    results['command_before'] = summarize(
+        (yield per_request(client.url('command.html'), n, **post)))
+    results['command_after'] = summarize(
+        (yield pooled(client, 'command.html', n, **post)))
+    client.close()
+    mock.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=500)
+    parser.add_argument('-o', '--output', help='also write json here')
+    args = parser.parse_args()
+
+    results = tornado.ioloop.IOLoop.current().run_sync(lambda: run(args.n))
+    write_results('http_client', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+'''parse_status microbenchmarks: schema-typed parser vs the lxml path
+
+    python benchmarks/bench_parse_status.py [-n 20000] [-o results.json]
+'''
+import os
+import sys
+import glob
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vlchc import mpc_status  # noqa
+from benchutil import write_results  # noqa
+
+
+data_root = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def bench(func, page, n):
+    per_call = min(timeit.repeat(lambda: func(page), number=n, repeat=3)) / n
+    return 1e6 * per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=20000)
+    parser.add_argument('-o', '--output', help='also write json here')
+    args = parser.parse_args()
+
+    results = {}
+    for fn in sorted(glob.glob(os.path.join(data_root, 'variables*.html'))):
+        with open(fn, 'rb') as f:
+            page = f.read()
+
+        res = {'fast_us': bench(mpc_status.parse_status_fast, page, args.n)}
+        if mpc_status.lxml is not None:
+            res['lxml_us'] = bench(mpc_status.parse_status_lxml, page, args.n)
+            res['speedup'] = res['lxml_us'] / res['fast_us']
+        results[os.path.basename(fn)] = res
+
+    write_results('parse_status', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
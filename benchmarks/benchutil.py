@@ -0,0 +1,41 @@
+'''Helpers shared by the benchmark scripts'''
+import sys
+import json
+import time
+import platform
+
+
+def summarize(times):
+    '''Latency summary (milliseconds) of a list of durations in seconds'''
+    if not times:
+        return {'n': 0}
+
+    times = sorted(times)
+    return {'n': len(times),
+            'mean_ms': 1e3 * sum(times) / len(times),
+            'p50_ms': 1e3 * times[len(times) // 2],
+            'p90_ms': 1e3 * times[int(len(times) * 0.9)],
+            'p99_ms': 1e3 * times[int(len(times) * 0.99)],
+            'max_ms': 1e3 * times[-1],
+            }
+
+
+def write_results(benchmark, results, output=None):
+    '''Print results as json, and write them to output if given'''
+    import tornado
+    from vlchc import encoding
+
+    doc = {'benchmark': benchmark,
+           'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+           'python': sys.version.split()[0],
+           'platform': platform.platform(),
+           'tornado': tornado.version,
+           'json_backend': encoding.json_backend,
+           'results': results,
+           }
+    text = json.dumps(doc, indent=2)
+    print(text)
+    if output:
+        with open(output, 'wt') as f:
+            f.write(text)
+    return doc
@@ -0,0 +1,167 @@
+'''Load generator: many simulated VLC remotes against vlchc
+
+Each remote polls status.json, and now and then fetches playlist.json,
+browses a folder and sends a command (pause, volume, seek).  By default a
+mock MPC-HC and a vlchc server are started in this process on free ports;
+pass --url to load an already running server instead.  In-process runs
+share one event loop with the server, so compare them with each other
+rather than with a real deployment.
+
+    python benchmarks/load.py [--remotes 20] [--duration 10] [-o out.json]
+'''
+import os
+import sys
+import time
+import base64
+import random
+import argparse
+import collections
+
+import tornado.ioloop
+import tornado.netutil
+import tornado.httpserver
+from tornado import gen
+from tornado import httpclient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mock_mpc import MockMpc  # noqa
+from benchutil import summarize, write_results  # noqa
+
+
+browse_root = os.path.abspath(os.path.dirname(__file__))
+
+commands = [
+    ('pl_pause', {}),
+    ('volume', {'val': lambda: random.randint(0, 512)}),
+    ('seek', {'val': lambda: random.randint(0, 6000)}),
+]
+
+
+class Remote:
+    '''One simulated remote'''
+
+    def __init__(self, client, base_url, headers, stats, args):
+        self.client = client
+        self.base_url = base_url
+        self.headers = headers
+        self.stats = stats
+        self.args = args
+
+    @gen.coroutine
+    def get(self, kind, path):
+        t0 = time.perf_counter()
+        try:
+            yield self.client.fetch(self.base_url + path,
+                                    headers=self.headers)
+        except Exception as ex:
+            self.stats['errors'][kind] += 1
+            self.stats['error_types'][type(ex).__name__] += 1
+        else:
+            self.stats['latency'][kind].append(time.perf_counter() - t0)
+
+    @gen.coroutine
+    def run(self, deadline):
+        args = self.args
+        # don't have every remote start in the same instant
+        yield gen.sleep(random.uniform(0, args.interval))
+        iteration = 0
+        while time.monotonic() < deadline:
+            iteration += 1
+            if random.random() < args.command_rate * args.interval:
+                name, params = random.choice(commands)
+                query = '&'.join('{}={}'.format(key, value())
+                                 for key, value in params.items())
+                yield self.get('command',
+                               '/requests/status.json?command={}&{}'
+                               ''.format(name, query))
+            else:
+                yield self.get('status', '/requests/status.json')
+
+            if iteration % 5 == 0:
+                yield self.get('playlist', '/requests/playlist.json')
+            if iteration % 10 == 0:
+                yield self.get('browse', '/requests/browse.json?uri=file:///'
+                               + browse_root.replace(os.sep, '/'))
+
+            yield gen.sleep(args.interval * random.uniform(0.8, 1.2))
+
+
+def start_in_process(args):
+    from vlchc import config, server
+    from vlchc.players import PlayerRegistry
+
+    mock = MockMpc(latency=args.latency, jitter=args.jitter,
+                   failure_rate=args.failure_rate)
+    config.host = '127.0.0.1'
+    config.mpc_port = mock.start()
+    config.players = None
+
+    players = PlayerRegistry.from_config()
+    sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+    tornado.httpserver.HTTPServer(server.make_app(players)).add_sockets(
+        sockets)
+    players.start()
+    return mock, 'http://127.0.0.1:{}'.format(sockets[0].getsockname()[1])
+
+
+@gen.coroutine
+def run(args):
+    mock = None
+    base_url = args.url
+    if base_url is None:
+        mock, base_url = start_in_process(args)
+
+    auth = base64.b64encode(':{}'.format(args.password).encode('utf-8'))
+    headers = {'Authorization': 'Basic ' + auth.decode('ascii')}
+    client = httpclient.AsyncHTTPClient(force_instance=True,
+                                        max_clients=args.remotes)
+    stats = {'latency': collections.defaultdict(list),
+             'errors': collections.Counter(),
+             'error_types': collections.Counter(),
+             }
+
+    deadline = time.monotonic() + args.duration
+    remotes = [Remote(client, base_url, headers, stats, args)
+               for i in range(args.remotes)]
+    yield [remote.run(deadline) for remote in remotes]
+    client.close()
+
+    results = {kind: summarize(times)
+               for kind, times in stats['latency'].items()}
+    results['requests'] = sum(len(times)
+                              for times in stats['latency'].values())
+    results['requests_per_second'] = results['requests'] / args.duration
+    results['errors'] = dict(stats['errors'])
+    results['error_types'] = dict(stats['error_types'])
+    results['settings'] = {key: value for key, value in vars(args).items()
+                           if key != 'password'}
+    if mock is not None:
+        results['mpc_requests'] = mock.requests
+        results['mpc_injected_failures'] = mock.failures
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='running vlchc (default: start one)')
+    parser.add_argument('--password', default='vlcremote')
+    parser.add_argument('--remotes', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between one remote\'s status polls')
+    parser.add_argument('--command-rate', type=float, default=0.1,
+                        help='commands per second per remote')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='mock MPC-HC response latency')
+    parser.add_argument('--jitter', type=float, default=0.001)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('-o', '--output', help='also write json here')
+    args = parser.parse_args()
+
+    results = tornado.ioloop.IOLoop.current().run_sync(lambda: run(args))
+    write_results('load', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
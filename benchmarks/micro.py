@@ -0,0 +1,84 @@
+'''Microbenchmarks of the per-request/per-poll hot spots
+
+parse_status, mpc_to_vlc, command encoding, uri_to_filename, json_response on
+plain dicts and VlcStatus/VlcPlaylist.encode(), timed on the captured pages
+in benchmarks/data.
+
+    python benchmarks/micro.py [-n 20000] [-o results.json]
+'''
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vlchc import mpc_status  # noqa
+from vlchc.mpc_client import vlc_to_mpc  # noqa
+from vlchc.server import uri_to_filename, json_response  # noqa
+from benchutil import write_results  # noqa
+
+
+data_root = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class FakeHandler:
+    '''Just enough of a RequestHandler for json_response'''
+
+    def clear(self):
+        self.chunks = []
+
+    def set_status(self, status):
+        pass
+
+    def set_header(self, name, value):
+        pass
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+
+
+def bench(func, n):
+    '''Best per-call time of func in microseconds'''
+    per_call = min(timeit.repeat(func, number=n, repeat=3)) / n
+    return 1e6 * per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=20000)
+    parser.add_argument('-o', '--output', help='also write json here')
+    args = parser.parse_args()
+    n = args.n
+
+    with open(os.path.join(data_root, 'variables.html'), 'rb') as f:
+        page = f.read()
+
+    mpc = mpc_status.parse_status(page)
+    vlc_status, vlc_playlist = mpc_status.mpc_to_vlc(mpc)
+    status_dict, playlist_dict = vlc_status.as_dict(), vlc_playlist.as_dict()
+    handler = FakeHandler()
+    uri = 'file:///B:/movies/The%20Movie%20(2015)/The%20Movie%20(2015).mkv'
+
+    results = {
+        'parse_status_us': bench(lambda: mpc_status.parse_status(page), n),
+        'mpc_to_vlc_us': bench(lambda: mpc_status.mpc_to_vlc(mpc), n),
+        'command_basic_us': bench(
+            lambda: vlc_to_mpc['pl_pause'](poller=None), n),
+        'command_volume_us': bench(
+            lambda: vlc_to_mpc['volume'](value='128', poller=None), n),
+        'command_in_play_us': bench(
+            lambda: vlc_to_mpc['in_play'](input_=mpc['filepath']), n),
+        'uri_to_filename_us': bench(lambda: uri_to_filename(uri), n),
+        'json_response_status_us': bench(
+            lambda: json_response(handler, status_dict), n),
+        'json_response_playlist_us': bench(
+            lambda: json_response(handler, playlist_dict), n),
+        'status_encode_us': bench(vlc_status.encode, n),
+        'playlist_encode_us': bench(vlc_playlist.encode, n),
+    }
+    write_results('micro', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
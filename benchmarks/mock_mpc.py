@@ -0,0 +1,220 @@
+'''Stand-in for MPC-HC's web interface, for benchmarks
+
+Serves variables.html, command.html and browser.html with a simulated
+player behind them (position advances while playing; play/pause, volume,
+seek and file changes are applied), plus configurable latency, jitter and
+failure injection.
+
+    python benchmarks/mock_mpc.py [--port 13579] [--latency 0.005]
+                                  [--jitter 0.002] [--failure-rate 0.01]
+'''
+import os
+import sys
+import time
+import html
+import random
+import argparse
+import urllib.parse
+
+import tornado.ioloop
+import tornado.web
+import tornado.netutil
+import tornado.httpserver
+from tornado import gen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from vlchc.mpc_reqs import MpcCommandEnum  # noqa
+
+
+variables_template = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+<title>MPC-HC WebServer - Variables</title>
+<link rel="stylesheet" href="default.css" type="text/css" />
+</head>
+<body class="page-variables">
+<p id="file">{file}</p>
+<p id="filepatharg">{filepatharg}</p>
+<p id="filepath">{filepath}</p>
+<p id="filedirarg">{filedirarg}</p>
+<p id="filedir">{filedir}</p>
+<p id="state">{state}</p>
+<p id="statestring">{statestring}</p>
+<p id="position">{position}</p>
+<p id="positionstring">{positionstring}</p>
+<p id="duration">{duration}</p>
+<p id="durationstring">{durationstring}</p>
+<p id="volumelevel">{volumelevel}</p>
+<p id="muted">{muted}</p>
+<p id="playbackrate">1</p>
+<p id="size">4.32 GB</p>
+<p id="reloadtime">0</p>
+<p id="version">1.7.10.0</p>
+</body>
+</html>
+'''
+
+state_strings = {0: 'Stopped', 1: 'Paused', 2: 'Playing'}
+
+
+def _hms(msec):
+    sec = int(msec / 1000)
+    return '{:02d}:{:02d}:{:02d}'.format(sec // 3600, sec // 60 % 60, sec % 60)
+
+
+class MockPlayer:
+    def __init__(self):
+        self.filepath = r'B:\movies\The Movie (2015)\The Movie (2015).mkv'
+        self.duration = 6937899
+        self.volume = 80
+        self.muted = False
+        self.state = 2
+        self._position = 0.0
+        self._since = time.monotonic()
+
+    @property
+    def position(self):
+        position = self._position
+        if self.state == 2:
+            position += 1000 * (time.monotonic() - self._since)
+        return min(int(position), self.duration)
+
+    def _set(self, *, position=None, state=None):
+        self._position = self.position if position is None else position
+        self._since = time.monotonic()
+        if state is not None:
+            self.state = state
+
+    def command(self, args):
+        cmd = int(args.get('wm_command', 0))
+        if cmd == MpcCommandEnum.PLAY:
+            self._set(state=2)
+        elif cmd == MpcCommandEnum.PAUSE:
+            self._set(state=1)
+        elif cmd == MpcCommandEnum.PLAY_PAUSE:
+            self._set(state=1 if self.state == 2 else 2)
+        elif cmd == MpcCommandEnum.STOP:
+            self._set(position=0, state=0)
+        elif cmd == MpcCommandEnum.CMD_SET_VOLUME:
+            self.volume = int(float(args.get('volume', self.volume)))
+        elif cmd == MpcCommandEnum.CMD_SET_POSITION:
+            percent = float(args.get('percent', 0))
+            self._set(position=self.duration * percent / 100.0)
+        elif cmd == MpcCommandEnum.VOLUME_MUTE:
+            self.muted = not self.muted
+
+    def open(self, path):
+        self.filepath = path.replace('/', '\\')
+        self._set(position=0, state=2)
+
+    def variables(self):
+        filedir, file = self.filepath.rsplit('\\', 1)
+        position = self.position
+        return variables_template.format(
+            file=html.escape(file),
+            filepatharg=urllib.parse.quote(self.filepath),
+            filepath=html.escape(self.filepath),
+            filedirarg=urllib.parse.quote(filedir),
+            filedir=html.escape(filedir),
+            state=self.state,
+            statestring=state_strings[self.state],
+            position=position,
+            positionstring=_hms(position),
+            duration=self.duration,
+            durationstring=_hms(self.duration),
+            volumelevel=self.volume,
+            muted=int(self.muted),
+            )
+
+
+class MockHandler(tornado.web.RequestHandler):
+    def initialize(self, mock):
+        self.mock = mock
+        self.player = mock.player
+
+    @gen.coroutine
+    def prepare(self):
+        mock = self.mock
+        mock.requests += 1
+        delay = mock.latency + random.uniform(-mock.jitter, mock.jitter)
+        if delay > 0:
+            yield gen.sleep(delay)
+        if random.random() < mock.failure_rate:
+            mock.failures += 1
+            raise tornado.web.HTTPError(500, 'injected failure')
+
+
+class VariablesHandler(MockHandler):
+    def get(self):
+        self.write(self.player.variables())
+
+
+class CommandHandler(MockHandler):
+    def post(self):
+        args = urllib.parse.parse_qs(self.request.body.decode('utf-8'))
+        self.player.command({key: value[-1] for key, value in args.items()})
+
+
+class BrowserHandler(MockHandler):
+    def get(self):
+        path = self.get_argument('path', '')
+        if path:
+            self.player.open(path)
+        self.write('<html><body></body></html>')
+
+
+class MockMpc:
+    '''Mock mpc-hc web server; start() it on the current ioloop'''
+
+    def __init__(self, *, latency=0.0, jitter=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.player = MockPlayer()
+        self.port = None
+        self.server = None
+
+    def make_app(self):
+        kwargs = dict(mock=self)
+        return tornado.web.Application([
+            (r'/variables.html', VariablesHandler, kwargs),
+            (r'/command.html', CommandHandler, kwargs),
+            (r'/browser.html', BrowserHandler, kwargs),
+        ])
+
+    def start(self, port=0, address='127.0.0.1'):
+        sockets = tornado.netutil.bind_sockets(port, address)
+        self.server = tornado.httpserver.HTTPServer(self.make_app())
+        self.server.add_sockets(sockets)
+        self.port = sockets[0].getsockname()[1]
+        return self.port
+
+    def stop(self):
+        self.server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=13579)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to each response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='+/- seconds of random latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of requests answered with a 500')
+    args = parser.parse_args()
+
+    mock = MockMpc(latency=args.latency, jitter=args.jitter,
+                   failure_rate=args.failure_rate)
+    mock.start(args.port, args.address)
+    print('Mock MPC-HC on {}:{}'.format(args.address, mock.port))
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# captured mpc-hc pages, shared with the benchmarks
+data_root = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                         'data')
+
+
+@pytest.fixture
+def read_page():
+    '''Function of a benchmarks/data file name to its bytes'''
+    def read(name):
+        with open(os.path.join(data_root, name), 'rb') as f:
+            return f.read()
+
+    return read
+
+
+class Clock:
+    '''Stands in for time.monotonic; tests move it forward by hand'''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
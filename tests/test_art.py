@@ -0,0 +1,79 @@
+import os
+import base64
+import shutil
+import tempfile
+import email.utils
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from vlchc import config
+from vlchc.server import ArtHandler
+
+
+class FakePoller:
+    def __init__(self, filepath):
+        self.mpc_status = {'filepath': filepath}
+
+    def touch(self):
+        pass
+
+
+class FakePlayer:
+    def __init__(self, filepath):
+        self.poller = FakePoller(filepath)
+
+
+class ArtHandlerTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.image = os.urandom(100000)
+        with open(os.path.join(self.root, 'Movie-poster.jpg'), 'wb') as f:
+            f.write(self.image)
+        self.player = FakePlayer(os.path.join(self.root, 'Movie.mkv'))
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.root)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r'/art', ArtHandler, dict(player=self.player)),
+        ], cookie_secret='test')
+
+    def fetch_art(self, **headers):
+        auth = base64.b64encode(
+            ':{}'.format(config.vlc_password).encode('utf-8'))
+        headers['Authorization'] = 'Basic ' + auth.decode('ascii')
+        return self.fetch('/art', headers=headers)
+
+    def test_full(self):
+        response = self.fetch_art()
+        assert response.code == 200
+        assert response.body == self.image
+        assert response.headers['Content-Type'] == 'image/jpeg'
+
+    def test_range(self):
+        response = self.fetch_art(Range='bytes=100-70099')
+        assert response.code == 206
+        assert response.body == self.image[100:70100]
+
+    def test_etag(self):
+        etag = self.fetch_art().headers['Etag']
+        assert self.fetch_art(**{'If-None-Match': etag}).code == 304
+
+    def test_if_modified_since(self):
+        last_modified = self.fetch_art().headers['Last-Modified']
+        response = self.fetch_art(**{'If-Modified-Since': last_modified})
+        assert response.code == 304
+
+        older = email.utils.formatdate(
+            os.stat(os.path.join(self.root, 'Movie-poster.jpg')).st_mtime -
+            3600, usegmt=True)
+        response = self.fetch_art(**{'If-Modified-Since': older})
+        assert response.code == 200
+
+    def test_no_art(self):
+        os.unlink(os.path.join(self.root, 'Movie-poster.jpg'))
+        assert self.fetch_art().code == 404
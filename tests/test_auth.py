@@ -0,0 +1,112 @@
+import base64
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from vlchc import auth
+from vlchc import config
+from vlchc.auth import CredentialCache, basic_auth
+
+
+def basic(user, password):
+    return 'Basic ' + base64.b64encode(
+        '{}:{}'.format(user, password).encode('utf-8')).decode('ascii')
+
+
+def test_cache_hit(clock):
+    cache = CredentialCache(max_size=4, ttl=60)
+    assert cache.lookup(basic('', 'pw')) is None
+    cache.add(basic('', 'pw'), '')
+    assert cache.lookup(basic('', 'pw')) == ''
+    assert cache.lookup(basic('', 'other')) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cache_ttl(clock):
+    cache = CredentialCache(max_size=4, ttl=60)
+    cache.add(basic('', 'pw'), '')
+    clock.now += 59
+    assert cache.lookup(basic('', 'pw')) == ''
+    # a hit doesn't extend it
+    clock.now += 2
+    assert cache.lookup(basic('', 'pw')) is None
+    assert not cache._entries
+
+
+def test_cache_lru(clock):
+    cache = CredentialCache(max_size=2, ttl=60)
+    cache.add(basic('a', 'pw'), 'a')
+    cache.add(basic('b', 'pw'), 'b')
+    assert cache.lookup(basic('a', 'pw')) == 'a'
+    cache.add(basic('c', 'pw'), 'c')
+    assert cache.lookup(basic('b', 'pw')) is None
+    assert cache.lookup(basic('a', 'pw')) == 'a'
+    assert cache.lookup(basic('c', 'pw')) == 'c'
+
+
+class BasicAuthTest(AsyncHTTPTestCase):
+    def setUp(self):
+        self.checked = []
+        self.cache = CredentialCache(max_size=4, ttl=60)
+        super().setUp()
+
+    def get_app(self):
+        def auth_func(user, password):
+            self.checked.append(password)
+            return password == 'secret'
+
+        @basic_auth(auth_func=auth_func, cache=self.cache)
+        class Handler(tornado.web.RequestHandler):
+            def get(self):
+                self.write('ok')
+
+        return tornado.web.Application([(r'/', Handler)],
+                                       cookie_secret='test')
+
+    def get(self, **headers):
+        return self.fetch('/', headers=headers)
+
+    def session_cookie(self, response):
+        for cookie in response.headers.get_list('Set-Cookie'):
+            if cookie.startswith(auth.session_cookie_name + '='):
+                return cookie.split(';', 1)[0]
+        return None
+
+    def test_no_credentials(self):
+        response = self.get()
+        assert response.code == 401
+        assert 'WWW-Authenticate' in response.headers
+
+    def test_wrong_password(self):
+        assert self.get(Authorization=basic('', 'wrong')).code == 401
+        assert self.get(Authorization='Basic %%%').code == 401
+
+    def test_cached_credentials(self):
+        for i in range(3):
+            assert self.get(Authorization=basic('', 'secret')).code == 200
+        assert self.checked == ['secret']
+
+    def test_session_cookie(self):
+        response = self.get(Authorization=basic('', 'secret'))
+        cookie = self.session_cookie(response)
+        assert cookie is not None
+
+        self.cache.clear()
+        response = self.get(Cookie=cookie)
+        assert response.code == 200
+        assert response.body == b'ok'
+        # the cookie alone got in: no credentials were checked again
+        assert self.checked == ['secret']
+
+    def test_forged_cookie(self):
+        cookie = auth.session_cookie_name + '="2|1:0|10:0|4:Zm9v|0:|00"'
+        assert self.get(Cookie=cookie).code == 401
+
+    def test_sessions_disabled(self):
+        cookie = self.session_cookie(
+            self.get(Authorization=basic('', 'secret')))
+        saved, config.session_cookie = config.session_cookie, False
+        try:
+            assert self.get(Cookie=cookie).code == 401
+        finally:
+            config.session_cookie = saved
@@ -0,0 +1,86 @@
+import pytest
+from tornado import httpclient
+
+from vlchc.breaker import CircuitBreaker, CircuitOpen, is_outage
+
+
+def make_breaker():
+    return CircuitBreaker('test', max_failures=3, reset_timeout=1.0,
+                          max_reset_timeout=4.0)
+
+
+def trip(circuit):
+    for i in range(circuit.max_failures):
+        assert circuit.allow()
+        circuit.failure()
+
+
+def test_stays_closed_below_threshold(clock):
+    circuit = make_breaker()
+    assert not circuit.failure()
+    assert not circuit.failure()
+    assert circuit.closed
+    circuit.success()
+    # successes reset the count
+    assert not circuit.failure()
+    assert not circuit.failure()
+    assert circuit.closed
+
+
+def test_closed_open_half_open_closed(clock):
+    circuit = make_breaker()
+    trip(circuit)
+    assert circuit.state == 'open'
+    assert circuit.opened == 1
+
+    # fails fast until reset_timeout has passed
+    assert not circuit.allow()
+    with pytest.raises(CircuitOpen):
+        circuit.check()
+    assert circuit.rejected == 2
+    assert circuit.retry_in == 1.0
+
+    clock.now += 1.0
+    assert circuit.retry_in == 0.0
+    assert circuit.allow()
+    assert circuit.state == 'half_open'
+    # only the one probe goes out
+    assert not circuit.allow()
+
+    circuit.success()
+    assert circuit.closed
+    assert circuit.failures == 0
+    assert circuit.allow()
+
+
+def test_failed_probes_double_timeout(clock):
+    circuit = make_breaker()
+    trip(circuit)
+
+    for expected in (2.0, 4.0, 4.0):
+        clock.now += circuit.reset_timeout
+        assert circuit.allow()
+        assert circuit.failure()
+        assert circuit.state == 'open'
+        assert circuit.reset_timeout == expected
+        assert circuit.retry_in == expected
+        clock.now += expected - 0.5
+        assert not circuit.allow()
+        clock.now -= expected - 0.5
+
+    # recovering resets the timeout
+    clock.now += circuit.reset_timeout
+    assert circuit.allow()
+    circuit.success()
+    assert circuit.reset_timeout == 1.0
+    trip(circuit)
+    assert circuit.retry_in == 1.0
+
+
+def test_is_outage():
+    request = httpclient.HTTPRequest('http://localhost/')
+    assert is_outage(ConnectionRefusedError())
+    assert is_outage(httpclient.HTTPError(599))
+    assert not is_outage(httpclient.HTTPError(
+        404, response=httpclient.HTTPResponse(request, 404)))
+    assert not is_outage(ValueError())
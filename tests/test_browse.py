@@ -0,0 +1,95 @@
+import os
+import json
+import base64
+import shutil
+import tempfile
+import urllib.parse
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from vlchc import browse
+from vlchc import config
+from vlchc.server import VlcBrowseHandler
+
+
+class FakePoller:
+    mpc_status = {}
+
+
+class FakePlayer:
+    poller = FakePoller()
+
+
+def test_page_cursor():
+    listing = [{'name': name} for name in ('a', 'b', 'c', 'd', 'e')]
+    elements, cursor = browse.page(listing, limit=2)
+    assert elements == listing[:2]
+    elements, cursor = browse.page(listing, limit=2, cursor=cursor)
+    assert elements == listing[2:4]
+    elements, cursor = browse.page(listing, limit=2, cursor=cursor)
+    assert elements == listing[4:]
+    assert cursor is None
+
+
+def test_cursor_after_removed_name():
+    listing = [{'name': name} for name in ('a', 'c', 'd')]
+    # 'b' was the last name sent, and has since been deleted
+    elements, cursor = browse.page(listing, limit=1,
+                                   cursor=browse.encode_cursor('b'))
+    assert elements == [{'name': 'c'}]
+
+
+def test_cursor_round_trip():
+    for name in ('plain.mkv', 'ünïcode ☃.mp4', 'bad \udcff byte.avi'):
+        assert browse.decode_cursor(browse.encode_cursor(name)) == name
+
+
+class BrowseHandlerTest(AsyncHTTPTestCase):
+    names = ['{:02}.mkv'.format(i) for i in range(7)]
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in self.names:
+            open(os.path.join(self.root, name), 'w').close()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.root)
+        browse.cache.invalidate(self.root)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r'/browse.json', VlcBrowseHandler, dict(player=FakePlayer())),
+        ], cookie_secret='test')
+
+    def fetch_browse(self, **args):
+        args['uri'] = 'file:///' + self.root
+        auth = base64.b64encode(
+            ':{}'.format(config.vlc_password).encode('utf-8'))
+        return self.fetch('/browse.json?' + urllib.parse.urlencode(args),
+                          headers={'Authorization':
+                                   'Basic ' + auth.decode('ascii')})
+
+    def test_pages(self):
+        names = []
+        args = dict(limit=3, fields='name')
+        while True:
+            response = self.fetch_browse(**args)
+            assert response.code == 200
+            res = json.loads(response.body)
+            assert res['total'] == len(self.names)
+            names.extend(info['name'] for info in res['element'])
+            if 'next' not in res:
+                break
+            args['cursor'] = res['next']
+        assert names == self.names
+
+    def test_bad_cursor(self):
+        for cursor in ('%%%', 'abc', '☃'):
+            response = self.fetch_browse(limit=3, cursor=cursor)
+            assert response.code == 400, cursor
+
+    def test_bad_limit(self):
+        assert self.fetch_browse(limit='-1').code == 400
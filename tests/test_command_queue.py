@@ -0,0 +1,87 @@
+from tornado import gen
+from tornado.queues import QueueFull
+from tornado.concurrent import Future
+from tornado.testing import AsyncTestCase, gen_test
+
+from vlchc.command_queue import CommandQueue
+
+
+class FakeClient:
+    '''Records each request; the test answers them through the futures'''
+    base_url = 'http://fake/'
+
+    def __init__(self):
+        self.sent = []
+
+    def fetch(self, request):
+        future = Future()
+        self.sent.append((request, future))
+        return future
+
+    def requests(self):
+        return [request for request, future in self.sent]
+
+    def answer(self, i, response=None):
+        self.sent[i][1].set_result(response or self.sent[i][0])
+
+
+class CommandQueueTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = FakeClient()
+        self.queue = CommandQueue(self.client, max_pending=3, workers=1)
+
+    @gen.coroutine
+    def wait_sent(self, n):
+        while len(self.client.sent) < n:
+            yield gen.moment
+
+    @gen_test
+    def test_latest_wins(self):
+        first = self.queue.submit('volume=10', coalesce_key='volume')
+        second = self.queue.submit('volume=20', coalesce_key='volume')
+        assert first is second
+        assert self.queue.coalesced == 1
+
+        yield self.wait_sent(1)
+        self.client.answer(0)
+        assert (yield first) == 'volume=20'
+        assert self.client.requests() == ['volume=20']
+
+    @gen_test
+    def test_sent_key_not_coalesced(self):
+        first = self.queue.submit('volume=10', coalesce_key='volume')
+        yield self.wait_sent(1)
+        # already on its way: a new one is queued behind it
+        second = self.queue.submit('volume=20', coalesce_key='volume')
+        assert first is not second
+
+        self.client.answer(0)
+        yield self.wait_sent(2)
+        self.client.answer(1)
+        assert (yield first) == 'volume=10'
+        assert (yield second) == 'volume=20'
+
+    @gen_test
+    def test_commands_before_background(self):
+        polls = [self.queue.submit_background('poll{}'.format(i))
+                 for i in range(2)]
+        play = self.queue.submit('play')
+        seek = self.queue.submit('seek')
+
+        for i in range(4):
+            yield self.wait_sent(i + 1)
+            self.client.answer(i)
+        yield polls + [play, seek]
+        assert self.client.requests() == ['play', 'seek', 'poll0', 'poll1']
+
+    def test_full(self):
+        self.queue.submit('cmd0')
+        self.queue.submit('cmd1')
+        keyed = self.queue.submit('volume=10', coalesce_key='volume')
+        with self.assertRaises(QueueFull):
+            self.queue.submit('cmd3')
+        assert self.queue.dropped == 1
+        # replacing a queued command doesn't need room
+        assert self.queue.submit('volume=20', coalesce_key='volume') is keyed
+        assert self.queue.pending == 3
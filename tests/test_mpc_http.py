@@ -0,0 +1,77 @@
+import tornado.web
+from tornado import gen
+from tornado import httpclient
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from vlchc.mpc_http import MpcHttpClient
+
+
+class EchoHandler(tornado.web.RequestHandler):
+    def get(self):
+        if self.get_argument('close', None):
+            self.set_header('Connection', 'close')
+        self.write('get ' + self.get_argument('v', ''))
+
+    def post(self):
+        self.write(b'post ' + self.request.body)
+
+
+class MissingHandler(tornado.web.RequestHandler):
+    def get(self):
+        raise tornado.web.HTTPError(404)
+
+
+class KeepAliveTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([
+            (r'/echo', EchoHandler),
+            (r'/missing', MissingHandler),
+        ])
+
+    def get_httpserver_options(self):
+        return dict(idle_connection_timeout=0.05)
+
+    def setUp(self):
+        super().setUp()
+        self.client = MpcHttpClient('127.0.0.1', self.get_http_port())
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    def fetch_path(self, path, **kwargs):
+        return self.client.fetch(self.client.request(path, **kwargs))
+
+    @gen_test
+    def test_reuses_connection(self):
+        for i in range(3):
+            response = yield self.fetch_path('echo?v={}'.format(i))
+            self.assertEqual(response.body, 'get {}'.format(i).encode())
+        response = yield self.fetch_path('echo', method='POST', body='a=1')
+        self.assertEqual(response.body, b'post a=1')
+        self.assertEqual(self.client.client.opened, 1)
+
+    @gen_test
+    def test_reconnects_after_close(self):
+        yield self.fetch_path('echo?close=1')
+        response = yield self.fetch_path('echo?v=again')
+        self.assertEqual(response.body, b'get again')
+        self.assertEqual(self.client.client.opened, 2)
+
+    @gen_test
+    def test_error_status(self):
+        with self.assertRaises(httpclient.HTTPClientError) as cm:
+            yield self.fetch_path('missing')
+        self.assertEqual(cm.exception.code, 404)
+        # the connection is still good for the next request
+        yield self.fetch_path('echo')
+        self.assertEqual(self.client.client.opened, 1)
+
+    @gen_test
+    def test_idle_connection_dropped(self):
+        yield self.fetch_path('echo')
+        # the server times the idle connection out; the retry opens another
+        yield gen.sleep(0.2)
+        response = yield self.fetch_path('echo?v=again')
+        self.assertEqual(response.body, b'get again')
+        self.assertEqual(self.client.client.opened, 2)
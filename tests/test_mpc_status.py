@@ -0,0 +1,91 @@
+import pytest
+
+from vlchc import mpc_status
+from vlchc.mpc_status import (parse_status, parse_status_fast, mpc_to_vlc,
+                              update_vlc)
+
+
+def test_parse_playing(read_page):
+    status = parse_status(read_page('variables.html'))
+    assert status['file'] == 'The Movie (2015) [1080p].mkv'
+    assert status['filepath'] == (r'B:\movies\The Movie (2015)'
+                                  r'\The Movie (2015) [1080p].mkv')
+    assert status['state'] == 2
+    assert status['statestring'] == 'Playing'
+    assert status['position'] == 1234567
+    assert status['duration'] == 6937899
+    assert status['volumelevel'] == 80
+    assert status['muted'] is False
+    assert status['playbackrate'] == 1.0
+    assert isinstance(status['playbackrate'], float)
+    assert status['size'] == '4.32 GB'
+    assert status['version'] == '1.7.10.0'
+
+
+def test_parse_paused_unescapes(read_page):
+    status = parse_status(read_page('variables_paused.html'))
+    assert status['file'] == 'Tom & Jerry - 01 - Puss Gets the Boot.avi'
+    assert status['filedir'] == r'B:\tv\Tom & Jerry'
+    # arg fields stay url-encoded
+    assert status['filedirarg'] == 'B:%5ctv%5cTom%20%26%20Jerry'
+    assert status['muted'] is True
+    assert status['playbackrate'] == 1.5
+
+
+def test_parse_str_and_bytes_agree(read_page):
+    page = read_page('variables.html')
+    assert parse_status(page) == parse_status(page.decode('utf-8'))
+
+
+@pytest.mark.parametrize('name', ['variables.html', 'variables_paused.html'])
+def test_fast_parser_matches_lxml(name, read_page):
+    if mpc_status.lxml is None:
+        pytest.skip('lxml not installed')
+    page = read_page(name)
+    assert parse_status_fast(page) == mpc_status.parse_status_lxml(page)
+
+
+def test_missing_required_field(read_page):
+    page = read_page('variables.html').replace(
+        b'<p id="duration">6937899</p>', b'')
+    assert parse_status_fast(page) is None
+
+
+def test_bad_number(read_page):
+    page = read_page('variables.html').replace(
+        b'<p id="position">1234567</p>', b'<p id="position">soon</p>')
+    assert parse_status_fast(page) is None
+
+
+def test_unrecognized_page():
+    if mpc_status.lxml is not None:
+        pytest.skip('lxml parses anything')
+    with pytest.raises(ValueError):
+        parse_status(b'<html><body>nope</body></html>')
+
+
+def test_mpc_to_vlc(read_page):
+    status, playlist = mpc_to_vlc(parse_status(read_page('variables.html')))
+    assert status.state == 'playing'
+    assert status.volume == 0.8 * 512
+    assert status.time == 1234.567
+    assert status.length == 6937
+    assert status.position == pytest.approx(1234567 / 6937899)
+    assert status.rate == 1.0
+    assert playlist.name == 'The Movie (2015) [1080p].mkv'
+    assert playlist.duration == 6937
+
+
+def test_update_vlc_matches_full_translation(read_page):
+    old = parse_status(read_page('variables.html'))
+    new = parse_status(read_page('variables_paused.html'))
+    changed = {key for key in new if old.get(key) != new[key]}
+
+    status, playlist = mpc_to_vlc(old)
+    updated_status, updated_playlist = update_vlc(status, playlist, new,
+                                                  changed)
+    expected_status, expected_playlist = mpc_to_vlc(new)
+    assert updated_status.fields() == expected_status.fields()
+    assert updated_playlist.as_dict() == expected_playlist.as_dict()
+    # the originals are left alone
+    assert status.state == 'playing'
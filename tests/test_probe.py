@@ -0,0 +1,165 @@
+import struct
+
+import pytest
+
+from vlchc.probe import probe_file
+
+
+# matroska: just the header elements probe reads, then a cluster
+
+def _vint(n):
+    for length in range(1, 9):
+        if n < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | n).to_bytes(length, 'big')
+
+
+def element(element_id, payload):
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+    return id_bytes + _vint(len(payload)) + payload
+
+
+def uint(element_id, value, length=None):
+    if length is None:
+        length = max(1, (value.bit_length() + 7) // 8)
+    return element(element_id, value.to_bytes(length, 'big'))
+
+
+def string(element_id, value):
+    return element(element_id, value.encode('utf-8'))
+
+
+def double(element_id, value):
+    return element(element_id, struct.pack('>d', value))
+
+
+_unknown_size = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+mkv_info = element(0x1549A966, uint(0x2AD7B1, 1000000) +
+                   double(0x4489, 6937899.0) + string(0x7BA9, 'The Movie'))
+mkv_tracks = element(0x1654AE6B, b''.join([
+    element(0xAE, uint(0xD7, 1) + uint(0x83, 1) +
+            string(0x86, 'V_MPEG4/ISO/AVC') + uint(0x23E383, 41708333) +
+            element(0xE0, uint(0xB0, 1920) + uint(0xBA, 1040))),
+    element(0xAE, uint(0xD7, 2) + uint(0x83, 2) +
+            string(0x86, 'A_AAC/MPEG4/LC') + string(0x22B59C, 'jpn') +
+            element(0xE1, double(0xB5, 48000.0) + uint(0x9F, 6))),
+    element(0xAE, uint(0xD7, 3) + uint(0x83, 17) +
+            string(0x86, 'S_TEXT/UTF8') + string(0x536E, 'Signs')),
+]))
+
+
+def mkv(segment):
+    return (element(0x1A45DFA3, string(0x4282, 'matroska')) +
+            b'\x18\x53\x80\x67' + _unknown_size + segment)
+
+
+def mkv_tracks_first():
+    cluster = b'\x1f\x43\xb6\x75' + _unknown_size + bytes(1000)
+    return mkv(mkv_info + mkv_tracks + cluster)
+
+
+def mkv_tracks_last():
+    '''Tracks after the first cluster, found through the seek head'''
+    cluster = element(0x1F43B675, uint(0xE7, 0) + bytes(5000))
+
+    def seek_head(position):
+        return element(0x114D9B74, element(0x4DBB, uint(
+            0x53AB, 0x1654AE6B) + uint(0x53AC, position, 4)))
+
+    position = len(seek_head(0)) + len(mkv_info) + len(cluster)
+    return mkv(seek_head(position) + mkv_info + cluster + mkv_tracks)
+
+
+mkv_streams = [
+    {'Type': 'Video', 'Codec': 'H264 - MPEG-4 AVC (part 10) (avc1)',
+     'Resolution': '1920x1040', 'Display_resolution': '1920x1040',
+     'Frame_rate': '23.976024', 'Language': 'eng'},
+    {'Type': 'Audio', 'Codec': 'MPEG AAC Audio (mp4a)',
+     'Channels': '3F2R/LFE', 'Sample_rate': '48000 Hz', 'Language': 'jpn'},
+    {'Type': 'Subtitle', 'Codec': 'Text subtitles with various tags (subt)',
+     'Language': 'eng', 'Description': 'Signs'},
+]
+
+
+# mp4: moov after a big mdat, as most encoders write it
+
+def atom(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def _language(code):
+    packed = 0
+    for c in code:
+        packed = (packed << 5) | (ord(c) - 0x60)
+    return packed
+
+
+def _mp4_track(handler, timescale, language, sample_entry, extra=b'',
+               header=b''):
+    mdhd = atom(b'mdhd', bytes(4) + struct.pack('>IIII', 0, 0, timescale, 0) +
+                struct.pack('>HH', _language(language), 0))
+    hdlr = atom(b'hdlr', bytes(8) + handler + bytes(13))
+    stsd = atom(b'stsd', bytes(4) + struct.pack('>I', 1) + sample_entry)
+    stbl = atom(b'stbl', stsd + extra)
+    return atom(b'trak', header +
+                atom(b'mdia', mdhd + hdlr + atom(b'minf', stbl)))
+
+
+def mp4():
+    ftyp = atom(b'ftyp', b'isom\0\0\2\0isomavc1')
+    mvhd = atom(b'mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, 6937899) +
+                bytes(80))
+    tkhd = atom(b'tkhd', b'\0\0\0\x07' + bytes(72) +
+                struct.pack('>II', 1920 << 16, 800 << 16))
+    avc1 = (struct.pack('>I4s', 86, b'avc1') + bytes(6) + b'\0\1' +
+            bytes(16) + struct.pack('>HH', 1920, 800) + bytes(50))
+    stts = atom(b'stts', bytes(4) + struct.pack('>III', 1, 1000, 1001))
+    video = _mp4_track(b'vide', 24000, 'eng', avc1, stts, tkhd)
+    mp4a = (struct.pack('>I4s', 36, b'mp4a') + bytes(6) + b'\0\1' +
+            bytes(8) + struct.pack('>HHHHI', 2, 16, 0, 0, 48000 << 16))
+    audio = _mp4_track(b'soun', 48000, 'und', mp4a)
+    return (ftyp + atom(b'mdat', bytes(100000)) +
+            atom(b'moov', mvhd + video + audio))
+
+
+mp4_streams = [
+    {'Type': 'Video', 'Codec': 'H264 - MPEG-4 AVC (part 10) (avc1)',
+     'Resolution': '1920x800', 'Display_resolution': '1920x800',
+     'Frame_rate': '23.976024', 'Language': 'eng'},
+    {'Type': 'Audio', 'Codec': 'MPEG AAC Audio (mp4a)', 'Channels': 'Stereo',
+     'Sample_rate': '48000 Hz', 'Bits_per_sample': '16'},
+]
+
+
+@pytest.fixture
+def media_file(tmp_path):
+    def write(name, data):
+        path = tmp_path / name
+        path.write_bytes(data)
+        return str(path)
+
+    return write
+
+
+@pytest.mark.parametrize('build', [mkv_tracks_first, mkv_tracks_last])
+def test_mkv(media_file, build):
+    result = probe_file(media_file('movie.mkv', build()))
+    assert result == {'streams': mkv_streams, 'duration': 6937.899,
+                      'title': 'The Movie'}
+
+
+def test_mp4(media_file):
+    result = probe_file(media_file('movie.mp4', mp4()))
+    assert result == {'streams': mp4_streams, 'duration': 6937.899}
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'', None),
+    (b'not a media file at all', None),
+    # the segment is cut off before info and tracks
+    (mkv_tracks_first()[:40], {'streams': []}),
+    # no moov
+    (mp4()[:20], None),
+])
+def test_unknown_or_truncated(media_file, data, expected):
+    assert probe_file(media_file('movie.bin', data)) == expected
@@ -0,0 +1,67 @@
+import copy
+
+import pytest
+
+from vlchc.push import merge_patch
+from vlchc.mpc_status import parse_status, mpc_to_vlc
+
+
+def apply_patch(target, patch):
+    '''RFC 7396 MergePatch, applied to a copy of target'''
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = apply_patch(result.get(key), value)
+    return result
+
+
+@pytest.mark.parametrize('old, new', [
+    ({}, {}),
+    ({'a': 1}, {'a': 1}),
+    ({'a': 1}, {'a': 2}),
+    ({'a': 1}, {'b': 2}),
+    ({'a': 1, 'b': 2}, {}),
+    ({}, {'a': {'b': [1, 2]}}),
+    ({'a': {'b': 1, 'c': 2}}, {'a': {'b': 1, 'c': 3}}),
+    ({'a': {'b': 1}}, {'a': {'c': {'d': 'e'}}}),
+    ({'a': {'b': 1}}, {'a': 'flat'}),
+    ({'a': 'flat'}, {'a': {'b': 1}}),
+    ({'a': [1, 2]}, {'a': [2, 1]}),
+    ({'a': 1.0, 's': 'x'}, {'a': 1.5, 's': 'y'}),
+])
+def test_round_trip(old, new):
+    original = copy.deepcopy(old)
+    patch = merge_patch(old, new)
+    assert apply_patch(old, patch) == new
+    assert old == original
+
+
+def test_unchanged_is_empty():
+    old = {'a': 1, 'b': {'c': [1, 2]}}
+    assert merge_patch(old, copy.deepcopy(old)) == {}
+
+
+def test_only_changes_sent():
+    old = {'a': 1, 'b': {'c': 1, 'd': 2}, 'e': 3}
+    new = {'a': 1, 'b': {'c': 1, 'd': 5}}
+    assert merge_patch(old, new) == {'b': {'d': 5}, 'e': None}
+
+
+def test_shared_sections_skipped_by_identity():
+    shared = {'big': list(range(10))}
+    assert merge_patch({'info': shared}, {'info': shared}) == {}
+
+
+def test_status_round_trip(read_page):
+    old_status, old_playlist = mpc_to_vlc(
+        parse_status(read_page('variables.html')))
+    new_status, new_playlist = mpc_to_vlc(
+        parse_status(read_page('variables_paused.html')))
+
+    for old, new in [(old_status.fields(), new_status.fields()),
+                     (old_playlist.as_dict(), new_playlist.as_dict())]:
+        assert apply_patch(old, merge_patch(old, new)) == new
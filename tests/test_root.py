@@ -0,0 +1,35 @@
+import base64
+import tempfile
+from unittest import mock
+
+import tornado.web
+from tornado.testing import AsyncHTTPTestCase
+
+from vlchc import config
+from vlchc import server
+from vlchc.static_cache import StaticAssetCache
+
+
+class RootHandlerTest(AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application([
+            (r'/.*', server.RootHandler),
+        ], cookie_secret='test')
+
+    def fetch_root(self):
+        auth = base64.b64encode(
+            ':{}'.format(config.vlc_password).encode('utf-8'))
+        return self.fetch('/', headers={
+            'Authorization': 'Basic ' + auth.decode('ascii')})
+
+    def test_index(self):
+        response = self.fetch_root()
+        assert response.code == 200
+        assert response.headers['Content-Type'].startswith('text/html')
+
+    def test_missing_index(self):
+        with tempfile.TemporaryDirectory() as root:
+            with mock.patch.object(server, 'static_assets',
+                                   StaticAssetCache(root)):
+                response = self.fetch_root()
+        assert response.code == 404
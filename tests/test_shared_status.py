@@ -0,0 +1,123 @@
+import os
+import mmap
+import time
+import struct
+import multiprocessing
+
+import pytest
+
+from vlchc import multiprocess
+from vlchc.multiprocess import SharedStatus
+
+
+# status, playlist and mpc_status for version n are _snapshots[n % 5]; the
+# lengths differ too, so parts of two versions can't line up
+_snapshots = [(kind * 4000 * (1 + i % 3), kind * 3000 * (1 + i % 2),
+               kind * 10)
+              for i, kind in enumerate((b'a', b'b', b'c', b'd', b'e'))]
+
+
+def snapshot(version):
+    return _snapshots[version % len(_snapshots)]
+
+
+def test_round_trip():
+    segment = SharedStatus(1 << 20)
+    assert segment.read() is None
+
+    assert segment.publish(1, *snapshot(1))
+    assert segment.read() == (1, ) + snapshot(1)
+    assert segment.read(known_version=1) is None
+    assert segment.version == 1
+
+    assert segment.publish(2, *snapshot(2))
+    assert segment.read(known_version=1) == (2, ) + snapshot(2)
+
+
+def test_too_large():
+    segment = SharedStatus(128)
+    assert segment.publish(1, b'{}', b'{}', b'{}')
+    assert not segment.publish(2, b'x' * 100, b'{}', b'{}')
+    # the last one that fit is still there
+    assert segment.read() == (1, b'{}', b'{}', b'{}')
+
+
+class RacingMap(mmap.mmap):
+    '''mmap that runs before_copy() ahead of its next slice copy, as if a
+    writer had got in after the reader looked at the header'''
+    before_copy = None
+
+    def __getitem__(self, key):
+        before_copy, self.before_copy = self.before_copy, None
+        if before_copy is not None:
+            before_copy()
+        return super().__getitem__(key)
+
+
+def racing_segment():
+    segment = SharedStatus(1 << 20)
+    segment.mm = RacingMap(-1, segment.size)
+    return segment
+
+
+def test_read_retries_after_write():
+    segment = racing_segment()
+    segment.publish(1, *snapshot(1))
+    segment.mm.before_copy = lambda: segment.publish(2, *snapshot(2))
+    assert segment.read() == (2, ) + snapshot(2)
+
+
+def test_read_waits_out_write(monkeypatch):
+    segment = racing_segment()
+    segment.publish(1, *snapshot(1))
+    # a write in progress: odd sequence number, half-copied data
+    seq = struct.unpack_from('<Q', segment.mm, 0)[0]
+    struct.pack_into('<Q', segment.mm, 0, seq + 1)
+    segment.mm[64:64 + 10] = b'x' * 10
+
+    waits = []
+
+    def sleep(seconds):
+        # the writer finishes while the reader waits
+        waits.append(seconds)
+        struct.pack_into('<Q', segment.mm, 0, seq)
+        segment.publish(2, *snapshot(2))
+
+    monkeypatch.setattr(multiprocess.time, 'sleep', sleep)
+    assert segment.read() == (2, ) + snapshot(2)
+    assert waits == [0]
+
+
+def _publish_until(segment, stop):
+    version = 0
+    while not stop.is_set():
+        for i in range(100):
+            version += 1
+            segment.publish(version, *snapshot(version))
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_concurrent_reads():
+    context = multiprocessing.get_context('fork')
+    segment = SharedStatus(1 << 20)
+    stop = context.Event()
+    writer = context.Process(target=_publish_until, args=(segment, stop))
+    writer.start()
+    try:
+        reads = 0
+        last = None
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            read = segment.read(known_version=last)
+            if read is None:
+                continue
+            version, status, playlist, mpc_status = read
+            assert (status, playlist, mpc_status) == snapshot(version)
+            assert last is None or version > last
+            last = version
+            reads += 1
+    finally:
+        stop.set()
+        writer.join(10)
+    assert writer.exitcode == 0
+    assert reads > 1
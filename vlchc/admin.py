@@ -0,0 +1,149 @@
+'''/admin/ handlers: sampling profiler, tracemalloc and request tracing
+
+    POST /admin/profile/start[?interval=0.005]   POST /admin/profile/stop
+    GET  /admin/profile                (collapsed stacks, for flamegraphs)
+    POST /admin/tracemalloc/start[?frames=10]    POST /admin/tracemalloc/stop
+    POST /admin/tracemalloc/snapshot   (top allocations, and the diff
+                                        against the previous snapshot)
+    GET  /admin/tracemalloc[?first=0&second=1&limit=20]
+    GET|POST /admin/trace[?enable=1]
+
+Only routed when config.admin_password is set.  Admin credentials are
+checked on every request: no session cookie, and a cache of their own so
+the vlc password can't stand in for the admin one.
+'''
+import hmac
+import time
+import logging
+
+import tornado.web
+
+from .auth import basic_auth, CredentialCache
+from .encoding import dumps
+from .profiling import profiler, memory
+from . import tracing
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def admin_auth_func(user, password):
+    if config.admin_password is None:
+        return False
+    return hmac.compare_digest(password.encode('utf-8'),
+                               config.admin_password.encode('utf-8'))
+
+
+def admin_handler(handler_class):
+    return basic_auth(auth_func=admin_auth_func, realm='vlchc-admin',
+                      cache=CredentialCache(), sessions=False)(handler_class)
+
+
+class AdminHandler(tornado.web.RequestHandler):
+    def json(self, res):
+        self.set_header("Content-Type", "text/json;charset=UTF-8")
+        self.set_header("Cache-Control", "no-store")
+        self.write(dumps(res))
+
+    def _float_argument(self, name, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, '%s must be a number', name)
+
+
+@admin_handler
+class ProfileHandler(AdminHandler):
+    def get(self, action=None):
+        if action is not None:
+            raise tornado.web.HTTPError(405)
+        filename = 'vlchc-{}.collapsed'.format(
+            time.strftime('%Y%m%d-%H%M%S'))
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.set_header("Content-Disposition",
+                        'attachment; filename="{}"'.format(filename))
+        self.write(profiler.collapsed())
+
+    def post(self, action=None):
+        if action == 'start':
+            interval = self._float_argument('interval')
+            if interval is not None and interval <= 0:
+                raise tornado.web.HTTPError(400, 'interval must be > 0')
+            changed = profiler.start(interval)
+        elif action == 'stop':
+            changed = profiler.stop()
+        else:
+            raise tornado.web.HTTPError(404)
+        self.json(dict(profiler.stats(), changed=changed))
+
+
+@admin_handler
+class TracemallocHandler(AdminHandler):
+    def get(self, action=None):
+        if action is not None:
+            raise tornado.web.HTTPError(405)
+
+        res = memory.stats()
+        first = self.get_argument('first', None)
+        second = self.get_argument('second', None)
+        limit = int(self._float_argument('limit', 20))
+        try:
+            if first is not None and second is not None:
+                res['diff'] = memory.diff(int(first), int(second),
+                                          limit=limit)
+            elif first is not None:
+                res['top'] = memory.top(int(first), limit=limit)
+        except (KeyError, ValueError):
+            raise tornado.web.HTTPError(404, 'no such snapshot')
+        self.json(res)
+
+    def post(self, action=None):
+        res = {}
+        if action == 'start':
+            frames = self._float_argument('frames')
+            res['changed'] = memory.start(
+                None if frames is None else max(1, int(frames)))
+        elif action == 'stop':
+            res['changed'] = memory.stop()
+        elif action == 'snapshot':
+            if not memory.tracing:
+                raise tornado.web.HTTPError(409, 'tracemalloc not started')
+            previous = next(reversed(memory.snapshots), None)
+            snapshot_id = memory.snapshot()
+            res['snapshot'] = snapshot_id
+            res['top'] = memory.top(snapshot_id)
+            if previous is not None:
+                res['diff'] = memory.diff(previous, snapshot_id)
+        else:
+            raise tornado.web.HTTPError(404)
+        res.update(memory.stats())
+        self.json(res)
+
+
+@admin_handler
+class TraceHandler(AdminHandler):
+    def get(self):
+        self.json({'enabled': tracing.enabled})
+
+    def post(self):
+        enable = self.get_argument('enable', None)
+        if enable is not None:
+            tracing.set_enabled(enable.lower() in ('1', 'true', 'on', 'yes'))
+            logger.info('Request tracing %s',
+                        'enabled' if tracing.enabled else 'disabled')
+        self.json({'enabled': tracing.enabled})
+
+
+def admin_routes():
+    if config.admin_password is None:
+        return []
+    return [
+        (r"/admin/profile(?:/(start|stop))?", ProfileHandler),
+        (r"/admin/tracemalloc(?:/(start|stop|snapshot))?",
+         TracemallocHandler),
+        (r"/admin/trace", TraceHandler),
+    ]
@@ -0,0 +1,156 @@
+'''Cover art for the playing file: an image next to it, found by name and
+kept in a byte-bounded LRU so every remote showing it shares one read'''
+import os
+import hashlib
+import logging
+import threading
+import collections
+
+from . import metrics
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def _candidates(filepath):
+    '''Image names to look for next to filepath, best first (lowercase)'''
+    stem = os.path.splitext(os.path.basename(filepath))[0].lower()
+    names = [stem, stem + '-poster', stem + '-cover', stem + '-fanart']
+    names.extend(config.art_names)
+    return [name + ext for name in names for ext in config.art_extensions]
+
+
+class ArtFinder:
+    '''filepath -> image path, remembered until the directory changes'''
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._found = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def find(self, filepath):
+        directory = os.path.dirname(filepath)
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._lock:
+            found = self._found.get(filepath)
+            if found is not None and found[0] == dir_mtime:
+                self._found.move_to_end(filepath)
+                return found[1]
+
+        try:
+            with os.scandir(directory) as it:
+                names = {entry.name.lower(): entry.path for entry in it
+                         if entry.is_file()}
+        except OSError:
+            return None
+
+        art_path = next((names[name] for name in _candidates(filepath)
+                         if name in names), None)
+        with self._lock:
+            self._found[filepath] = (dir_mtime, art_path)
+            self._found.move_to_end(filepath)
+            while len(self._found) > self.max_entries:
+                self._found.popitem(last=False)
+        return art_path
+
+
+_Image = collections.namedtuple('_Image', 'path size mtime_ns data etag')
+
+
+class ArtCache:
+    '''Image bytes by path, least recently used dropped past max_bytes
+
+    An entry is reused while the file's mtime matches; images bigger than
+    max_item_bytes aren't kept (they're read from disk each time).
+    '''
+
+    def __init__(self, *, max_bytes=None, max_item_bytes=None):
+        if max_bytes is None:
+            max_bytes = config.art_cache_bytes
+        if max_item_bytes is None:
+            max_item_bytes = config.art_max_item_bytes
+
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        '''_Image for path (data is None if too big to cache), or None if
+        it can't be read'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.invalidate(path)
+            return None
+
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None and image.mtime_ns == st.st_mtime_ns:
+                self._images.move_to_end(path)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        if st.st_size > self.max_item_bytes:
+            etag = '"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size)
+            return _Image(path, st.st_size, st.st_mtime_ns, None, etag)
+
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.invalidate(path)
+            return None
+
+        image = _Image(path, len(data), st.st_mtime_ns, data,
+                       '"{}"'.format(hashlib.sha1(data).hexdigest()))
+        with self._lock:
+            old = self._images.pop(path, None)
+            if old is not None:
+                self.size -= len(old.data)
+            self._images[path] = image
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, dropped = self._images.popitem(last=False)
+                self.size -= len(dropped.data)
+        return image
+
+    def invalidate(self, path):
+        with self._lock:
+            image = self._images.pop(path, None)
+            if image is not None:
+                self.size -= len(image.data)
+
+    def stats(self):
+        return dict(images=len(self._images), size=self.size,
+                    hits=self.hits, misses=self.misses)
+
+
+finder = ArtFinder()
+cache = ArtCache()
+
+
+def lookup(filepath):
+    '''The cover art _Image for filepath, or None (blocking; these stat and
+    read the media's disk, so run them on an executor)'''
+    art_path = finder.find(filepath)
+    if art_path is None:
+        return None
+    return cache.get(art_path)
+
+
+metrics.Callback('vlchc_art_cache_hits_total', 'Cover art served from memory',
+                 lambda: {(): cache.hits}, type_name='counter')
+metrics.Callback('vlchc_art_cache_misses_total', 'Cover art read from disk',
+                 lambda: {(): cache.misses}, type_name='counter')
+metrics.Callback('vlchc_art_cache_bytes', 'Size of the cached cover art',
+                 lambda: {(): cache.size})
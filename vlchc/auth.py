@@ -1,10 +1,23 @@
 # https://gist.github.com/kelleyk/1073682
+import os
+import hmac
+import time
 import base64
+import hashlib
 import logging
+import threading
+import collections
+
+from tornado.concurrent import Future
+
+from . import config
+from . import tracing
 
 
 logger = logging.getLogger(__name__)
 
+session_cookie_name = 'vlchc_session'
+
 
 def after_login(*args, **kwargs):
     pass
@@ -18,28 +31,148 @@ def create_auth_header(handler, realm):
     handler.finish()
 
 
+class CredentialCache:
+    '''Recently verified Authorization headers, so repeat requests skip
+    decoding and checking them
+
+    Only a digest of each header is kept.  Entries expire after ttl seconds
+    and the least recently used are dropped past max_size.
+    '''
+
+    def __init__(self, *, max_size=None, ttl=None):
+        if max_size is None:
+            max_size = config.auth_cache_size
+        if ttl is None:
+            ttl = config.auth_cache_ttl
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(auth_header):
+        return hashlib.sha256(auth_header.encode('utf-8')).digest()
+
+    def lookup(self, auth_header):
+        '''User name if auth_header was verified recently, else None'''
+        digest = self._digest(auth_header)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                stored_digest, user, expires = entry
+                if (expires > time.monotonic() and
+                        hmac.compare_digest(stored_digest, digest)):
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return user
+                del self._entries[digest]
+            self.misses += 1
+        return None
+
+    def add(self, auth_header, user):
+        digest = self._digest(auth_header)
+        with self._lock:
+            self._entries[digest] = (digest, user,
+                                     time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache()
+
+
+def session_secret():
+    '''config.cookie_secret, or a random one; pick it once and share it
+    between every app (and process) that should accept the same sessions'''
+    if config.cookie_secret is not None:
+        return config.cookie_secret
+    # sessions only last as long as the server
+    return os.urandom(32).hex()
+
+
+def _session_user(handler):
+    if not config.session_cookie or 'cookie_secret' not in handler.settings:
+        return None
+
+    user = handler.get_secure_cookie(session_cookie_name,
+                                     max_age_days=config.session_max_age_days)
+    return None if user is None else user.decode('utf-8')
+
+
+def _start_session(handler, user):
+    if config.session_cookie and 'cookie_secret' in handler.settings:
+        handler.set_secure_cookie(session_cookie_name, user,
+                                  expires_days=config.session_max_age_days,
+                                  httponly=True)
+
+
+def _check_basic_auth(auth_header, auth_func):
+    '''(user, password) if the Basic auth header checks out, else None'''
+    try:
+        auth_bytes = auth_header[6:].encode('ascii')
+        auth_decoded_bytes = base64.decodebytes(auth_bytes)
+        auth_decoded = auth_decoded_bytes.decode('utf-8')
+        user, pwd = auth_decoded.split(':', 1)
+    except (ValueError, UnicodeError):
+        return None
+
+    if auth_func(user, pwd):
+        return user, pwd
+    return None
+
+
+def _done():
+    future = Future()
+    future.set_result(None)
+    return future
+
+
 def basic_auth(auth_func=lambda *args, **kwargs: True,
-               after_login_func=after_login, realm='Restricted'):
+               after_login_func=after_login, realm='Restricted',
+               cache=credential_cache, sessions=True):
     def basic_auth_decorator(handler_class):
         def wrap_execute(handler_execute):
             def require_basic_auth(handler, kwargs):
+                '''True if the request may go ahead'''
+                if sessions and _session_user(handler) is not None:
+                    return True
+
                 auth_header = handler.request.headers.get('Authorization')
 
                 if auth_header is None or not auth_header.startswith('Basic '):
                     create_auth_header(handler, realm)
-                else:
-                    auth_bytes = auth_header[6:].encode('ascii')
-                    auth_decoded_bytes = base64.decodebytes(auth_bytes)
-                    auth_decoded = auth_decoded_bytes.decode('ascii')
-                    user, pwd = auth_decoded.split(':', 2)
+                    return False
+
+                if cache is not None and cache.lookup(auth_header) is not None:
+                    return True
+
+                credentials = _check_basic_auth(auth_header, auth_func)
+                if credentials is None:
+                    create_auth_header(handler, realm)
+                    return False
 
-                    if auth_func(user, pwd):
-                        after_login_func(handler, kwargs, user, pwd)
-                    else:
-                        create_auth_header(handler, realm)
+                user, pwd = credentials
+                if cache is not None:
+                    cache.add(auth_header, user)
+                if sessions:
+                    _start_session(handler, user)
+                after_login_func(handler, kwargs, user, pwd)
+                return True
 
             def _execute(self, transforms, *args, **kwargs):
-                require_basic_auth(self, kwargs)
+                trace = tracing.start(self)
+                with tracing.span(trace, 'auth'):
+                    allowed = require_basic_auth(self, kwargs)
+                if not allowed:
+                    return _done()
                 return handler_execute(self, transforms, *args, **kwargs)
 
             return _execute
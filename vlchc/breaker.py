@@ -0,0 +1,113 @@
+import time
+import logging
+
+from tornado import httpclient
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    '''mpc-hc is considered down; the request wasn't sent'''
+
+
+def is_outage(ex):
+    '''Whether ex means mpc-hc couldn't be reached (rather than answering
+    with an error)'''
+    if isinstance(ex, httpclient.HTTPError):
+        # 599: timeouts, or the connection dropped before a response
+        return ex.code == 599
+    # refused connections and the like
+    return isinstance(ex, OSError)
+
+
+class CircuitBreaker:
+    '''Stops sending requests to an mpc-hc that isn't answering
+
+    closed: requests go through; max_failures outages in a row open it.
+    open: requests fail at once with CircuitOpen.  After reset_timeout
+    seconds one request is let through as a probe (half_open).
+    half_open: other requests still fail at once; the probe succeeding
+    closes the circuit, failing re-opens it with reset_timeout doubled (up
+    to max_reset_timeout).
+    '''
+
+    def __init__(self, name, *, max_failures=None, reset_timeout=None,
+                 max_reset_timeout=None):
+        if max_failures is None:
+            max_failures = config.breaker_failures
+        if reset_timeout is None:
+            reset_timeout = config.breaker_reset_timeout
+        if max_reset_timeout is None:
+            max_reset_timeout = config.breaker_reset_max
+
+        self.name = name
+        self.max_failures = max_failures
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+
+        # metrics
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def closed(self):
+        return self.state == 'closed'
+
+    @property
+    def retry_in(self):
+        '''Seconds until a request may be sent (0.0 if one may be now)'''
+        if self.state == 'closed':
+            return 0.0
+        if self.state == 'half_open':
+            # a probe is out; it'll be done within a request timeout
+            return self.reset_timeout
+        return max(0.0, self.opened_at + self.reset_timeout -
+                   time.monotonic())
+
+    def allow(self):
+        '''Whether a request may be sent now (counts it as the probe if
+        the circuit is due one)'''
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and self.retry_in == 0.0:
+            self.state = 'half_open'
+            logger.info('%s: sending a probe request', self.name)
+            return True
+        self.rejected += 1
+        return False
+
+    def check(self):
+        '''Raise CircuitOpen unless a request may be sent now'''
+        if not self.allow():
+            raise CircuitOpen('{} is unreachable; retrying in {:.1f}s'
+                              ''.format(self.name, self.retry_in))
+
+    def success(self):
+        if self.state != 'closed':
+            logger.info('%s: reachable again; circuit closed', self.name)
+        self.state = 'closed'
+        self.failures = 0
+        self.reset_timeout = self.base_reset_timeout
+
+    def failure(self):
+        '''Record an outage; returns True if that opened the circuit'''
+        self.failures += 1
+        if self.state == 'half_open':
+            self.reset_timeout = min(2 * self.reset_timeout,
+                                     self.max_reset_timeout)
+        elif self.state == 'open' or self.failures < self.max_failures:
+            return False
+
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.opened += 1
+        logger.warning('%s: %d failed requests in a row; circuit open for '
+                       '%.1fs', self.name, self.failures, self.reset_timeout)
+        return True
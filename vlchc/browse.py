@@ -0,0 +1,333 @@
+import os
+import sys
+import stat
+import base64
+import bisect
+import logging
+import pathlib
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop
+
+from . import config
+from . import metrics
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+logger = logging.getLogger(__name__)
+
+# directory listing touches the disk (or a network share), so it happens
+# here instead of on the ioloop
+executor = ThreadPoolExecutor(max_workers=config.browse_workers)
+
+# fields that need a stat() of each entry
+stat_fields = ('access_time', 'creation_time', 'modification_time', 'uid',
+               'gid', 'mode', 'size')
+all_fields = ('type', 'path', 'name', 'uri') + stat_fields
+
+
+def parse_fields(arg):
+    '''Comma-separated browse.json `fields` argument -> field names'''
+    if not arg:
+        return all_fields
+    fields = tuple(field for field in arg.split(',') if field in all_fields)
+    return fields or all_fields
+
+
+def _info(path, name, is_dir, st, fields):
+    info = {'type': 'dir' if is_dir else 'file',
+            'path': path,
+            'name': name,
+            }
+
+    if 'uri' in fields:
+        info['uri'] = pathlib.Path(path).as_uri()
+
+    if st is not None:
+        info.update(access_time=st.st_atime,
+                    creation_time=st.st_ctime,
+                    modification_time=st.st_mtime,
+                    uid=st.st_uid,
+                    gid=st.st_gid,
+                    mode=st.st_mode,
+                    size=st.st_size,
+                    )
+
+    if len(info) != len(fields):
+        info = {key: info[key] for key in fields}
+    return info
+
+
+def get_file_info(fn, fields=all_fields):
+    try:
+        st = os.stat(fn)
+    except Exception:
+        return None
+
+    name = os.path.split(fn)[1]
+    if not name:
+        name = fn
+
+    return _info(os.path.abspath(fn), name, stat.S_ISDIR(st.st_mode), st,
+                 fields)
+
+
+def entry_info(entry, fields=all_fields):
+    '''get_file_info for an os.DirEntry, using what scandir already knows'''
+    try:
+        is_dir = entry.is_dir()
+        st = entry.stat() if not set(fields).isdisjoint(stat_fields) else None
+    except OSError:
+        return None
+
+    return _info(os.path.abspath(entry.path), entry.name, is_dir, st, fields)
+
+
+def _scan_directory(path, fields):
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    return [entry_info(entry, fields) for entry in entries]
+
+
+def _listing_size(listing):
+    '''Rough number of bytes a cached listing holds on to'''
+    size = sys.getsizeof(listing)
+    for info in listing:
+        if info is not None:
+            size += sys.getsizeof(info)
+            size += sum(sys.getsizeof(value) for value in info.values())
+    return size
+
+
+_CacheEntry = collections.namedtuple('_CacheEntry', 'mtime listing size')
+
+
+class DirectoryCache:
+    '''LRU cache of directory listings, bounded by (estimated) memory use
+
+    A listing is reused until the directory's mtime changes.  That catches
+    files being added, removed or renamed, but not a file's own size/times
+    changing; on Linux, with inotify_simple installed, watching the cached
+    directories catches those too.
+    '''
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = config.browse_cache_bytes
+
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._inotify = None
+        self._watches = {}
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    entries=len(self._entries), size=self.size,
+                    max_bytes=self.max_bytes)
+
+    def lookup(self, path, fields, list_func=_scan_directory):
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, fields)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.mtime == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.listing
+            self.misses += 1
+
+        listing = list_func(path, fields)
+        self._store(key, _CacheEntry(mtime, listing, _listing_size(listing)))
+        return listing
+
+    def invalidate(self, path):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _store(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            self._watch(key[0])
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        path = key[0]
+        if not any(other[0] == path for other in self._entries):
+            self._unwatch(path)
+
+    def start_watching(self, io_loop=None):
+        '''Invalidate cached listings on inotify events, if available'''
+        if inotify_simple is None or not config.browse_inotify:
+            return False
+
+        if io_loop is None:
+            io_loop = IOLoop.current()
+
+        self._inotify = inotify_simple.INotify()
+        io_loop.add_handler(self._inotify.fileno(), self._inotify_events,
+                            IOLoop.READ)
+        logger.debug('Watching cached directories with inotify')
+        return True
+
+    def _watch(self, path):
+        if self._inotify is None or path in self._watches:
+            return
+
+        flags = inotify_simple.flags
+        mask = (flags.CREATE | flags.DELETE | flags.MOVED_FROM |
+                flags.MOVED_TO | flags.MODIFY | flags.ATTRIB |
+                flags.DELETE_SELF | flags.MOVE_SELF)
+        try:
+            self._watches[path] = self._inotify.add_watch(path, mask)
+        except OSError as ex:
+            logger.debug('Unable to watch %s: %s', path, ex)
+
+    def _unwatch(self, path):
+        wd = self._watches.pop(path, None)
+        if wd is not None:
+            try:
+                self._inotify.rm_watch(wd)
+            except OSError:
+                # already gone along with the directory
+                pass
+
+    def _inotify_events(self, fd, events):
+        with self._lock:
+            paths = {wd: path for path, wd in self._watches.items()}
+        for event in self._inotify.read(timeout=0):
+            path = paths.get(event.wd)
+            if path is not None:
+                self.invalidate(path)
+
+
+cache = DirectoryCache()
+
+metrics.Callback('vlchc_browse_cache_hits_total', 'Listings served from cache',
+                 lambda: {(): cache.hits}, type_name='counter')
+metrics.Callback('vlchc_browse_cache_misses_total', 'Listings read from disk',
+                 lambda: {(): cache.misses}, type_name='counter')
+metrics.Callback('vlchc_browse_cache_bytes', 'Estimated size of the cache',
+                 lambda: {(): cache.size})
+
+
+def list_directory(path, fields=all_fields):
+    return cache.lookup(path, fields)
+
+
+def _resolve_path(local_path):
+    '''Directory to list, or None for "list the drives"'''
+    if local_path in ('c:/..', 'Volumes', 'media'):
+        if sys.platform in ('win32', ):
+            return None
+
+        local_path = '/'
+
+    logger.debug('local path is %r', local_path)
+
+    if not os.path.exists(local_path):
+        logger.info("Path %r doesn't exist, using default", local_path)
+        local_path = config.default_path
+
+    return local_path
+
+
+def _list_drives(fields):
+    drives = ['{}:/'.format(letter) for letter in
+              'ABCDEFGHIJKLMNOPQRSTUVWXYZ']
+    return [get_file_info(drive, fields) for drive in drives]
+
+
+def path_list(local_path, fields=all_fields):
+    '''File info for everything in local_path (run this in `executor`)'''
+    local_path = _resolve_path(local_path)
+    if local_path is None:
+        return _list_drives(fields)
+    return list_directory(local_path, fields)
+
+
+def iter_path_list(local_path, fields=all_fields, batch_size=None):
+    '''Like path_list, but yields batches of file info as the directory is
+    read, in directory order and skipping the cache
+
+    Each step touches the disk; advance it in `executor`.
+    '''
+    if batch_size is None:
+        batch_size = config.browse_stream_batch
+
+    local_path = _resolve_path(local_path)
+    if local_path is None:
+        yield [info for info in _list_drives(fields) if info is not None]
+        return
+
+    batch = []
+    with os.scandir(local_path) as it:
+        for entry in it:
+            info = entry_info(entry, fields)
+            if info is None:
+                continue
+
+            batch.append(info)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+
+def encode_cursor(name):
+    return base64.urlsafe_b64encode(
+        name.encode('utf-8', 'surrogateescape')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    '''Name from encode_cursor; ValueError if cursor isn't one'''
+    # validate: without it anything outside the alphabet is skipped, and
+    # garbage decodes to some name instead of failing
+    return base64.b64decode(cursor.encode('ascii'), altchars=b'-_',
+                            validate=True).decode('utf-8', 'surrogateescape')
+
+
+def page(listing, *, offset=0, limit=None, cursor=None):
+    '''Slice of a name-sorted listing and the cursor for the next one
+
+    cursor (from a previous page) takes precedence over offset.  The next
+    cursor is None on the last page.
+    '''
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        offset = bisect.bisect_right([info['name'] for info in listing],
+                                     after)
+
+    end = len(listing) if limit is None else offset + limit
+    elements = listing[offset:end]
+    if end >= len(listing) or not elements:
+        return elements, None
+    return elements, encode_cursor(elements[-1]['name'])
@@ -0,0 +1,197 @@
+import logging
+import collections
+
+from tornado import gen
+from tornado import locks
+from tornado.ioloop import IOLoop
+from tornado.queues import QueueFull
+from tornado.concurrent import Future, chain_future
+
+from .breaker import CircuitBreaker, CircuitOpen, is_outage
+from . import config
+from . import metrics
+from .mpc_http import get_client
+
+
+logger = logging.getLogger(__name__)
+
+
+_queues = {}
+
+
+class _Pending:
+    __slots__ = ('request', 'coalesce_key', 'future')
+
+    def __init__(self, request, coalesce_key=None):
+        self.request = request
+        self.coalesce_key = coalesce_key
+        self.future = Future()
+
+
+class CommandQueue:
+    '''Orders the requests going to one mpc-hc instance
+
+    Commands are sent in the order they were submitted, ahead of any
+    background (status) fetches.  A command submitted with a coalesce_key
+    replaces one with the same key that hasn't been sent yet (latest wins),
+    and everyone waiting on either gets the response to the one sent.
+
+    Requests go through a CircuitBreaker: while mpc-hc is unreachable they
+    fail at once with CircuitOpen, and so do any still queued when it trips.
+    '''
+
+    def __init__(self, client, *, max_pending=None, workers=None):
+        if max_pending is None:
+            max_pending = config.command_queue_max_pending
+        if workers is None:
+            workers = config.command_queue_workers
+
+        self.client = client
+        self.max_pending = max_pending
+        self.workers = workers
+        self._commands = collections.deque()
+        self._background = collections.deque()
+        self._coalescable = {}
+        self._ready = locks.Condition()
+        self._started = False
+        self.breaker = CircuitBreaker(client.base_url)
+
+        # metrics
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        return len(self._commands) + len(self._background)
+
+    def stats(self):
+        return dict(sent=self.sent, coalesced=self.coalesced,
+                    dropped=self.dropped, pending=self.pending)
+
+    def submit(self, request, *, coalesce_key=None):
+        '''Queue an interactive command; returns a Future of the response'''
+        if coalesce_key is not None:
+            try:
+                pending = self._coalescable[coalesce_key]
+            except KeyError:
+                pass
+            else:
+                pending.request = request
+                self.coalesced += 1
+                return pending.future
+
+        if len(self._commands) >= self.max_pending:
+            self.dropped += 1
+            raise QueueFull('{} commands already waiting for {}'
+                            ''.format(len(self._commands),
+                                      self.client.base_url))
+
+        self.breaker.check()
+        pending = _Pending(request, coalesce_key)
+        if coalesce_key is not None:
+            self._coalescable[coalesce_key] = pending
+        self._commands.append(pending)
+        self._notify()
+        return pending.future
+
+    def submit_background(self, request):
+        '''Queue a low-priority fetch; returns a Future of the response'''
+        self.breaker.check()
+        pending = _Pending(request)
+        self._background.append(pending)
+        self._notify()
+        return pending.future
+
+    def _notify(self):
+        if not self._started:
+            self._started = True
+            for i in range(self.workers):
+                IOLoop.current().spawn_callback(self._worker)
+        self._ready.notify()
+
+    def _next(self):
+        if self._commands:
+            pending = self._commands.popleft()
+            if pending.coalesce_key is not None:
+                del self._coalescable[pending.coalesce_key]
+            return pending
+        if self._background:
+            return self._background.popleft()
+        return None
+
+    @gen.coroutine
+    def _worker(self):
+        while True:
+            pending = self._next()
+            if pending is None:
+                yield self._ready.wait()
+                continue
+
+            self.sent += 1
+            fetch = self.client.fetch(pending.request)
+            chain_future(fetch, pending.future)
+            try:
+                yield fetch
+            except Exception as ex:
+                # reported through pending.future
+                if not is_outage(ex):
+                    # an error response still means mpc-hc is up
+                    self.breaker.success()
+                elif self.breaker.failure():
+                    self._fail_pending()
+            else:
+                self.breaker.success()
+
+    def _fail_pending(self):
+        '''Fail everything queued with CircuitOpen instead of letting each
+        wait out its timeout'''
+        ex = CircuitOpen('{} is unreachable'.format(self.client.base_url))
+        for pending in self._commands + self._background:
+            pending.future.set_exception(ex)
+        self._commands.clear()
+        self._background.clear()
+        self._coalescable.clear()
+
+
+def get_queue(host=None, port=None):
+    '''Shared command queue for the given mpc-hc endpoint'''
+    client = get_client(host, port)
+    try:
+        return _queues[(client.host, client.port)]
+    except KeyError:
+        queue = CommandQueue(client)
+        _queues[(client.host, client.port)] = queue
+        return queue
+
+
+def _queue_stats(stat):
+    return lambda: {(queue.client.base_url, ): getattr(queue, stat)
+                    for queue in _queues.values()}
+
+
+metrics.Callback('vlchc_commands_sent_total', 'Requests sent to mpc-hc',
+                 _queue_stats('sent'), ['endpoint'], type_name='counter')
+metrics.Callback('vlchc_commands_coalesced_total',
+                 'Commands merged into a pending one of the same kind',
+                 _queue_stats('coalesced'), ['endpoint'], type_name='counter')
+metrics.Callback('vlchc_commands_dropped_total',
+                 'Commands rejected because the queue was full',
+                 _queue_stats('dropped'), ['endpoint'], type_name='counter')
+metrics.Callback('vlchc_circuit_open',
+                 'Whether requests to mpc-hc are failing fast (1) or sent (0)',
+                 lambda: {(queue.client.base_url, ):
+                          int(not queue.breaker.closed)
+                          for queue in _queues.values()}, ['endpoint'])
+metrics.Callback('vlchc_circuit_opened_total',
+                 'Times mpc-hc was found unreachable',
+                 lambda: {(queue.client.base_url, ): queue.breaker.opened
+                          for queue in _queues.values()},
+                 ['endpoint'], type_name='counter')
+metrics.Callback('vlchc_circuit_rejected_total',
+                 'Requests failed at once while mpc-hc was unreachable',
+                 lambda: {(queue.client.base_url, ): queue.breaker.rejected
+                          for queue in _queues.values()},
+                 ['endpoint'], type_name='counter')
+metrics.Callback('vlchc_command_queue_pending', 'Requests waiting to be sent',
+                 _queue_stats('pending'), ['endpoint'])
@@ -1,3 +1,5 @@
+import os
+
 host = 'localhost'
 mpc_port = 13579
 vlc_passthru_port = 8081
@@ -6,3 +8,145 @@ vlc_port = 8080
 vlc_password = 'vlcremote'
 
 default_path = r'B:/movies'
+
+# shared http client settings for talking to mpc-hc (seconds)
+mpc_max_connections = 4
+mpc_connect_timeout = 2.0
+mpc_request_timeout = 5.0
+
+# status/playlist json responses
+json_gzip = True
+gzip_level = 6
+gzip_min_length = 1024
+
+# status polling intervals (seconds)
+poll_delay_playing = 0.1
+poll_delay_paused = 0.5
+poll_delay_stopped = 1.0
+# no status requests for poll_demand_window -> poll every poll_delay_idle
+poll_delay_idle = 10.0
+poll_demand_window = 5.0
+poll_backoff_max = 10.0
+
+# status.json fetches fresh status if what the poller has is older than this
+status_max_age = 0.25
+# after a command, wait at most this long for status showing its effect
+command_refresh_timeout = 0.3
+
+# requests to mpc-hc go through a per-player queue; at most this many
+# commands can be waiting, and this many requests are sent at once
+command_queue_max_pending = 32
+command_queue_workers = 1
+
+# threads used for directory browsing
+browse_workers = 4
+# memory budget for cached directory listings (bytes), and whether to watch
+# cached directories with inotify (linux, needs inotify_simple)
+browse_cache_bytes = 32 * 1024 * 1024
+browse_inotify = True
+# entries per chunk when streaming browse.json (stream=1)
+browse_stream_batch = 500
+
+# verified Authorization headers are remembered for auth_cache_ttl seconds
+auth_cache_size = 256
+auth_cache_ttl = 300
+# signed session cookie so browsers can skip basic auth; cookie_secret=None
+# picks a random one at startup (sessions end when the server restarts)
+session_cookie = True
+session_max_age_days = 1
+cookie_secret = None
+
+# static files are served from memory; check them for changes this often
+# (seconds), and send this Cache-Control with them
+static_check_interval = 1.0
+static_cache_control = 'no-cache'
+
+# websocket / event-stream status push: heartbeat every push_heartbeat
+# seconds, drop clients stuck on one message for more than push_max_lag
+push_heartbeat = 15.0
+push_max_lag = 30.0
+
+# more than one mpc-hc instance: name -> dict(host=..., mpc_port=...,
+# vlc_port=...).  Each is reachable under /players/<name>/requests/..., and
+# on its own vlc_port if it has one.  The first is also served at
+# /requests/... on vlc_port.  None means one player at host/mpc_port.
+players = None
+# first polls of the players are spread over this many seconds, and every
+# poll delay varies by +/- poll_jitter (fraction) so they stay spread out
+poll_stagger = 1.0
+poll_jitter = 0.1
+
+# multi-process mode (unix): workers > 0 forks one poller process plus this
+# many http workers sharing vlc_port.  Workers read status from shared
+# memory (shared_status_bytes per player, checked for push clients every
+# shared_check_interval seconds) and forward commands to the poller process
+# on 127.0.0.1:forward_port.
+workers = 0
+forward_port = 8089
+shared_status_bytes = 256 * 1024
+shared_check_interval = 0.05
+# a worker whose shared status is older than status_max_age asks the poller
+# process for a fetch (noticed within shared_check_interval) and waits at
+# most this long for it
+shared_refresh_timeout = 0.5
+
+# /health reports a player unreachable (and answers 503) once its status is
+# older than this many seconds; keep it above poll_delay_idle and
+# poll_backoff_max, as an idle player is polled that rarely
+health_max_status_age = 30.0
+
+# admin tools under /admin/ (profiler, tracemalloc, request tracing), only
+# served when admin_password is set; the user name is ignored
+admin_password = None
+# log a json line per request with its spans (auth, vlc_to_mpc, mpc_fetch,
+# json_encode, write); can also be switched at /admin/trace
+trace_requests = False
+# sampling profiler: seconds between samples, and a cap so a forgotten
+# profiler doesn't grow forever
+profile_interval = 0.005
+profile_max_samples = 200000
+# tracemalloc: frames kept per allocation, and snapshots kept for diffs
+tracemalloc_frames = 10
+tracemalloc_max_snapshots = 8
+
+# media library: files under library_roots (None means [default_path]) with
+# one of library_extensions are indexed into library_db, rescanned (only
+# changed directories are re-read) every library_rescan_interval seconds
+library_roots = None
+library_db = os.path.join(os.path.expanduser('~'), '.vlchc', 'library.db')
+library_extensions = ('.mkv', '.mp4', '.m4v', '.avi', '.mov', '.wmv',
+                      '.mpg', '.mpeg', '.ts', '.m2ts', '.webm', '.flv',
+                      '.ogm', '.ogv', '.mp3', '.flac', '.m4a', '.aac',
+                      '.ogg', '.opus', '.wav', '.wma')
+library_rescan_interval = 600.0
+library_search_limit = 50
+library_workers = 2
+
+# read stream info (codecs, resolution...) for status.json from the playing
+# file's headers, in probe_workers processes; results are kept for
+# probe_cache_size files in memory and for every file in probe_db
+probe_streams = True
+probe_workers = 1
+probe_cache_size = 256
+probe_db = os.path.join(os.path.expanduser('~'), '.vlchc', 'probe.db')
+
+# cover art (/art): an image next to the playing file named after it
+# (<name>.jpg, <name>-poster.png...) or one of art_names; recently served
+# images are kept in memory up to art_cache_bytes, skipping any bigger than
+# art_max_item_bytes
+art_names = ('cover', 'folder', 'poster', 'front', 'albumart',
+             'albumartsmall', 'thumb')
+art_extensions = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+art_cache_bytes = 16 * 1024 * 1024
+art_max_item_bytes = 4 * 1024 * 1024
+# bytes per write when streaming art
+art_chunk_size = 64 * 1024
+
+# circuit breaker per mpc-hc: after breaker_failures requests in a row
+# can't reach it, requests fail at once (status.json serves the last known
+# status with "stale": true) instead of waiting out mpc_*_timeout; one probe
+# is let through after breaker_reset_timeout seconds, doubling up to
+# breaker_reset_max while probes keep failing
+breaker_failures = 3
+breaker_reset_timeout = 1.0
+breaker_reset_max = 10.0
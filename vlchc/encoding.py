@@ -0,0 +1,61 @@
+import gzip
+import json
+import hashlib
+import logging
+
+from . import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+if orjson is not None:
+    json_backend, dumps = 'orjson', orjson.dumps
+elif ujson is not None:
+    json_backend, dumps = 'ujson', _ujson_dumps
+else:
+    json_backend, dumps = 'json', _stdlib_dumps
+
+logger.debug('Using %s for json encoding', json_backend)
+
+
+class EncodedJson:
+    '''JSON bytes for one snapshot, with etag and (lazily) gzipped bytes'''
+    __slots__ = ('body', 'etag', '_gzipped')
+
+    def __init__(self, obj=None, *, body=None):
+        if body is None:
+            body = dumps(obj)
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.sha1(self.body).hexdigest())
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body,
+                                          compresslevel=config.gzip_level)
+        return self._gzipped
+
+    def accepts_gzip(self, request):
+        return (config.json_gzip and
+                len(self.body) >= config.gzip_min_length and
+                'gzip' in request.headers.get('Accept-Encoding', ''))
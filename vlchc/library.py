@@ -0,0 +1,346 @@
+'''Media library: an sqlite index of the media files under the library
+roots, searched by library.json
+
+Rescans are incremental.  A directory whose mtime hasn't changed keeps its
+indexed files; only its subdirectories are stat()ed to look for changes
+further down.  Names are searched through an fts5 table, with the trigram
+tokenizer (substring matches) when sqlite has it, otherwise word prefixes.
+'''
+import os
+import time
+import sqlite3
+import logging
+import pathlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+# scans and searches hit the disk; one scan at a time, searches alongside
+executor = ThreadPoolExecutor(max_workers=config.library_workers)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, name)
+        VALUES ('delete', old.id, old.name);
+END;
+'''
+
+_fts_schema = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5 (
+    name, content='files', content_rowid='id', tokenize='{}'
+)
+'''
+
+
+def library_roots():
+    '''config.library_roots, or just config.default_path'''
+    roots = config.library_roots
+    if roots is None:
+        roots = [config.default_path]
+    return [os.path.abspath(root) for root in roots]
+
+
+def _subtree_range(path):
+    '''(low, high) bounds of the paths strictly under path'''
+    prefix = os.path.join(path, '')
+    # everything starting with prefix sorts below prefix with its trailing
+    # separator bumped by one
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _fts_phrase(term):
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def _like_pattern(term):
+    escaped = (term.replace('\\', '\\\\').replace('%', '\\%')
+               .replace('_', '\\_'))
+    return '%' + escaped + '%'
+
+
+class LibraryIndex:
+    def __init__(self, path=None, *, roots=None, extensions=None):
+        if path is None:
+            path = config.library_db
+        if roots is None:
+            roots = library_roots()
+        if extensions is None:
+            extensions = config.library_extensions
+
+        self.path = path
+        self.roots = roots
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        self.tokenizer = None
+        self.scanning = False
+        self.last_scan = None
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._periodic = None
+
+    def _connection(self):
+        '''This thread's connection (sqlite connections stay on one thread)'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._init_lock:
+                if self.path != ':memory:':
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                                exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=30.0)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                if self.tokenizer is None:
+                    self.tokenizer = self._create_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _create_schema(conn):
+        row = conn.execute("SELECT sql FROM sqlite_master "
+                           "WHERE name = 'files_fts'").fetchone()
+        if row is None:
+            try:
+                conn.execute(_fts_schema.format('trigram'))
+            except sqlite3.OperationalError:
+                logger.info('sqlite has no trigram tokenizer; library '
+                            'search matches word prefixes')
+                conn.execute(_fts_schema.format('unicode61'))
+            row = conn.execute("SELECT sql FROM sqlite_master "
+                               "WHERE name = 'files_fts'").fetchone()
+        conn.executescript(_schema)
+        return 'trigram' if 'trigram' in row[0] else 'unicode61'
+
+    # scanning (blocking; run on executor)
+
+    def scan(self):
+        '''Bring the index up to date; returns counts of what changed, or
+        None if another scan is already running'''
+        if not self._scan_lock.acquire(blocking=False):
+            return None
+
+        self.scanning = True
+        try:
+            conn = self._connection()
+            stats = dict(dirs=0, rescanned=0, added=0, updated=0,
+                         removed=0)
+            started = time.monotonic()
+            for root in self.roots:
+                if os.path.isdir(root):
+                    self._scan_tree(conn, root, stats)
+                else:
+                    logger.warning('Library root %s is not a directory',
+                                   root)
+
+            known_roots = [path for path, in conn.execute(
+                'SELECT path FROM dirs WHERE parent IS NULL')]
+            for root in known_roots:
+                if root not in self.roots:
+                    with conn:
+                        self._remove_tree(conn, root, stats)
+
+            stats['seconds'] = round(time.monotonic() - started, 3)
+            stats['finished_at'] = time.time()
+            self.last_scan = stats
+            logger.info('Library scan: %s', stats)
+            return stats
+        finally:
+            self.scanning = False
+            self._scan_lock.release()
+
+    def _scan_tree(self, conn, root, stats):
+        stack = [(root, None)]
+        while stack:
+            path, parent = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                with conn:
+                    self._remove_tree(conn, path, stats)
+                continue
+
+            stats['dirs'] += 1
+            row = conn.execute('SELECT mtime_ns FROM dirs WHERE path = ?',
+                               (path, )).fetchone()
+            if row is not None and row[0] == mtime_ns:
+                subdirs = [sub for sub, in conn.execute(
+                    'SELECT path FROM dirs WHERE parent = ?', (path, ))]
+            else:
+                subdirs = self._scan_dir(conn, path, parent, mtime_ns,
+                                         stats)
+            stack.extend((subdir, path) for subdir in subdirs)
+
+    def _scan_dir(self, conn, path, parent, mtime_ns, stats):
+        '''Re-read one changed directory; returns its subdirectories'''
+        files = {}
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        # not following links keeps loops out of the walk
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                            continue
+                        ext = os.path.splitext(entry.name)[1].lower()
+                        if ext in self.extensions:
+                            st = entry.stat()
+                            files[entry.name] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError as ex:
+            logger.debug('Unable to scan %s: %s', path, ex)
+            return []
+
+        stats['rescanned'] += 1
+        with conn:
+            indexed = {name: (file_id, size, mtime)
+                       for file_id, name, size, mtime in conn.execute(
+                           'SELECT id, name, size, mtime_ns FROM files '
+                           'WHERE dir = ?', (path, ))}
+            for name, (file_id, size, mtime) in indexed.items():
+                if name not in files:
+                    conn.execute('DELETE FROM files WHERE id = ?',
+                                 (file_id, ))
+                    stats['removed'] += 1
+                elif files[name] != (size, mtime):
+                    conn.execute('UPDATE files SET size = ?, mtime_ns = ? '
+                                 'WHERE id = ?', files[name] + (file_id, ))
+                    stats['updated'] += 1
+            conn.executemany(
+                'INSERT INTO files (dir, name, size, mtime_ns) '
+                'VALUES (?, ?, ?, ?)',
+                [(path, name, size, mtime)
+                 for name, (size, mtime) in files.items()
+                 if name not in indexed])
+            stats['added'] += len(files.keys() - indexed.keys())
+
+            subdir_set = set(subdirs)
+            for subdir, in conn.execute(
+                    'SELECT path FROM dirs WHERE parent = ?',
+                    (path, )).fetchall():
+                if subdir not in subdir_set:
+                    self._remove_tree(conn, subdir, stats)
+
+            conn.execute('INSERT OR REPLACE INTO dirs (path, parent, '
+                         'mtime_ns) VALUES (?, ?, ?)',
+                         (path, parent, mtime_ns))
+        return subdirs
+
+    @staticmethod
+    def _remove_tree(conn, path, stats):
+        low, high = _subtree_range(path)
+        cursor = conn.execute('DELETE FROM files WHERE dir = ? OR '
+                              '(dir > ? AND dir < ?)', (path, low, high))
+        stats['removed'] += cursor.rowcount
+        conn.execute('DELETE FROM dirs WHERE path = ? OR '
+                     '(path > ? AND path < ?)', (path, low, high))
+
+    # searching (blocking; run on executor)
+
+    def search(self, query, limit=None):
+        '''Files whose name contains every word of query (trigram), or has
+        words starting with them (prefix), best matches first'''
+        if limit is None:
+            limit = config.library_search_limit
+
+        terms = query.split()
+        if not terms:
+            return []
+
+        conn = self._connection()
+        if self.tokenizer == 'trigram':
+            # trigrams need 3+ characters; shorter words are LIKEd
+            match = [term for term in terms if len(term) >= 3]
+            like = [term for term in terms if len(term) < 3]
+            fts_query = ' '.join(_fts_phrase(term) for term in match)
+        else:
+            match, like = terms, []
+            fts_query = ' '.join(_fts_phrase(term) + '*' for term in match)
+
+        params = []
+        if match:
+            sql = ('SELECT f.dir, f.name, f.size, f.mtime_ns '
+                   'FROM files_fts JOIN files f ON f.id = files_fts.rowid '
+                   'WHERE files_fts MATCH ?')
+            params.append(fts_query)
+        else:
+            sql = ('SELECT f.dir, f.name, f.size, f.mtime_ns FROM files f '
+                   'WHERE 1')
+        for term in like:
+            sql += " AND f.name LIKE ? ESCAPE '\\'"
+            params.append(_like_pattern(term))
+        sql += ' ORDER BY rank' if match else ' ORDER BY f.name'
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+        return [self._info(*row) for row in conn.execute(sql, params)]
+
+    @staticmethod
+    def _info(directory, name, size, mtime_ns):
+        path = os.path.join(directory, name)
+        return {'type': 'file',
+                'path': path,
+                'name': name,
+                'uri': pathlib.Path(path).as_uri(),
+                'size': size,
+                'modification_time': mtime_ns / 1e9,
+                }
+
+    def stats(self):
+        conn = self._connection()
+        files, = conn.execute('SELECT count(*) FROM files').fetchone()
+        dirs, = conn.execute('SELECT count(*) FROM dirs').fetchone()
+        return dict(files=files, dirs=dirs, roots=self.roots,
+                    tokenizer=self.tokenizer, scanning=self.scanning,
+                    last_scan=self.last_scan)
+
+    # background rescans
+
+    def start(self, io_loop=None):
+        '''Scan now, then every config.library_rescan_interval seconds'''
+        if io_loop is None:
+            io_loop = IOLoop.current()
+
+        io_loop.add_callback(self._rescan)
+        if config.library_rescan_interval:
+            self._periodic = PeriodicCallback(
+                self._rescan, 1000 * config.library_rescan_interval)
+            self._periodic.start()
+
+    def _rescan(self):
+        if self.scanning:
+            return
+        future = executor.submit(self.scan)
+        future.add_done_callback(self._scan_done)
+
+    @staticmethod
+    def _scan_done(future):
+        ex = future.exception()
+        if ex is not None:
+            logger.error('Library scan failed', exc_info=ex)
+
+
+index = LibraryIndex()
@@ -0,0 +1,151 @@
+import bisect
+import logging
+import collections
+
+
+logger = logging.getLogger(__name__)
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                              .replace('"', r'\"').replace('\n', r'\n'))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self):
+        yield '# HELP {} {}'.format(self.name, self.help)
+        yield '# TYPE {} {}'.format(self.name, self.type_name)
+        yield from self._render_samples()
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[self._key(labels)] += amount
+
+    def _render_samples(self):
+        for key, value in sorted(self.values.items()):
+            yield '{}{} {}'.format(self.name,
+                                   _format_labels(self.labels, key),
+                                   _format_value(value))
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=latency_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # per label set: [count per bucket (last is +Inf)..., sum]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        try:
+            counts = self.values[key]
+        except KeyError:
+            counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _render_samples(self):
+        name = self.name
+        for key, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ),
+                                    counts):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                yield '{}_bucket{} {}'.format(
+                    name, _format_labels(self.labels, key, le), cumulative)
+            labels = _format_labels(self.labels, key)
+            yield '{}_sum{} {}'.format(name, labels, _format_value(counts[-1]))
+            yield '{}_count{} {}'.format(name, labels, cumulative)
+
+
+class Callback(Metric):
+    '''Values read at scrape time: callback() -> {label values: value}
+
+    For things already counted elsewhere (queue, cache stats); type_name is
+    'gauge' or 'counter'.
+    '''
+
+    def __init__(self, name, help, callback, labels=(), type_name='gauge'):
+        super().__init__(name, help, labels)
+        self.callback = callback
+        self.type_name = type_name
+
+    def _render_samples(self):
+        try:
+            values = self.callback()
+        except Exception as ex:
+            logger.warning('Metric %s failed', self.name, exc_info=ex)
+            return
+
+        for key, value in sorted(values.items()):
+            yield '{}{} {}'.format(self.name,
+                                   _format_labels(self.labels, key),
+                                   _format_value(value))
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+poll_seconds = Histogram('vlchc_mpc_poll_seconds',
+                         'variables.html round trip', ['player'])
+parse_seconds = Histogram('vlchc_parse_status_seconds',
+                          'Time spent in parse_status', ['player'])
+translate_seconds = Histogram('vlchc_mpc_to_vlc_seconds',
+                              'Time spent translating mpc-hc to vlc status',
+                              ['player'])
+poll_failures = Counter('vlchc_poll_failures_total',
+                        'Failed status polls', ['player'])
+poll_backoff_seconds = Histogram('vlchc_poll_backoff_seconds',
+                                 'Delay before the next poll after a failure',
+                                 ['player'])
+status_age_seconds = Histogram('vlchc_status_age_seconds',
+                               'Age of the status when sent to a remote',
+                               ['player'])
+command_seconds = Histogram('vlchc_command_seconds',
+                            'Round trip of a vlc command sent to mpc-hc',
+                            ['player', 'command'])
+request_seconds = Histogram('vlchc_request_seconds',
+                            'Request handling time', ['handler'])
+browse_entries = Histogram('vlchc_browse_entries',
+                           'Entries in browsed directories',
+                           buckets=(10, 100, 1000, 10000, 100000))
@@ -1,14 +1,14 @@
+import math
 import logging
-import functools
+import collections
 import urllib.parse
 
-from tornado import httpclient
 from tornado import gen
-from tornado.httputil import url_concat as _url_concat
 
 from . import config
+from .mpc_http import get_client
+from .command_queue import get_queue
 from .mpc_reqs import MpcCommandEnum
-from .mpc_status import StatusPoller
 
 
 logger = logging.getLogger(__name__)
@@ -23,81 +23,86 @@ def get_mpc_host_port(host=None, port=None):
     return host, port
 
 
-def mpc_command(data, *, host=None, port=None):
-    host, port = get_mpc_host_port(host, port)
+class MpcRequest(collections.namedtuple('MpcRequest',
+                                        'path method body coalesce_key')):
+    '''A command ready to send to mpc-hc: path (with any query), method,
+    encoded body (bytes or None) and its coalescing key (or None)'''
+    __slots__ = ()
 
-    command_url = ('http://{host}:{port}/command.html'
-                   ''.format(host=host, port=port))
-    logger.debug('Generating command request URL=%s', command_url)
-    if 'wm_command' in data:
-        data = dict(data)
-        data['wm_command'] = int(data['wm_command'])
 
-    return httpclient.HTTPRequest(command_url,
-                                  method='POST',
-                                  body=urllib.parse.urlencode(data),
-                                  )
-    # auth_username='',
-    # auth_password=config.vlc_password,
-    # auth_mode='basic'
+class CommandError(ValueError):
+    '''A vlc command with a value it can't be sent with'''
 
 
-@gen.coroutine
-def send_command_request(cmd):
-    client = httpclient.AsyncHTTPClient()
-    req = mpc_command(cmd)
-    logger.debug('req %s (data=%s)', req.url, cmd)
+# if several of these are waiting to be sent, only the latest matters
+coalesced_commands = {MpcCommandEnum.CMD_SET_VOLUME,
+                      MpcCommandEnum.CMD_SET_POSITION,
+                      }
 
-    try:
-        response = yield client.fetch(req)
-    finally:
-        client.close()
-    return response
 
+def _command_prefix(wm_command):
+    return 'wm_command={:d}'.format(wm_command).encode('ascii')
 
-def url_concat(url, d):
-    '''url u, dict d
-    space handling for mpc webserver is nonstandard + as space doesn't work,
-    %20 does can't replace before url_concat or it gets double encoded, so
-    replace with a, uh, silly string. this is totally representative of my skill
-    level in general.
 
-    i think this is also my only docstring in this repo, so, enjoy
+def command_request(wm_command):
+    '''A command.html post with no parameters, encoded once'''
+    coalesce_key = wm_command if wm_command in coalesced_commands else None
+    return MpcRequest('command.html', 'POST', _command_prefix(wm_command),
+                      coalesce_key)
 
-    ref http://stackoverflow.com/questions/2678551
-    '''
 
-    # hahaha
-    SPACE = 'SUCHSPAAAAAACE'
-    new_d = {k: v.replace(' ', SPACE) for k, v in d.items()}
-    return _url_concat(url, new_d).replace(SPACE, '%20')
+def command_encoder(wm_command, param):
+    '''Function of a number to the command.html post for wm_command with
+    param set to it'''
+    prefix = _command_prefix(wm_command) + '&{}='.format(param).encode('ascii')
+    coalesce_key = wm_command if wm_command in coalesced_commands else None
 
+    def encode(value):
+        return MpcRequest('command.html', 'POST',
+                          prefix + str(value).encode('ascii'), coalesce_key)
 
-@gen.coroutine
-def send_get_request(url, *, host=None, port=None, **data):
-    host, port = get_mpc_host_port(host, port)
-    client = httpclient.AsyncHTTPClient()
-    base_url = ('http://{host}:{port}/{url}'
-                ''.format(host=host, port=port, url=url))
+    return encode
 
-    command_url = url_concat(base_url, data)
 
-    logger.debug('Generating command request URL=%s', command_url)
-    req = httpclient.HTTPRequest(command_url, method='GET')
-    try:
-        response = yield client.fetch(req)
-    finally:
-        client.close()
+def get_request(path, param):
+    '''Function of a string to a get of path?param=string
+
+    mpc-hc's web server doesn't take + for a space, so everything (spaces
+    included) is %-escaped.
+    '''
+    prefix = '{}?{}='.format(path, param)
+
+    def encode(value):
+        return MpcRequest(prefix + urllib.parse.quote(value, safe=''), 'GET',
+                          None, None)
+
+    return encode
+
+
+@gen.coroutine
+def send_command_request(request, *, host=None, port=None):
+    '''Queue an MpcRequest for the given mpc-hc endpoint'''
+    client = get_client(*get_mpc_host_port(host, port))
+    req = client.request(request.path, method=request.method,
+                         body=request.body)
+    logger.debug('req %s %s (body=%s)', request.method, req.url,
+                 request.body)
+
+    queue = get_queue(*get_mpc_host_port(host, port))
+    response = yield queue.submit(req, coalesce_key=request.coalesce_key)
     return response
 
 
 def basic_command(wm_command):
-    def wrapped(**kwargs):
-        return dict(wm_command=wm_command)
+    request = command_request(wm_command)
+
+    def compiled(**kwargs):
+        return request
 
-    return wrapped
+    return compiled
 
 
+# vlc command -> function(value, input_, poller) returning the MpcRequest
 vlc_to_mpc = dict(
     pl_play=basic_command(MpcCommandEnum.PLAY),
     # pl_pause=basic_command(MpcCommandEnum.PAUSE),
@@ -116,70 +121,93 @@ vlc_to_mpc = dict(
 
 
 def handles(vlc_command):
-    '''maps vlc_command to put args for mpc-hc request'''
+    '''registers the decorated function as the vlc_to_mpc entry for
+    vlc_command'''
     def wrapper(command_fcn):
-        @functools.wraps(command_fcn)
-        def wrapped(**kwargs):
-            return command_fcn(**kwargs)
-
-        global vlc_to_mpc
         vlc_to_mpc[vlc_command] = command_fcn
-        return wrapped
+        return command_fcn
 
     return wrapper
 
 
+def _number(value, convert=float):
+    try:
+        number = convert(value)
+    except (TypeError, ValueError):
+        raise CommandError('Not a number: {!r}'.format(value))
+    # float() takes 'nan', 'inf' and '1e400'; none of them are positions
+    if not math.isfinite(number):
+        raise CommandError('Not a finite number: {!r}'.format(value))
+    return number
+
+
+_set_volume = command_encoder(MpcCommandEnum.CMD_SET_VOLUME, 'volume')
+
+
 @handles('volume')
 def mpc_volume(value=0, **kwargs):
-    value = int(value)
-    return dict(wm_command=MpcCommandEnum.CMD_SET_VOLUME,
-                volume=int(100.0 * (value / 512)),
-                )
+    value = _number(value, int)
+    return _set_volume(int(100.0 * (value / 512)))
+
+
+_key_commands = {
+    'subdelay-down': MpcCommandEnum.SUBTITLE_DELAY_MINUS,
+    'subdelay-up': MpcCommandEnum.SUBTITLE_DELAY_PLUS,
+    'audiodelay-down': MpcCommandEnum.AUDIO_DELAY_MINUS10_MS,
+    'audiodelay-up': MpcCommandEnum.AUDIO_DELAY_PLUS10_MS,
+    'audio-track': MpcCommandEnum.NEXT_AUDIO_TRACK,
+    'nav-left': MpcCommandEnum.DVD_MENU_LEFT,
+    'nav-right': MpcCommandEnum.DVD_MENU_RIGHT,
+    'nav-up': MpcCommandEnum.DVD_MENU_UP,
+    'nav-down': MpcCommandEnum.DVD_MENU_DOWN,
+    'nav-activate': MpcCommandEnum.DVD_MENU_ACTIVATE,
+    # 'chapter-prev': ,
+    # 'chapter-next': ,
+    # 'title-prev': ,
+    # 'title-next': ,
+    }
+_keys = {name: command_request(wm_command)
+         for name, wm_command in _key_commands.items()}
 
 
 @handles('key')
 def mpc_key(value=0, **kwargs):
-    keys = {'subdelay-down': MpcCommandEnum.SUBTITLE_DELAY_MINUS,
-            'subdelay-up': MpcCommandEnum.SUBTITLE_DELAY_PLUS,
-            'audiodelay-down': MpcCommandEnum.AUDIO_DELAY_MINUS10_MS,
-            'audiodelay-up': MpcCommandEnum.AUDIO_DELAY_PLUS10_MS,
-            'audio-track': MpcCommandEnum.NEXT_AUDIO_TRACK,
-            'nav-left': MpcCommandEnum.DVD_MENU_LEFT,
-            'nav-right': MpcCommandEnum.DVD_MENU_RIGHT,
-            'nav-up': MpcCommandEnum.DVD_MENU_UP,
-            'nav-down': MpcCommandEnum.DVD_MENU_DOWN,
-            'nav-activate': MpcCommandEnum.DVD_MENU_ACTIVATE,
-            # 'chapter-prev': ,
-            # 'chapter-next': ,
-            # 'title-prev': ,
-            # 'title-next': ,
-            }
-
-    return dict(wm_command=keys[value])
+    try:
+        return _keys[value]
+    except KeyError:
+        raise CommandError('Unknown key: {!r}'.format(value))
+
+
+_fullscreen = command_request(MpcCommandEnum.FULLSCREEN_NO_RES_CHANGE)
 
 
 @handles('fullscreen')
-def fullscreen(**kwargs):
-    poller = StatusPoller.instance
+def fullscreen(*, poller, **kwargs):
     poller.fullscreen = not poller.fullscreen
-    return dict(wm_command=MpcCommandEnum.FULLSCREEN_NO_RES_CHANGE)
+    return _fullscreen
+
+
+_set_position = command_encoder(MpcCommandEnum.CMD_SET_POSITION, 'percent')
 
 
 @handles('seek')
-def seek(value=0, **kwargs):
-    poller = StatusPoller.instance
-    vlc_position = float(value)
-    vlc_length = poller.status['length']
+def seek(value=0, *, poller, **kwargs):
+    vlc_position = _number(value)
+    vlc_length = poller.status.length
+    if not vlc_length:
+        raise CommandError('Nothing to seek in')
     percent = (vlc_position / vlc_length) * 100.0
-    return dict(wm_command=MpcCommandEnum.CMD_SET_POSITION,
-                percent=percent)
+    return _set_position(percent)
+
+
+_open_file = get_request('browser.html', 'path')
 
 
 @handles('in_play')
 def play_file(input_=0, **kwargs):
-    return {'url': 'browser.html',
-            'path': input_
-            }
+    if not input_:
+        raise CommandError('no input given')
+    return _open_file(input_)
 
 
 # @handles('pl_delete')
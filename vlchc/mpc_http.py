@@ -0,0 +1,226 @@
+import io
+import time
+import logging
+import collections
+import urllib.parse
+
+from tornado import gen
+from tornado import locks
+from tornado import httputil
+from tornado import httpclient
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.tcpclient import TCPClient
+from tornado.http1connection import HTTP1Connection, HTTP1ConnectionParameters
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class _StaleConnection(Exception):
+    '''A reused connection was closed before any response came back'''
+
+
+class _ResponseReader(httputil.HTTPMessageDelegate):
+    def __init__(self):
+        self.start_line = None
+        self.headers = None
+        self.chunks = []
+        self.finished = False
+
+    def headers_received(self, start_line, headers):
+        self.start_line = start_line
+        self.headers = headers
+
+    def data_received(self, chunk):
+        self.chunks.append(chunk)
+
+    def finish(self):
+        self.finished = True
+
+
+def _keep_alive(start_line, headers):
+    connection = headers.get('Connection', '').lower()
+    if start_line.version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive' and 'Content-Length' in headers
+
+
+class KeepAliveClient:
+    '''HTTP/1.1 client that keeps its connections to one host:port open
+
+    tornado's simple client closes the socket after every request.  This
+    sends one request at a time on each of up to max_connections
+    connections and puts them back for the next request.  Only what mpc-hc
+    needs: no redirects, proxies, cookies or compression.
+    '''
+
+    def __init__(self, host, port, *, max_connections):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self._idle = collections.deque()
+        self._slots = locks.Semaphore(max_connections)
+        self._tcp = TCPClient()
+        self._params = HTTP1ConnectionParameters(decompress=False)
+        self._closed = False
+
+        # metrics
+        self.opened = 0
+
+    @gen.coroutine
+    def fetch(self, request):
+        start_time = time.time()
+        deadline = IOLoop.current().time() + request.request_timeout
+        try:
+            yield self._slots.acquire(deadline)
+        except gen.TimeoutError:
+            raise httpclient.HTTPError(599, 'Timeout waiting for a connection')
+        try:
+            reader = yield self._fetch(request, deadline)
+        finally:
+            self._slots.release()
+
+        response = httpclient.HTTPResponse(
+            request, reader.start_line.code, reason=reader.start_line.reason,
+            headers=reader.headers, buffer=io.BytesIO(b''.join(reader.chunks)),
+            effective_url=request.url, request_time=time.time() - start_time,
+            start_time=start_time)
+        response.rethrow()
+        return response
+
+    @gen.coroutine
+    def _fetch(self, request, deadline):
+        while self._idle:
+            stream = self._idle.pop()
+            if stream.closed():
+                continue
+            try:
+                return (yield self._send(stream, request, deadline))
+            except _StaleConnection:
+                # mpc-hc dropped it while it was idle; a fresh one next
+                logger.debug('%s:%s closed an idle connection',
+                             self.host, self.port)
+
+        connect_deadline = IOLoop.current().time() + request.connect_timeout
+        try:
+            stream = yield self._tcp.connect(
+                self.host, self.port, timeout=min(deadline, connect_deadline))
+        except gen.TimeoutError:
+            raise httpclient.HTTPError(599, 'Timeout while connecting')
+        self.opened += 1
+        stream.set_nodelay(True)
+        try:
+            return (yield self._send(stream, request, deadline))
+        except _StaleConnection:
+            raise httpclient.HTTPError(599, 'Connection closed')
+
+    @gen.coroutine
+    def _send(self, stream, request, deadline):
+        url = urllib.parse.urlsplit(request.url)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        headers = httputil.HTTPHeaders(request.headers)
+        headers.setdefault('Host', url.netloc)
+        if request.body is not None:
+            headers['Content-Length'] = str(len(request.body))
+
+        connection = HTTP1Connection(stream, True, self._params)
+        reader = _ResponseReader()
+        try:
+            connection.write_headers(
+                httputil.RequestStartLine(request.method, path, 'HTTP/1.1'),
+                headers)
+            if request.body:
+                connection.write(request.body)
+            connection.finish()
+            yield gen.with_timeout(deadline, connection.read_response(reader),
+                                   quiet_exceptions=StreamClosedError)
+        except gen.TimeoutError:
+            stream.close()
+            raise httpclient.HTTPError(599, 'Timeout during request')
+        except StreamClosedError:
+            stream.close()
+            if reader.start_line is None:
+                raise _StaleConnection()
+            raise httpclient.HTTPError(599, 'Connection closed')
+
+        if not reader.finished:
+            stream.close()
+            raise httpclient.HTTPError(599, 'Incomplete response')
+        if (self._closed or stream.closed() or
+                not _keep_alive(reader.start_line, reader.headers)):
+            stream.close()
+        else:
+            self._idle.append(stream)
+        return reader
+
+    def close(self):
+        self._closed = True
+        while self._idle:
+            self._idle.pop().close()
+
+
+_clients = {}
+
+
+class MpcHttpClient:
+    '''Long-lived http client for a single mpc-hc web interface'''
+
+    def __init__(self, host, port, *, max_connections=None,
+                 connect_timeout=None, request_timeout=None):
+        if max_connections is None:
+            max_connections = config.mpc_max_connections
+        if connect_timeout is None:
+            connect_timeout = config.mpc_connect_timeout
+        if request_timeout is None:
+            request_timeout = config.mpc_request_timeout
+
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.base_url = 'http://{host}:{port}/'.format(host=host, port=port)
+        self.client = KeepAliveClient(host, port,
+                                      max_connections=max_connections)
+        logger.debug('Created a client for %s (max_connections=%d)',
+                     self.base_url, max_connections)
+
+    def url(self, path):
+        return self.base_url + path.lstrip('/')
+
+    def request(self, path, **kwargs):
+        kwargs.setdefault('connect_timeout', self.connect_timeout)
+        kwargs.setdefault('request_timeout', self.request_timeout)
+        return httpclient.HTTPRequest(self.url(path), **kwargs)
+
+    def fetch(self, request):
+        return self.client.fetch(request)
+
+    def close(self):
+        self.client.close()
+
+
+def get_client(host=None, port=None):
+    '''Shared client for the given mpc-hc endpoint (config defaults)'''
+    if host is None:
+        host = config.host
+    if port is None:
+        port = config.mpc_port
+
+    try:
+        return _clients[(host, port)]
+    except KeyError:
+        client = MpcHttpClient(host, port)
+        _clients[(host, port)] = client
+        return client
+
+
+def close_all():
+    for client in _clients.values():
+        client.close()
+    _clients.clear()
@@ -1,20 +1,105 @@
+import re
 import ast
+import html
+import time
 import pathlib
 import logging
+import datetime
 
-import lxml
-import lxml.html
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
-from tornado import httpclient
 from tornado import gen
+from tornado.ioloop import IOLoop
 
 from . import config
+from . import metrics
+from . import probe
+from .mpc_http import get_client
+from .command_queue import get_queue
+from .breaker import CircuitOpen
+from .encoding import EncodedJson, dumps
+from .scheduler import PollScheduler
 
 
 logger = logging.getLogger(__name__)
 
 
+# types of the <p id=...> fields on mpc-hc's variables.html
+status_schema = dict(file=str,
+                     filepatharg=str,
+                     filepath=str,
+                     filedirarg=str,
+                     filedir=str,
+                     state=int,
+                     statestring=str,
+                     position=int,
+                     positionstring=str,
+                     duration=int,
+                     durationstring=str,
+                     volumelevel=int,
+                     muted=bool,
+                     playbackrate=float,
+                     size=str,
+                     reloadtime=int,
+                     version=str,
+                     )
+
+# fields mpc_to_vlc can't do without
+required_fields = ('file', 'filepath', 'statestring', 'position', 'duration',
+                   'volumelevel', 'muted', 'playbackrate')
+
+_status_p_re = re.compile(r'<p id="([^"]*)">([^<]*)</p>')
+
+
+def _parse_bool(text):
+    return text.strip() not in ('', '0', 'false', 'False')
+
+
+_converters = {str: html.unescape,
+               int: int,
+               float: float,
+               bool: _parse_bool,
+               }
+
+
+def parse_status_fast(html_string, schema=status_schema):
+    '''Single pass over variables.html, typed by schema
+
+    Returns None if the page doesn't look like what mpc-hc normally sends.
+    '''
+    if isinstance(html_string, bytes):
+        html_string = html_string.decode('utf-8', errors='replace')
+
+    status = {}
+    for match in _status_p_re.finditer(html_string):
+        key, text = match.groups()
+        convert = _converters[schema.get(key, str)]
+        try:
+            status[key] = convert(text)
+        except ValueError:
+            return None
+
+    if any(key not in status for key in required_fields):
+        return None
+    return status
+
+
 def parse_status(html_string):
+    status = parse_status_fast(html_string)
+    if status is not None:
+        return status
+
+    if lxml is None:
+        raise ValueError('Unrecognized status page (and lxml unavailable)')
+
+    logger.debug('Unrecognized status page; falling back to lxml')
+    return parse_status_lxml(html_string)
+
+
+def parse_status_lxml(html_string):
     html_elem = lxml.html.fromstring(html_string)
     body = html_elem.body
 
@@ -28,41 +113,108 @@ def parse_status(html_string):
             for info_p in body.iterfind('p')}
 
 
-def mpc_to_vlc(status):
-    stats = dict.fromkeys(["inputbitrate", "sentbytes", "lostabuffers",
-                           "averagedemuxbitrate", "readpackets",
-                           "demuxreadpackets", "lostpictures",
-                           "displayedpictures", "sentpackets",
-                           "demuxreadbytes", "demuxbitrate", "playedabuffers",
-                           "demuxdiscontinuity", "decodedaudio", "sendbitrate",
-                           "readbytes", "averageinputbitrate",
-                           "demuxcorrupted", "decodedvideo"],
-                          0)
+def _vlc_duration(status):
+    # mpc-hc duration in msec
+    # vlc duration in seconds
+    return int(status['duration'] / 1000.0)
+
+
+def _derive_volume(status):
     if status['muted']:
-        volume = 0
-    else:
-        volume = (status['volumelevel'] / 100) * 512
+        return {'volume': 0}
+    return {'volume': (status['volumelevel'] / 100) * 512}
+
 
+def _derive_position(status):
     duration = status['duration']
     if duration == 0:
         duration = 1
 
     # position is normalized
-    position = (status['position'] / duration)
-    vlc_time = status['position'] / 1000.0
+    return {'position': status['position'] / duration,
+            'time': status['position'] / 1000.0,
+            }
+
+
+def _derive_length(status):
+    return {'length': _vlc_duration(status)}
+
+
+def _derive_state(status):
+    return {'state': status['statestring'].lower()}
+
+
+def _derive_rate(status):
+    return {'rate': status['playbackrate']}
+
+
+def _derive_information(status):
+    # just the name until the file's streams are probed
+    return {'information': _vlc_information(_vlc_category(status['file']))}
 
-    # mpc-hc duration in msec
-    # vlc duration in seconds
-    vlc_duration = int(duration / 1000.0)
 
-    vlc_status = {
-      "time": vlc_time,
-      "volume": volume,
-      "length": vlc_duration,
-      "state": status['statestring'].lower(),
+# (mpc-hc fields used, function deriving the vlc status fields from them)
+status_derivations = [
+    (('muted', 'volumelevel'), _derive_volume),
+    (('position', 'duration'), _derive_position),
+    (('duration', ), _derive_length),
+    (('statestring', ), _derive_state),
+    (('playbackrate', ), _derive_rate),
+    (('file', 'filepath'), _derive_information),
+]
 
+playlist_inputs = ('file', 'filepath', 'duration')
+
+
+def _file_uri(filepath):
+    if not filepath:
+        return ''
+    # mpc-hc only runs on windows, wherever this server happens to be
+    try:
+        return pathlib.PureWindowsPath(filepath).as_uri()
+    except ValueError:
+        # no drive letter: a posix path (mock server) or a relative one
+        path = pathlib.PurePosixPath(filepath)
+        return path.as_uri() if path.is_absolute() else ''
+
+
+def _vlc_playlist(leaf):
+    return {
+      "ro": "rw",
+      "type": "node",
+      "name": "Undefined",
+      "id": "1",
+      "children": [{
+          "ro": "ro",
+          "type": "node",
+          "name": "Playlist",
+          "id": "2",
+          "children": [leaf]
+        },
+        {
+          "ro": "ro",
+          "type": "node",
+          "name": "Media Library",
+          "id": "3",
+          "children": []
+        }]
+    }
+
+
+def _vlc_status_constants():
+    '''Everything in vlc's status.json that mpc-hc's status doesn't change'''
+    stats = dict.fromkeys(["inputbitrate", "sentbytes", "lostabuffers",
+                           "averagedemuxbitrate", "readpackets",
+                           "demuxreadpackets", "lostpictures",
+                           "displayedpictures", "sentpackets",
+                           "demuxreadbytes", "demuxbitrate", "playedabuffers",
+                           "demuxdiscontinuity", "decodedaudio", "sendbitrate",
+                           "readbytes", "averageinputbitrate",
+                           "demuxcorrupted", "decodedvideo"],
+                          0)
+
+    return {
       "stats": stats,
-      "fullscreen": False,
       "repeat": False,
       "subtitledelay": 0,
       "equalizer": [],
@@ -75,7 +227,6 @@ def mpc_to_vlc(status):
       "audiofilters": {
         "filter_0": ""
       },
-      "rate": status['playbackrate'],
       "videoeffects": {
         "hue": 0,
         "saturation": 1,
@@ -85,74 +236,171 @@ def mpc_to_vlc(status):
       },
       "loop": False,
       "version": "2.2.1 Terry Pratchett (Weatherwax)",
-      "position": position,
-      "information": {
-        "chapter": 0,
-        "chapters": [0],
-        "title": 0,
-        "category": {
-          "Stream 0": {
-            "Frame_rate": "23.976216",
-            "Decoded_format": "Planar 4: 2: 0 YVU",
-            "Type": "Video",
-            "Codec": "H264 - MPEG-4 AVC (part 10) (avc1)",
-            "Display_resolution": "1920x1040",
-            "Resolution": "1920x1040"
-          },
-          "Stream 1": {
-            "Type": "Audio",
-            "Channels": "3F2R/LFE",
-            "AAC_extension": "SBR",
-            "Sample_rate": "48000 Hz",
-            "Codec": "MPEG AAC Audio (mp4a)"
-          },
-          # "meta": {
-          #   "NUMBER_OF_FRAMES": "162607",
-          #   "DURATION": "01: 55: 37.899000000",
-          #   "filename": status['filepath'],
-          #   "_STATISTICS_TAGS": ("BPS DURATION NUMBER_OF_FRAMES "
-          #                        "NUMBER_OF_BYTES"),
-          #   "NUMBER_OF_BYTES": "163113973",
-          #   "_STATISTICS_WRITING_APP": ("mkvmerge v7.7.0 ('Six Voices')
-          #                               "32bit"
-          #                               "built on Feb 28 2015 23: 23: 00"),
-          #   "BPS": "188084",
-          #   "_STATISTICS_WRITING_DATE_UTC": "2015-09-13 03: 40: 53"
-          # }
-        },
-        "titles": [0]
-      },
     }
 
-    vlc_playlist = {
-      "ro": "rw",
-      "type": "node",
-      "name": "Undefined",
-      "id": "1",
-      "children": [{
-          "ro": "ro",
-          "type": "node",
-          "name": "Playlist",
-          "id": "2",
-          "children": [{
-              "ro": "rw",
-              "type": "leaf",
-              "name": status['file'],
-              "id": "4",
-              "duration": vlc_duration,
-              "uri": pathlib.Path(status['filepath']).as_uri(),
-              "current": "current"
-            }]
-        },
-        {
-          "ro": "ro",
-          "type": "node",
-          "name": "Media Library",
-          "id": "3",
-          "children": []
-        }]
+
+def _vlc_category(filename, probed=None):
+    '''information.category: meta, plus a "Stream n" per probed stream'''
+    meta = {'filename': filename}
+    category = {'meta': meta}
+    if probed:
+        if probed.get('title'):
+            meta['title'] = probed['title']
+        for number, stream in enumerate(probed['streams']):
+            category['Stream {}'.format(number)] = stream
+    return category
+
+
+def _vlc_information(category):
+    return {
+      "chapter": 0,
+      "chapters": [0],
+      "title": 0,
+      "category": category,
+      "titles": [0]
     }
 
+
+# built and encoded once; shared (read-only) by every VlcStatus
+status_constants = _vlc_status_constants()
+_status_constants_json = dumps(status_constants)
+
+# (information dict, its json) for the last VlcStatus encoded
+_information_json = (None, b'')
+
+_leaf_constants = {"ro": "rw", "type": "leaf", "id": "4",
+                   "current": "current"}
+# playlist.json up to and after the current file's entry
+_playlist_prefix, _playlist_suffix = dumps(
+    _vlc_playlist('@leaf@')).split(dumps('@leaf@'))
+
+
+class VlcStatus:
+    '''The fields of vlc's status.json that follow mpc-hc's status
+
+    The rest is status_constants, spliced in pre-encoded by encode().
+    Treated as immutable: replace() returns an updated copy.
+    '''
+    # information last: encode() splices it in separately
+    __slots__ = ('volume', 'position', 'time', 'length', 'state', 'rate',
+                 'fullscreen', 'stale', 'information')
+
+    def __init__(self, *, volume=0, position=0.0, time=0.0, length=0,
+                 state='stopped', rate=1.0, fullscreen=False, stale=False,
+                 information=None):
+        if information is None:
+            information = _vlc_information({})
+
+        self.volume = volume
+        self.position = position
+        self.time = time
+        self.length = length
+        self.state = state
+        self.rate = rate
+        self.fullscreen = fullscreen
+        # mpc-hc is unreachable and this is the last status it gave
+        self.stale = stale
+        self.information = information
+
+    @classmethod
+    def from_dict(cls, status):
+        '''From a decoded status.json (or anything with the same keys)'''
+        return cls(**{name: status[name] for name in cls.__slots__
+                      if name in status})
+
+    def replace(self, **fields):
+        new = object.__new__(VlcStatus)
+        for name in self.__slots__:
+            setattr(new, name, fields.get(name, getattr(self, name)))
+        return new
+
+    def fields(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def as_dict(self):
+        status = dict(status_constants)
+        status.update(self.fields())
+        return status
+
+    def encode(self):
+        global _information_json
+        # information only changes with the file; reuse its encoding
+        information = self.information
+        if _information_json[0] is not information:
+            _information_json = (information, dumps(information))
+
+        fields = {name: getattr(self, name) for name in self.__slots__[:-1]}
+        return b''.join((dumps(fields)[:-1], b',"information":',
+                         _information_json[1], b',',
+                         _status_constants_json[1:]))
+
+    def __repr__(self):
+        return 'VlcStatus({})'.format(', '.join(
+            '{}={!r}'.format(name, value)
+            for name, value in self.fields().items()))
+
+
+class VlcPlaylist:
+    '''vlc's playlist.json, which only ever holds mpc-hc's current file'''
+    __slots__ = ('name', 'duration', 'uri')
+
+    def __init__(self, *, name='', duration=0, uri=''):
+        self.name = name
+        self.duration = duration
+        self.uri = uri
+
+    @classmethod
+    def from_mpc(cls, status):
+        return cls(name=status['file'], duration=_vlc_duration(status),
+                   uri=_file_uri(status['filepath']))
+
+    @classmethod
+    def from_dict(cls, playlist):
+        '''From a decoded playlist.json'''
+        try:
+            leaf = playlist['children'][0]['children'][0]
+        except (KeyError, IndexError):
+            return cls()
+        return cls(**{name: leaf[name] for name in cls.__slots__
+                      if name in leaf})
+
+    def leaf(self):
+        leaf = dict(_leaf_constants)
+        leaf.update(name=self.name, duration=self.duration, uri=self.uri)
+        return leaf
+
+    def as_dict(self):
+        return _vlc_playlist(self.leaf())
+
+    def encode(self):
+        return _playlist_prefix + dumps(self.leaf()) + _playlist_suffix
+
+
+def mpc_to_vlc(status):
+    fields = {}
+    for inputs, derive in status_derivations:
+        fields.update(derive(status))
+
+    return VlcStatus(**fields), VlcPlaylist.from_mpc(status)
+
+
+def update_vlc(vlc_status, vlc_playlist, status, changed):
+    '''Re-derive only the vlc fields that depend on the changed mpc fields
+
+    Returns new (status, playlist); the ones passed in are left untouched so
+    anyone still holding them sees a consistent snapshot.
+    '''
+    updates = {}
+    for inputs, derive in status_derivations:
+        if not changed.isdisjoint(inputs):
+            updates.update(derive(status))
+
+    if updates:
+        vlc_status = vlc_status.replace(**updates)
+
+    if not changed.isdisjoint(playlist_inputs):
+        vlc_playlist = VlcPlaylist.from_mpc(status)
+
     return vlc_status, vlc_playlist
 
 
@@ -160,57 +408,238 @@ def test():
     import pprint
     status = parse_status(open('status.html', 'rt').read())
     pprint.pprint(status)
-    pprint.pprint(mpc_to_vlc(status))
+    vlc_status, vlc_playlist = mpc_to_vlc(status)
+    pprint.pprint(vlc_status.as_dict())
+    pprint.pprint(vlc_playlist.as_dict())
 
 
 class StatusPoller:
-    def __init__(self, *, host=None, port=None, delay=0.1):
+    def __init__(self, *, host=None, port=None, delay=None, name=None):
         super().__init__()
-        StatusPoller.instance = self
 
         if host is None:
             host = config.host
         if port is None:
             port = config.mpc_port
 
+        if name is None:
+            name = '{}:{}'.format(host, port)
+
         self.host = host
         self.port = port
-        self.delay = delay
-        self.status_url = ('http://{host}:{port}/variables.html'
-                           ''.format(host=host, port=port))
-        self.request = httpclient.HTTPRequest(self.status_url)
+        self.name = name
+        self.scheduler = PollScheduler(delay=delay)
+        self.client = get_client(host, port)
+        self.queue = get_queue(host, port)
+        self.status_url = self.client.url('variables.html')
+        self.request = self.client.request('variables.html')
         logger.debug('Status request URL=%s', self.status_url)
         self.mpc_status = {}
-        self.status = {}
-        self.playlist = {}
-        self.fullscreen = False
+        self.status = VlcStatus()
+        self.playlist = VlcPlaylist()
+        # bumped whenever status or playlist change; safe to cache against
+        self.status_version = 0
+        self._last_body = None
+        self._fullscreen = False
+        self._encoded = {}
+        self._listeners = []
+        # monotonic time the last successful fetch was started
+        self.updated_at = None
+        self._inflight = None
+
+    @property
+    def fullscreen(self):
+        return self._fullscreen
+
+    @fullscreen.setter
+    def fullscreen(self, fullscreen):
+        self._fullscreen = fullscreen
+        self.status = self.status.replace(fullscreen=fullscreen)
+        self._changed()
+
+    def encoded(self, kind):
+        '''Encoded json of the current status or playlist (by attribute name)'''
+        key = (kind, self.status_version)
+        try:
+            return self._encoded[key]
+        except KeyError:
+            pass
+
+        if any(version != self.status_version
+               for _, version in self._encoded):
+            self._encoded.clear()
+
+        encoded = EncodedJson(body=getattr(self, kind).encode())
+        self._encoded[key] = encoded
+        return encoded
+
+    def touch(self):
+        '''Note that a remote wants status (see PollScheduler)'''
+        self.scheduler.touch()
+
+    @property
+    def age(self):
+        '''Seconds since the current status was fetched'''
+        if self.updated_at is None:
+            return float('inf')
+        return time.monotonic() - self.updated_at
 
-    @gen.coroutine
     def update_status(self):
-        client = httpclient.AsyncHTTPClient()
+        '''Fetch status, sharing the fetch with any other caller already
+        waiting on one'''
+        if self._inflight is None:
+            future = self._fetch_status()
+            # one refused by the circuit breaker is already over
+            if not future.done():
+                self._inflight = future
+            return future
+        return self._inflight
 
+    @gen.coroutine
+    def _fetch_status(self):
+        started = time.monotonic()
         try:
-            response = yield client.fetch(self.request)
-            self._status_received(response.body)
+            response = yield self.queue.submit_background(self.request)
+        except Exception:
+            if not self.queue.breaker.closed:
+                self._set_stale(True)
+            raise
         finally:
-            client.close()
+            self._inflight = None
+        metrics.poll_seconds.observe(time.monotonic() - started,
+                                     player=self.name)
+        self.updated_at = started
+        self._set_stale(False)
+        self._status_received(response.body)
+
+    def _set_stale(self, stale):
+        if self.status.stale != stale:
+            self.status = self.status.replace(stale=stale)
+            self._changed()
+
+    @gen.coroutine
+    def refresh(self, max_age=None):
+        '''Fetch status now if it's older than max_age seconds'''
+        if max_age is None:
+            max_age = config.status_max_age
+        if self.age > max_age:
+            yield self.update_status()
+
+    @gen.coroutine
+    def refresh_since(self, since, timeout=None):
+        '''Wait for status fetched after monotonic time `since`
+
+        Used after sending a command so the reply shows its effect.  Gives up
+        quietly after timeout seconds, leaving the last known status.
+        '''
+        if timeout is None:
+            timeout = config.command_refresh_timeout
+
+        @gen.coroutine
+        def refresh():
+            # a fetch already in flight may predate `since`; wait it out
+            while self.updated_at is None or self.updated_at < since:
+                yield self.update_status()
+
+        try:
+            yield gen.with_timeout(datetime.timedelta(seconds=timeout),
+                                   refresh())
+        except gen.TimeoutError:
+            logger.debug('No post-command status within %.2fs', timeout)
 
     def _status_received(self, status_html):
+        # the raw body is its own fingerprint; comparing it is cheaper than
+        # hashing it, and most polls return exactly the same page
+        if status_html == self._last_body:
+            return False
+
+        t0 = time.perf_counter()
         mpc_status = parse_status(status_html)
+        t1 = time.perf_counter()
+        metrics.parse_seconds.observe(t1 - t0, player=self.name)
+        self._last_body = status_html
+
+        old_status = self.mpc_status
+        changed = {key for key, value in mpc_status.items()
+                   if key not in old_status or old_status[key] != value}
+        changed.update(key for key in old_status if key not in mpc_status)
+        if not changed:
+            return False
+
+        if not old_status:
+            status, self.playlist = mpc_to_vlc(mpc_status)
+            self.status = status.replace(fullscreen=self._fullscreen)
+        else:
+            self.status, self.playlist = update_vlc(self.status, self.playlist,
+                                                    mpc_status, changed)
         self.mpc_status = mpc_status
-        self.status, self.playlist = mpc_to_vlc(mpc_status)
-        self.status['fullscreen'] = self.fullscreen
+        metrics.translate_seconds.observe(time.perf_counter() - t1,
+                                          player=self.name)
+        self._changed()
+
+        if 'filepath' in changed and mpc_status.get('filepath'):
+            IOLoop.current().spawn_callback(self._probe_streams, mpc_status)
+        return True
+
+    @gen.coroutine
+    def _probe_streams(self, mpc_status):
+        '''Fill in information.category from the file's headers'''
+        if not config.probe_streams:
+            return
+
+        filepath = mpc_status['filepath']
+        try:
+            probed = yield probe.probe(filepath)
+        except Exception as ex:
+            logger.warning('Probing %s failed', filepath, exc_info=ex)
+            return
+
+        if probed is None or self.mpc_status.get('filepath') != filepath:
+            return
+        category = _vlc_category(mpc_status['file'], probed)
+        self.status = self.status.replace(
+            information=_vlc_information(category))
+        self._changed()
+
+    def add_listener(self, callback):
+        '''callback() is called whenever status_version changes'''
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _changed(self):
+        self.status_version += 1
+        for callback in list(self._listeners):
+            try:
+                callback()
+            except Exception as ex:
+                logger.error('Status listener %s failed', callback,
+                             exc_info=ex)
 
     @gen.coroutine
     def run(self):
         logger.debug('Status poller started')
+        scheduler = self.scheduler
         while True:
+            delay = None
             try:
                 yield self.update_status()
+            except CircuitOpen:
+                # nothing was sent; wait until the breaker allows a probe
+                delay = max(self.queue.breaker.retry_in, scheduler.delay)
             except Exception as ex:
-                logger.warning('Update failed', exc_info=ex)
-                yield gen.sleep(5 * self.delay)
-            yield gen.sleep(self.delay)
+                scheduler.failure()
+                metrics.poll_failures.inc(player=self.name)
+                logger.warning('Update failed (%d in a row)',
+                               scheduler.failures, exc_info=ex)
+            else:
+                scheduler.success()
+            if delay is None:
+                delay = scheduler.next_delay(self.status.state)
+            if scheduler.failures:
+                metrics.poll_backoff_seconds.observe(delay, player=self.name)
+            yield scheduler.sleep(delay)
 
 
 if __name__ == '__main__':
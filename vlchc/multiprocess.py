@@ -0,0 +1,383 @@
+import os
+import json
+import mmap
+import time
+import base64
+import struct
+import socket
+import logging
+import urllib.parse
+
+import tornado.netutil
+import tornado.process
+import tornado.httpserver
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . import config
+from .encoding import EncodedJson, dumps
+from .mpc_status import VlcStatus, VlcPlaylist
+from .mpc_http import MpcHttpClient
+from .auth import session_secret
+from .players import PlayerRegistry, configured_players
+from .library import index as library_index
+from .push import StatusBroadcaster
+
+
+logger = logging.getLogger(__name__)
+
+# seqlock counter, status_version, then the lengths of the status, playlist
+# and mpc-hc status json that follow the header
+_header = struct.Struct('<QQIII')
+# last time (time.monotonic) any worker had a request for status
+_demand = struct.Struct('<d')
+_demand_offset = 32
+# time.monotonic of the poller's last successful fetch
+_updated = struct.Struct('<d')
+_updated_offset = 40
+# time.monotonic a worker last wanted fresher status, and of the latest such
+# request the poller process has finished fetching for
+_refresh = struct.Struct('<d')
+_refresh_requested_offset = 48
+_refresh_done_offset = 56
+_data_offset = 64
+
+# how often a worker waiting on a refresh checks whether it's done
+_refresh_wait_interval = 0.005
+
+
+class SharedStatus:
+    '''Shared-memory segment holding one player's encoded status
+
+    Created before forking so every process maps the same pages.  A single
+    writer (the poller process) publishes under a seqlock; readers retry if
+    they catch it mid-write.
+    '''
+
+    def __init__(self, size=None):
+        if size is None:
+            size = config.shared_status_bytes
+        self.size = size
+        self.mm = mmap.mmap(-1, size)
+
+    @property
+    def version(self):
+        return _header.unpack_from(self.mm, 0)[1]
+
+    def publish(self, version, status, playlist, mpc_status):
+        data_len = len(status) + len(playlist) + len(mpc_status)
+        if _data_offset + data_len > self.size:
+            logger.error('Status (%d bytes) too large for shared segment',
+                         data_len)
+            return False
+
+        mm = self.mm
+        seq = _header.unpack_from(mm, 0)[0]
+        struct.pack_into('<Q', mm, 0, seq + 1)
+        mm[_data_offset:_data_offset + data_len] = (status + playlist +
+                                                    mpc_status)
+        _header.pack_into(mm, 0, seq + 1, version, len(status),
+                          len(playlist), len(mpc_status))
+        struct.pack_into('<Q', mm, 0, seq + 2)
+        return True
+
+    def read(self, known_version=None):
+        '''(version, status, playlist, mpc_status), or None if the version
+        is still known_version (or nothing was published yet)'''
+        mm = self.mm
+        while True:
+            seq, version, status_len, playlist_len, mpc_len = \
+                _header.unpack_from(mm, 0)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            if seq == 0 or version == known_version:
+                return None
+
+            end = _data_offset + status_len + playlist_len + mpc_len
+            data = mm[_data_offset:end]
+            if _header.unpack_from(mm, 0)[0] == seq:
+                break
+
+        status = data[:status_len]
+        playlist = data[status_len:status_len + playlist_len]
+        return version, status, playlist, data[status_len + playlist_len:]
+
+    @property
+    def demand(self):
+        return _demand.unpack_from(self.mm, _demand_offset)[0]
+
+    def touch(self):
+        _demand.pack_into(self.mm, _demand_offset, time.monotonic())
+
+    @property
+    def updated_at(self):
+        return _updated.unpack_from(self.mm, _updated_offset)[0] or None
+
+    @updated_at.setter
+    def updated_at(self, value):
+        _updated.pack_into(self.mm, _updated_offset, value or 0.0)
+
+    @property
+    def refresh_requested(self):
+        return _refresh.unpack_from(self.mm, _refresh_requested_offset)[0]
+
+    def request_refresh(self):
+        '''Ask the poller process for a fetch; returns the request's time'''
+        requested = time.monotonic()
+        _refresh.pack_into(self.mm, _refresh_requested_offset, requested)
+        return requested
+
+    @property
+    def refresh_done(self):
+        return _refresh.unpack_from(self.mm, _refresh_done_offset)[0]
+
+    @refresh_done.setter
+    def refresh_done(self, value):
+        _refresh.pack_into(self.mm, _refresh_done_offset, value)
+
+
+class SharedStatusWriter:
+    '''Poller process side: publishes a StatusPoller's changes, and passes
+    workers' demand on to its scheduler'''
+
+    def __init__(self, poller, segment):
+        self.poller = poller
+        self.segment = segment
+        self._last_demand = 0.0
+        self._last_refresh = 0.0
+        self._refreshing = False
+        poller.add_listener(self.publish)
+        self._demand_check = PeriodicCallback(
+            self._check_demand, 1000 * config.shared_check_interval)
+        self._demand_check.start()
+
+    def publish(self):
+        poller = self.poller
+        self.segment.publish(poller.status_version,
+                             poller.encoded('status').body,
+                             poller.encoded('playlist').body,
+                             dumps(poller.mpc_status))
+
+    def _check_demand(self):
+        # polls that change nothing aren't published, but still count for
+        # the workers' idea of status age
+        self.segment.updated_at = self.poller.updated_at
+        demand = self.segment.demand
+        if demand > self._last_demand:
+            self._last_demand = demand
+            self.poller.touch()
+
+        requested = self.segment.refresh_requested
+        if requested > self._last_refresh and not self._refreshing:
+            self._last_refresh = requested
+            self._refreshing = True
+            IOLoop.current().spawn_callback(self._refresh_for_workers, requested)
+
+    @gen.coroutine
+    def _refresh_for_workers(self, requested):
+        try:
+            yield self.poller.refresh()
+        except Exception as ex:
+            logger.debug('Refresh for workers failed', exc_info=ex)
+        finally:
+            self._refreshing = False
+            self.segment.updated_at = self.poller.updated_at
+            self.segment.refresh_done = requested
+
+
+class SharedStatusReader:
+    '''Worker side stand-in for StatusPoller, reading a SharedStatus
+
+    Bytes are copied out of the segment once per version per worker; every
+    request in between is served from that copy.
+    '''
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.status_version = 0
+        self._encoded = {}
+        self._decoded = {}
+        self._listeners = []
+        self._check = None
+
+    def _update(self):
+        snapshot = self.segment.read(self.status_version)
+        if snapshot is None:
+            return False
+
+        version, status, playlist, mpc_status = snapshot
+        self.status_version = version
+        self._encoded = {'status': EncodedJson(body=status),
+                         'playlist': EncodedJson(body=playlist),
+                         'mpc_status': EncodedJson(body=mpc_status),
+                         }
+        self._decoded = {}
+        return True
+
+    def encoded(self, kind):
+        self._update()
+        try:
+            return self._encoded[kind]
+        except KeyError:
+            return EncodedJson({})
+
+    def _decode(self, kind, record=None):
+        self._update()
+        try:
+            return self._decoded[kind]
+        except KeyError:
+            value = json.loads(self.encoded(kind).body.decode('utf-8'))
+            if record is not None:
+                value = record.from_dict(value)
+            self._decoded[kind] = value
+            return value
+
+    @property
+    def status(self):
+        return self._decode('status', VlcStatus)
+
+    @property
+    def playlist(self):
+        return self._decode('playlist', VlcPlaylist)
+
+    @property
+    def mpc_status(self):
+        return self._decode('mpc_status')
+
+    def touch(self):
+        self.segment.touch()
+
+    @property
+    def age(self):
+        updated_at = self.segment.updated_at
+        if updated_at is None:
+            return float('inf')
+        return time.monotonic() - updated_at
+
+    @gen.coroutine
+    def refresh(self, max_age=None):
+        '''Have the poller process fetch status if what's shared is older
+        than max_age seconds, waiting at most shared_refresh_timeout'''
+        if max_age is None:
+            max_age = config.status_max_age
+        if self.age <= max_age:
+            return
+
+        segment = self.segment
+        requested = segment.request_refresh()
+        deadline = requested + config.shared_refresh_timeout
+        # done, even unsuccessfully (mpc-hc unreachable), ends the wait
+        while (self.age > max_age and segment.refresh_done < requested and
+               time.monotonic() < deadline):
+            yield gen.sleep(_refresh_wait_interval)
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+        if self._check is None:
+            self._check = PeriodicCallback(
+                self._check_version, 1000 * config.shared_check_interval)
+            self._check.start()
+
+    def remove_listener(self, callback):
+        self._listeners.remove(callback)
+
+    def _check_version(self):
+        if self._listeners and self._update():
+            for callback in list(self._listeners):
+                callback()
+
+
+class RemotePlayer:
+    '''A player whose poller lives in another process
+
+    Status comes from shared memory; commands are forwarded to the poller
+    process over one pooled http client.
+    '''
+
+    def __init__(self, name, segment, forward_port, vlc_port=None):
+        self.name = name
+        self.host = None
+        self.port = None
+        self.vlc_port = vlc_port
+        self.poller = SharedStatusReader(segment)
+        self.forward = MpcHttpClient('127.0.0.1', forward_port)
+        self.forward_path = ('players/{}/requests/status.json'
+                             ''.format(urllib.parse.quote(name)))
+        self.broadcaster = StatusBroadcaster(self.poller)
+
+    def start(self, delay=0.0):
+        pass
+
+    @gen.coroutine
+    def forward_command(self, query):
+        auth = base64.b64encode(
+            ':{}'.format(config.vlc_password).encode('utf-8'))
+        request = self.forward.request(
+            self.forward_path + '?' + query,
+            headers={'Authorization': 'Basic ' + auth.decode('ascii')})
+        response = yield self.forward.fetch(request)
+        return response
+
+
+def serve(make_app, workers=None, *, startup=None):
+    '''Fork one poller process plus `workers` http worker processes
+
+    The poller process runs every player's StatusPoller and command queue,
+    and takes forwarded commands on 127.0.0.1:config.forward_port.  Workers
+    share the public listening sockets (config.vlc_port and any player's own
+    vlc_port), read status from shared memory and call startup(io_loop)
+    before serving.  Unix only (relies on fork).
+    '''
+    if workers is None:
+        workers = config.workers
+
+    # nothing touching the ioloop (pollers, http clients) before forking
+    infos = configured_players()
+    segments = {name: SharedStatus() for name in infos}
+    sockets = tornado.netutil.bind_sockets(config.vlc_port,
+                                           family=socket.AF_INET)
+    player_sockets = {
+        name: tornado.netutil.bind_sockets(info['vlc_port'],
+                                           family=socket.AF_INET)
+        for name, info in infos.items()
+        if info['vlc_port'] not in (None, config.vlc_port)}
+    # every process must accept the others' session cookies
+    cookie_secret = session_secret()
+
+    task_id = tornado.process.fork_processes(workers + 1)
+    io_loop = IOLoop.current()
+    if task_id == 0:
+        for sock in sockets:
+            sock.close()
+        for player_socks in player_sockets.values():
+            for sock in player_socks:
+                sock.close()
+
+        players = PlayerRegistry.from_config()
+        writers = [SharedStatusWriter(player.poller, segments[player.name])
+                   for player in players]
+        make_app(players, cookie_secret=cookie_secret).listen(
+            config.forward_port, address='127.0.0.1')
+        players.start()
+        # workers search the same index file; only this process writes it
+        library_index.start()
+        logger.info('Poller process %d serving %d player(s)', os.getpid(),
+                    len(writers))
+    else:
+        remote = PlayerRegistry()
+        for name, info in infos.items():
+            remote.players[name] = RemotePlayer(name, segments[name],
+                                                config.forward_port,
+                                                vlc_port=info['vlc_port'])
+        app = make_app(remote, cookie_secret=cookie_secret)
+        tornado.httpserver.HTTPServer(app).add_sockets(sockets)
+        for name, player_socks in player_sockets.items():
+            app = make_app(remote, default=remote.players[name],
+                           cookie_secret=cookie_secret)
+            tornado.httpserver.HTTPServer(app).add_sockets(player_socks)
+        if startup is not None:
+            startup(io_loop)
+        logger.info('Worker %d (pid %d) serving', task_id, os.getpid())
+
+    io_loop.start()
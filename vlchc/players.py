@@ -0,0 +1,96 @@
+import logging
+import collections
+
+from tornado.ioloop import IOLoop
+
+from . import config
+from .mpc_http import get_client
+from .command_queue import get_queue
+from .mpc_status import StatusPoller
+from .push import StatusBroadcaster
+
+
+logger = logging.getLogger(__name__)
+
+
+class Player:
+    '''One MPC-HC instance: its connection pool, command queue and poller'''
+
+    def __init__(self, name, host, mpc_port, *, vlc_port=None):
+        self.name = name
+        self.host = host
+        self.port = mpc_port
+        self.vlc_port = vlc_port
+        self.client = get_client(host, mpc_port)
+        self.queue = get_queue(host, mpc_port)
+        self.poller = StatusPoller(host=host, port=mpc_port, name=name)
+        self.broadcaster = None
+        # set when commands go to a poller in another process
+        self.forward = None
+
+    def __repr__(self):
+        return ('<Player {} {}:{}>'
+                ''.format(self.name, self.host, self.port))
+
+    def start(self, delay=0.0):
+        '''Start polling after delay seconds'''
+        if self.broadcaster is None:
+            self.broadcaster = StatusBroadcaster(self.poller)
+        IOLoop.current().call_later(delay, self.poller.run)
+
+
+class PlayerRegistry:
+    def __init__(self):
+        self.players = collections.OrderedDict()
+
+    def __iter__(self):
+        return iter(self.players.values())
+
+    def __len__(self):
+        return len(self.players)
+
+    def __getitem__(self, name):
+        return self.players[name]
+
+    @property
+    def default(self):
+        return next(iter(self.players.values()))
+
+    def add(self, name, host, mpc_port, *, vlc_port=None):
+        if name in self.players:
+            raise ValueError('Duplicate player name: {!r}'.format(name))
+
+        player = Player(name, host, mpc_port, vlc_port=vlc_port)
+        self.players[name] = player
+        return player
+
+    def start(self, stagger=None):
+        '''Start all pollers, spreading their first polls over stagger
+        seconds so they don't all hit the network at once'''
+        if stagger is None:
+            stagger = config.poll_stagger
+
+        for idx, player in enumerate(self):
+            player.start(stagger * idx / len(self))
+        logger.debug('Started %d player(s)', len(self))
+
+    @classmethod
+    def from_config(cls):
+        registry = cls()
+        for name, info in configured_players().items():
+            registry.add(name, info['host'], info['mpc_port'],
+                         vlc_port=info['vlc_port'])
+        return registry
+
+
+def configured_players():
+    '''config.players with defaults filled in'''
+    players = config.players
+    if not players:
+        players = {'default': {}}
+
+    return collections.OrderedDict(
+        (name, dict(host=info.get('host', config.host),
+                    mpc_port=info.get('mpc_port', config.mpc_port),
+                    vlc_port=info.get('vlc_port')))
+        for name, info in players.items())
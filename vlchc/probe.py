@@ -0,0 +1,564 @@
+'''Stream info for the playing file, read from its container headers
+
+Matroska/WebM (EBML) and MP4/MOV (atoms) are understood.  Files are mapped
+with mmap and only the header elements are touched: Matroska stops at the
+first cluster (following the seek head if the tracks come later), MP4 hops
+over everything but moov.  Probing runs in a process pool; results are
+cached by (path, size, mtime) in memory and in config.probe_db, so playing
+a file again costs a stat().
+'''
+import os
+import json
+import mmap
+import struct
+import sqlite3
+import logging
+import threading
+import multiprocessing
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from tornado import gen
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+# (vlc codec description, fourcc) by matroska codec id / mp4 sample entry
+codec_names = {
+    'V_MPEG4/ISO/AVC': ('H264 - MPEG-4 AVC (part 10)', 'avc1'),
+    'V_MPEGH/ISO/HEVC': ('MPEG-H Part2/HEVC (H.265)', 'hevc'),
+    'V_AV1': ("AOMedia's AV1 Video", 'av01'),
+    'V_VP9': ("Google/On2's VP9 Video", 'VP90'),
+    'V_VP8': ("Google/On2's VP8 Video", 'VP80'),
+    'V_MPEG4/ISO/ASP': ('MPEG-4 Video', 'mp4v'),
+    'V_MPEG2': ('MPEG-1/2 Video', 'mpgv'),
+    'V_MPEG1': ('MPEG-1/2 Video', 'mpgv'),
+    'V_MS/VFW/FOURCC': ('Video for Windows', 'vfw '),
+    'A_AAC': ('MPEG AAC Audio', 'mp4a'),
+    'A_AC3': ('A52 Audio (aka AC3)', 'a52 '),
+    'A_EAC3': ('E-AC3 Audio', 'eac3'),
+    'A_DTS': ('DTS Audio', 'dts '),
+    'A_TRUEHD': ('TrueHD Audio', 'mlp '),
+    'A_FLAC': ('FLAC (Free Lossless Audio Codec)', 'flac'),
+    'A_OPUS': ('Opus Audio', 'Opus'),
+    'A_VORBIS': ('Vorbis Audio', 'vorb'),
+    'A_MPEG/L3': ('MPEG Audio layer 1/2/3', 'mpga'),
+    'A_MPEG/L2': ('MPEG Audio layer 1/2/3', 'mpga'),
+    'A_PCM': ('PCM Audio', 'araw'),
+    'S_TEXT/UTF8': ('Text subtitles with various tags', 'subt'),
+    'S_TEXT/ASS': ('SubStation Alpha', 'ssa '),
+    'S_TEXT/SSA': ('SubStation Alpha', 'ssa '),
+    'S_HDMV/PGS': ('HDMV Presentation Graphic Stream subtitles', 'pgs '),
+    'S_VOBSUB': ('DVD subtitles', 'spu '),
+    'avc1': ('H264 - MPEG-4 AVC (part 10)', 'avc1'),
+    'avc3': ('H264 - MPEG-4 AVC (part 10)', 'avc1'),
+    'hvc1': ('MPEG-H Part2/HEVC (H.265)', 'hevc'),
+    'hev1': ('MPEG-H Part2/HEVC (H.265)', 'hevc'),
+    'av01': ("AOMedia's AV1 Video", 'av01'),
+    'vp09': ("Google/On2's VP9 Video", 'VP90'),
+    'mp4v': ('MPEG-4 Video', 'mp4v'),
+    'mp4a': ('MPEG AAC Audio', 'mp4a'),
+    'ac-3': ('A52 Audio (aka AC3)', 'a52 '),
+    'ec-3': ('E-AC3 Audio', 'eac3'),
+    'Opus': ('Opus Audio', 'Opus'),
+    'fLaC': ('FLAC (Free Lossless Audio Codec)', 'flac'),
+    '.mp3': ('MPEG Audio layer 1/2/3', 'mpga'),
+    'tx3g': ('tx3g subtitles', 'tx3g'),
+    'wvtt': ('WebVTT subtitles', 'wvtt'),
+}
+
+channel_names = {1: 'Mono', 2: 'Stereo', 6: '3F2R/LFE', 8: '3F2M2R/LFE'}
+
+
+def _codec(codec_id):
+    name = codec_names.get(codec_id)
+    if name is None:
+        # A_AAC/MPEG4/LC and friends
+        name = codec_names.get(codec_id.split('/')[0])
+    if name is None:
+        return codec_id
+    return '{} ({})'.format(*name)
+
+
+def _video(codec_id, width, height, display_width=None,
+           display_height=None, frame_rate=None, language=None, name=None):
+    stream = {'Type': 'Video', 'Codec': _codec(codec_id)}
+    if width and height:
+        stream['Resolution'] = '{}x{}'.format(width, height)
+        stream['Display_resolution'] = '{}x{}'.format(
+            display_width or width, display_height or height)
+    if frame_rate:
+        stream['Frame_rate'] = '{:.6f}'.format(frame_rate)
+    return _common(stream, language, name)
+
+
+def _audio(codec_id, channels=None, sample_rate=None, bits=None,
+           language=None, name=None):
+    stream = {'Type': 'Audio', 'Codec': _codec(codec_id)}
+    if channels:
+        stream['Channels'] = channel_names.get(channels, str(channels))
+    if sample_rate:
+        stream['Sample_rate'] = '{} Hz'.format(int(sample_rate))
+    if bits:
+        stream['Bits_per_sample'] = str(bits)
+    return _common(stream, language, name)
+
+
+def _subtitle(codec_id, language=None, name=None):
+    return _common({'Type': 'Subtitle', 'Codec': _codec(codec_id)},
+                   language, name)
+
+
+def _common(stream, language, name):
+    if language and language != 'und':
+        stream['Language'] = language
+    if name:
+        stream['Description'] = name
+    return stream
+
+
+# matroska
+
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TITLE = 0x7BA9
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_CODEC_ID = 0x86
+_LANGUAGE = 0x22B59C
+_NAME = 0x536E
+_DEFAULT_DURATION = 0x23E383
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_DISPLAY_WIDTH = 0x54B0
+_DISPLAY_HEIGHT = 0x54BA
+_AUDIO = 0xE1
+_SAMPLING_FREQUENCY = 0xB5
+_CHANNELS = 0x9F
+_BIT_DEPTH = 0x6264
+_CLUSTER = 0x1F43B675
+
+
+def _ebml_id(buf, pos):
+    length = 9 - buf[pos].bit_length()
+    if length > 4:
+        raise ValueError('Bad element id at {}'.format(pos))
+    return int.from_bytes(buf[pos:pos + length], 'big'), pos + length
+
+
+def _ebml_size(buf, pos):
+    '''(size or None if unknown, position after it)'''
+    first = buf[pos]
+    length = 9 - first.bit_length()
+    if length > 8:
+        raise ValueError('Bad element size at {}'.format(pos))
+    mask = 0xFF >> length
+    size = first & mask
+    unknown = size == mask
+    for byte in buf[pos + 1:pos + length]:
+        size = (size << 8) | byte
+        unknown = unknown and byte == 0xFF
+    return (None if unknown else size), pos + length
+
+
+def _ebml_elements(buf, start, end):
+    '''(id, data start, data end) of the elements between start and end'''
+    pos = start
+    while pos < end:
+        element_id, pos = _ebml_id(buf, pos)
+        size, pos = _ebml_size(buf, pos)
+        if size is None:
+            # only ever the last thing in its parent (segment, cluster)
+            yield element_id, pos, end
+            return
+        yield element_id, pos, min(pos + size, end)
+        pos += size
+
+
+def _ebml_values(buf, start, end):
+    return {element_id: (data_start, data_end)
+            for element_id, data_start, data_end
+            in _ebml_elements(buf, start, end)}
+
+
+def _uint(buf, span, default=None):
+    if span is None:
+        return default
+    return int.from_bytes(buf[span[0]:span[1]], 'big')
+
+
+def _float(buf, span, default=None):
+    if span is None:
+        return default
+    data = buf[span[0]:span[1]]
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+    return default
+
+
+def _string(buf, span, default=None):
+    if span is None:
+        return default
+    return buf[span[0]:span[1]].rstrip(b'\0').decode('utf-8', 'replace')
+
+
+def _mkv_track(buf, start, end):
+    values = _ebml_values(buf, start, end)
+    track_type = _uint(buf, values.get(_TRACK_TYPE))
+    codec_id = _string(buf, values.get(_CODEC_ID), '')
+    language = _string(buf, values.get(_LANGUAGE), 'eng')
+    name = _string(buf, values.get(_NAME))
+
+    if track_type == 1:
+        video = _ebml_values(buf, *values.get(_VIDEO, (0, 0)))
+        frame_ns = _uint(buf, values.get(_DEFAULT_DURATION))
+        return _video(codec_id,
+                      _uint(buf, video.get(_PIXEL_WIDTH)),
+                      _uint(buf, video.get(_PIXEL_HEIGHT)),
+                      _uint(buf, video.get(_DISPLAY_WIDTH)),
+                      _uint(buf, video.get(_DISPLAY_HEIGHT)),
+                      1e9 / frame_ns if frame_ns else None,
+                      language, name)
+    if track_type == 2:
+        audio = _ebml_values(buf, *values.get(_AUDIO, (0, 0)))
+        return _audio(codec_id,
+                      _uint(buf, audio.get(_CHANNELS), 1),
+                      _float(buf, audio.get(_SAMPLING_FREQUENCY), 8000.0),
+                      _uint(buf, audio.get(_BIT_DEPTH)),
+                      language, name)
+    if track_type == 17:
+        return _subtitle(codec_id, language, name)
+    return None
+
+
+def _mkv_element_at(buf, pos, end):
+    element_id, pos = _ebml_id(buf, pos)
+    size, pos = _ebml_size(buf, pos)
+    return element_id, pos, end if size is None else min(pos + size, end)
+
+
+def _probe_mkv(buf):
+    end = len(buf)
+    elements = _ebml_elements(buf, 0, end)
+    element_id, start, stop = next(elements)
+    if element_id != _EBML:
+        return None
+    for element_id, start, stop in elements:
+        if element_id == _SEGMENT:
+            break
+    else:
+        return None
+
+    segment_start, segment_end = start, stop
+    found = {}
+    seeks = {}
+    for element_id, start, stop in _ebml_elements(buf, segment_start,
+                                                  segment_end):
+        if element_id == _SEEK_HEAD:
+            for seek_id, seek_start, seek_end in _ebml_elements(buf, start,
+                                                                stop):
+                if seek_id == _SEEK:
+                    seek = _ebml_values(buf, seek_start, seek_end)
+                    target = _uint(buf, seek.get(_SEEK_ID))
+                    position = _uint(buf, seek.get(_SEEK_POSITION))
+                    if target is not None and position is not None:
+                        seeks.setdefault(target, segment_start + position)
+        elif element_id in (_INFO, _TRACKS):
+            found[element_id] = (start, stop)
+        elif element_id == _CLUSTER:
+            break
+        if len(found) == 2:
+            break
+
+    for element_id in (_INFO, _TRACKS):
+        if element_id not in found and element_id in seeks:
+            target_id, start, stop = _mkv_element_at(buf, seeks[element_id],
+                                                     segment_end)
+            if target_id == element_id:
+                found[element_id] = (start, stop)
+
+    result = {'streams': []}
+    if _INFO in found:
+        info = _ebml_values(buf, *found[_INFO])
+        scale = _uint(buf, info.get(_TIMECODE_SCALE), 1000000)
+        duration = _float(buf, info.get(_DURATION))
+        if duration:
+            result['duration'] = duration * scale / 1e9
+        title = _string(buf, info.get(_TITLE))
+        if title:
+            result['title'] = title
+    if _TRACKS in found:
+        for element_id, start, stop in _ebml_elements(buf, *found[_TRACKS]):
+            if element_id == _TRACK_ENTRY:
+                stream = _mkv_track(buf, start, stop)
+                if stream is not None:
+                    result['streams'].append(stream)
+    return result
+
+
+# mp4 / quicktime
+
+def _atoms(buf, start, end):
+    '''(type, data start, data end) of the atoms between start and end'''
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', buf, pos)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', buf, pos + 8)
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            raise ValueError('Bad atom size at {}'.format(pos))
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _child(buf, start, end, *path):
+    '''(start, end) of the first atom at path below start..end, or None'''
+    for kind in path:
+        for child_kind, child_start, child_end in _atoms(buf, start, end):
+            if child_kind == kind:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _mp4_language(packed):
+    if not packed:
+        return None
+    return ''.join(chr(((packed >> shift) & 0x1F) + 0x60)
+                   for shift in (10, 5, 0))
+
+
+def _mp4_track(buf, start, end):
+    mdhd = _child(buf, start, end, b'mdia', b'mdhd')
+    hdlr = _child(buf, start, end, b'mdia', b'hdlr')
+    stsd = _child(buf, start, end, b'mdia', b'minf', b'stbl', b'stsd')
+    if hdlr is None or stsd is None:
+        return None
+
+    handler = buf[hdlr[0] + 8:hdlr[0] + 12]
+    timescale = language = None
+    if mdhd is not None:
+        if buf[mdhd[0]] == 1:
+            timescale, = struct.unpack_from('>I', buf, mdhd[0] + 20)
+            packed, = struct.unpack_from('>H', buf, mdhd[0] + 32)
+        else:
+            timescale, = struct.unpack_from('>I', buf, mdhd[0] + 12)
+            packed, = struct.unpack_from('>H', buf, mdhd[0] + 20)
+        language = _mp4_language(packed)
+
+    # first sample entry: size, format, 6 reserved, data reference index
+    entry = stsd[0] + 8
+    if entry + 16 > stsd[1]:
+        return None
+    codec_id = buf[entry + 4:entry + 8].decode('latin-1')
+
+    if handler == b'vide':
+        width, height = struct.unpack_from('>HH', buf, entry + 32)
+        frame_rate = None
+        stts = _child(buf, start, end, b'mdia', b'minf', b'stbl', b'stts')
+        if stts is not None and timescale:
+            count, = struct.unpack_from('>I', buf, stts[0] + 4)
+            if count:
+                delta, = struct.unpack_from('>I', buf, stts[0] + 12)
+                frame_rate = timescale / delta if delta else None
+        tkhd = _child(buf, start, end, b'tkhd')
+        display_width = display_height = None
+        if tkhd is not None and tkhd[1] - tkhd[0] >= 8:
+            display_width, display_height = (
+                value >> 16 for value in
+                struct.unpack_from('>II', buf, tkhd[1] - 8))
+        return _video(codec_id, width, height, display_width,
+                      display_height, frame_rate, language)
+    if handler == b'soun':
+        channels, bits = struct.unpack_from('>HH', buf, entry + 24)
+        sample_rate, = struct.unpack_from('>I', buf, entry + 32)
+        return _audio(codec_id, channels, sample_rate >> 16, bits, language)
+    if handler in (b'subt', b'text', b'sbtl'):
+        return _subtitle(codec_id, language)
+    return None
+
+
+def _probe_mp4(buf):
+    end = len(buf)
+    atoms = _atoms(buf, 0, end)
+    kind, start, stop = next(atoms)
+    if kind not in (b'ftyp', b'moov', b'free', b'wide', b'skip'):
+        return None
+
+    for kind, start, stop in [(kind, start, stop)] + list(atoms):
+        if kind == b'moov':
+            break
+    else:
+        return None
+
+    result = {'streams': []}
+    mvhd = _child(buf, start, stop, b'mvhd')
+    if mvhd is not None:
+        if buf[mvhd[0]] == 1:
+            timescale, duration = struct.unpack_from('>IQ', buf, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', buf, mvhd[0] + 12)
+        if timescale:
+            result['duration'] = duration / timescale
+    for kind, trak_start, trak_end in _atoms(buf, start, stop):
+        if kind == b'trak':
+            stream = _mp4_track(buf, trak_start, trak_end)
+            if stream is not None:
+                result['streams'].append(stream)
+    return result
+
+
+def probe_file(path):
+    '''{'streams': [vlc stream info...], 'duration': s, 'title': ...}, or
+    None if path isn't a container this understands'''
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                magic = buf[:4]
+                if magic == b'\x1a\x45\xdf\xa3':
+                    return _probe_mkv(buf)
+                if buf[4:8] in (b'ftyp', b'moov', b'free', b'wide', b'skip',
+                                b'mdat'):
+                    return _probe_mp4(buf)
+    except (OSError, ValueError, IndexError, StopIteration,
+            struct.error) as ex:
+        logger.debug('Unable to probe %s: %s', path, ex)
+    return None
+
+
+class ProbeCache:
+    '''probe_file results by (path, size, mtime), in memory (LRU) and in an
+    sqlite file so they outlive restarts'''
+
+    def __init__(self, path=None, *, max_entries=None):
+        if path is None:
+            path = config.probe_db
+        if max_entries is None:
+            max_entries = config.probe_cache_size
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('CREATE TABLE IF NOT EXISTS probes (path TEXT '
+                         'PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                         'result TEXT)')
+            self._conn = conn
+        return self._conn
+
+    def get(self, key):
+        '''(True, result) if key was probed before, else (False, None)'''
+        path, size, mtime_ns = key
+        with self._lock:
+            try:
+                result = self._entries[key]
+            except KeyError:
+                pass
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, result
+
+            try:
+                row = self._connection().execute(
+                    'SELECT result FROM probes WHERE path = ? AND size = ? '
+                    'AND mtime_ns = ?', key).fetchone()
+            except sqlite3.Error as ex:
+                logger.warning('Probe cache unavailable: %s', ex)
+                row = None
+            if row is None:
+                self.misses += 1
+                return False, None
+
+            self.hits += 1
+            result = json.loads(row[0])
+            self._remember(key, result)
+            return True, result
+
+    def put(self, key, result):
+        with self._lock:
+            self._remember(key, result)
+            try:
+                with self._connection() as conn:
+                    conn.execute('INSERT OR REPLACE INTO probes (path, size, '
+                                 'mtime_ns, result) VALUES (?, ?, ?, ?)',
+                                 key + (json.dumps(result), ))
+            except sqlite3.Error as ex:
+                logger.warning('Unable to save probe result: %s', ex)
+
+    def _remember(self, key, result):
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+cache = ProbeCache()
+# stat() and the cache (sqlite) run here; probing in _processes
+_io_executor = ThreadPoolExecutor(max_workers=1)
+_processes = None
+
+
+def _process_pool():
+    # created on first use, so forking servers (multiprocess.serve) don't
+    # inherit one.  Not forked from here either: this process runs executor
+    # threads whose locks a fork could copy mid-use; forkserver (spawn
+    # where there's none, e.g. windows) starts children from a clean one
+    global _processes
+    if _processes is None:
+        methods = multiprocessing.get_all_start_methods()
+        method = 'forkserver' if 'forkserver' in methods else 'spawn'
+        _processes = ProcessPoolExecutor(
+            max_workers=config.probe_workers,
+            mp_context=multiprocessing.get_context(method))
+    return _processes
+
+
+def _cached(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, False, None
+    key = (path, st.st_size, st.st_mtime_ns)
+    found, result = cache.get(key)
+    return key, found, result
+
+
+@gen.coroutine
+def probe(path):
+    '''probe_file(path), from the cache if the file hasn't changed'''
+    key, found, result = yield _io_executor.submit(_cached, path)
+    if key is None or found:
+        return result
+
+    result = yield _process_pool().submit(probe_file, path)
+    _io_executor.submit(cache.put, key, result)
+    return result
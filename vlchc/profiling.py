@@ -0,0 +1,176 @@
+'''On-demand sampling profiler and tracemalloc snapshots (see admin.py)
+
+Neither does anything until started: the profiler is a thread that only
+exists while profiling, and tracemalloc is only started on request.
+'''
+import sys
+import time
+import logging
+import threading
+import tracemalloc
+import collections
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+def _collapse(frame):
+    '''frame's stack, outermost first, as 'func (file:line);...' '''
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, code.co_filename,
+                                        frame.f_lineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    '''Samples every thread's stack each interval seconds
+
+    Results are collapsed stacks ('thread;frame;frame count' per line), as
+    read by flamegraph.pl and speedscope.
+    '''
+
+    def __init__(self):
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.interval = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        if self.running:
+            return False
+        if interval is None:
+            interval = config.profile_interval
+
+        self.samples = collections.Counter()
+        self.sample_count = 0
+        self.interval = interval
+        self.started_at = time.time()
+        self.stopped_at = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='vlchc-profiler', daemon=True)
+        self._thread.start()
+        logger.info('Profiler started (every %.3fs)', interval)
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.stopped_at = time.time()
+        logger.info('Profiler stopped after %d samples', self.sample_count)
+        return True
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        max_samples = config.profile_max_samples
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            stacks = [names.get(ident, str(ident)) + ';' + _collapse(frame)
+                      for ident, frame in sys._current_frames().items()
+                      if ident != own_ident]
+            with self._lock:
+                self.samples.update(stacks)
+                self.sample_count += 1
+            if self.sample_count >= max_samples:
+                logger.warning('Profiler stopping at %d samples',
+                               max_samples)
+                break
+
+    def stats(self):
+        return dict(running=self.running, samples=self.sample_count,
+                    interval=self.interval, started_at=self.started_at,
+                    stopped_at=self.stopped_at)
+
+    def collapsed(self):
+        with self._lock:
+            samples = self.samples.most_common()
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in samples)
+
+
+class MemoryTracker:
+    '''tracemalloc snapshots, kept so any two can be compared'''
+
+    def __init__(self):
+        self.snapshots = collections.OrderedDict()
+        self._next_id = 0
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=None):
+        if frames is None:
+            frames = config.tracemalloc_frames
+        if self.tracing:
+            return False
+        tracemalloc.start(frames)
+        logger.info('tracemalloc started (%d frames)', frames)
+        return True
+
+    def stop(self):
+        '''Stop tracing and forget the snapshots'''
+        self.snapshots.clear()
+        if not self.tracing:
+            return False
+        tracemalloc.stop()
+        logger.info('tracemalloc stopped')
+        return True
+
+    def snapshot(self):
+        '''Take a snapshot; returns its id'''
+        if not self.tracing:
+            raise RuntimeError('tracemalloc is not running')
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        snapshot_id = self._next_id
+        self._next_id += 1
+        self.snapshots[snapshot_id] = snapshot
+        while len(self.snapshots) > config.tracemalloc_max_snapshots:
+            self.snapshots.popitem(last=False)
+        return snapshot_id
+
+    def top(self, snapshot_id, *, limit=20, key_type='lineno'):
+        stats = self.snapshots[snapshot_id].statistics(key_type)
+        return [dict(where=str(stat.traceback), size=stat.size,
+                     count=stat.count)
+                for stat in stats[:limit]]
+
+    def diff(self, first_id, second_id, *, limit=20, key_type='lineno'):
+        '''Biggest changes in allocations from first to second'''
+        stats = self.snapshots[second_id].compare_to(
+            self.snapshots[first_id], key_type)
+        return [dict(where=str(stat.traceback), size=stat.size,
+                     size_diff=stat.size_diff, count=stat.count,
+                     count_diff=stat.count_diff)
+                for stat in stats[:limit]]
+
+    def stats(self):
+        traced, peak = (tracemalloc.get_traced_memory() if self.tracing
+                        else (0, 0))
+        return dict(tracing=self.tracing, snapshots=list(self.snapshots),
+                    traced=traced, peak=peak)
+
+
+profiler = SamplingProfiler()
+memory = MemoryTracker()
@@ -0,0 +1,193 @@
+import logging
+
+from tornado import gen
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from . import config
+from .encoding import dumps
+
+
+logger = logging.getLogger(__name__)
+
+
+def merge_patch(old, new):
+    '''JSON merge patch (RFC 7396) turning old into new
+
+    Nested dicts are patched key by key; removed keys are null.  Unchanged
+    sections the poller shares between snapshots are skipped by identity.
+    '''
+    patch = {}
+    for key, value in new.items():
+        try:
+            old_value = old[key]
+        except KeyError:
+            patch[key] = value
+            continue
+
+        if old_value is value:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            sub_patch = merge_patch(old_value, value)
+            if sub_patch:
+                patch[key] = sub_patch
+        elif old_value != value:
+            patch[key] = value
+
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+class Subscriber:
+    '''One push client: what it has seen, and whether a send is pending
+
+    send(bytes) returns a Future that resolves once the message is on its way
+    out; a client that hasn't finished receiving one message doesn't get
+    queued another, it gets a single delta to whatever is current when it's
+    ready.
+    '''
+
+    def __init__(self, broadcaster, send, close):
+        self.broadcaster = broadcaster
+        self.send = send
+        self.close = close
+        self.version = None
+        self.status = None
+        self.playlist = None
+        self.sending = False
+        self.dirty = False
+        self.send_started = None
+
+    def update(self):
+        self.dirty = True
+        if self.sending:
+            lag = IOLoop.current().time() - self.send_started
+            if lag > config.push_max_lag:
+                logger.debug('Dropping push client %d seconds behind', lag)
+                self.drop()
+            return
+        IOLoop.current().spawn_callback(self._send_pending)
+
+    def heartbeat(self):
+        if not self.sending:
+            IOLoop.current().spawn_callback(self._send_heartbeat)
+
+    def drop(self):
+        self.broadcaster.unsubscribe(self)
+        self.close()
+
+    @gen.coroutine
+    def _send_heartbeat(self):
+        if (yield self._send(b'{"type":"heartbeat"}')) and self.dirty:
+            yield self._send_pending()
+
+    @gen.coroutine
+    def _send(self, message):
+        self.sending = True
+        self.send_started = IOLoop.current().time()
+        try:
+            yield self.send(message)
+        except Exception as ex:
+            logger.debug('Push client went away (%s)', ex)
+            self.drop()
+            return False
+        finally:
+            self.sending = False
+        return True
+
+    @gen.coroutine
+    def _send_pending(self):
+        while self.dirty and not self.sending:
+            self.dirty = False
+            poller = self.broadcaster.poller
+            if self.version is None:
+                message = self.broadcaster.snapshot()
+            else:
+                message = self.broadcaster.delta(self)
+                if message is None:
+                    continue
+
+            self.version = poller.status_version
+            self.status = poller.status
+            self.playlist = poller.playlist
+            if not (yield self._send(message)):
+                return
+
+
+class StatusBroadcaster:
+    '''Pushes StatusPoller changes to websocket/event-stream clients'''
+
+    def __init__(self, poller, *, heartbeat=None):
+        if heartbeat is None:
+            heartbeat = config.push_heartbeat
+
+        self.poller = poller
+        self.subscribers = set()
+        self._snapshot = None
+        self._deltas = {}
+        poller.add_listener(self._status_changed)
+        self._heartbeat = PeriodicCallback(self._send_heartbeats,
+                                           1000 * heartbeat)
+        self._heartbeat.start()
+
+    def subscribe(self, send, close):
+        subscriber = Subscriber(self, send, close)
+        self.subscribers.add(subscriber)
+        self.poller.touch()
+        subscriber.update()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def snapshot(self):
+        '''Encoded full status + playlist message for the current version'''
+        poller = self.poller
+        version = poller.status_version
+        if self._snapshot is None or self._snapshot[0] != version:
+            message = b''.join([
+                b'{"type":"snapshot","version":', str(version).encode(),
+                b',"status":', poller.encoded('status').body,
+                b',"playlist":', poller.encoded('playlist').body,
+                b'}'])
+            self._snapshot = (version, message)
+        return self._snapshot[1]
+
+    def delta(self, subscriber):
+        '''Encoded patch from what subscriber last saw to now (or None)'''
+        poller = self.poller
+        version = poller.status_version
+        if subscriber.version == version:
+            return None
+
+        key = (subscriber.version, version)
+        try:
+            return self._deltas[key]
+        except KeyError:
+            pass
+
+        if any(to_version != version for _, to_version in self._deltas):
+            self._deltas.clear()
+
+        message = {'type': 'delta',
+                   'version': version,
+                   # only VlcStatus fields change, and they're top level
+                   'status': merge_patch(subscriber.status.fields(),
+                                         poller.status.fields()),
+                   'playlist': merge_patch(subscriber.playlist.as_dict(),
+                                           poller.playlist.as_dict()),
+                   }
+        self._deltas[key] = message = dumps(message)
+        return message
+
+    def _status_changed(self):
+        for subscriber in list(self.subscribers):
+            subscriber.update()
+
+    def _send_heartbeats(self):
+        if self.subscribers:
+            # connected push clients count as wanting status
+            self.poller.touch()
+        for subscriber in list(self.subscribers):
+            subscriber.heartbeat()
@@ -0,0 +1,76 @@
+import time
+import random
+import logging
+import datetime
+
+from tornado import gen
+from tornado import locks
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    '''Decides how long the status poller sleeps between polls
+
+    Polls at full rate while remotes are asking for status and the player is
+    playing, slower when paused/stopped, near-idle when nobody has asked for a
+    while, and backs off exponentially (with jitter) on failures.
+    '''
+
+    def __init__(self, *, delay=None):
+        if delay is None:
+            delay = config.poll_delay_playing
+
+        self.state_delays = {'playing': delay,
+                             'paused': config.poll_delay_paused,
+                             'stopped': config.poll_delay_stopped,
+                             }
+        self.delay = delay
+        self.idle_delay = config.poll_delay_idle
+        self.demand_window = config.poll_demand_window
+        self.max_backoff = config.poll_backoff_max
+        self.jitter = config.poll_jitter
+        self.failures = 0
+        self.last_demand = None
+        self._wakeup = locks.Event()
+
+    @property
+    def idle(self):
+        return (self.last_demand is None or
+                time.monotonic() - self.last_demand > self.demand_window)
+
+    def touch(self):
+        '''A remote asked for status; return to full rate if idle'''
+        was_idle = self.idle
+        self.last_demand = time.monotonic()
+        if was_idle:
+            logger.debug('Remote connected; leaving idle polling')
+            self._wakeup.set()
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+
+    def next_delay(self, state=None):
+        if self.failures:
+            backoff = min(self.max_backoff, self.delay * 2 ** self.failures)
+            return random.uniform(0.5 * backoff, backoff)
+        if self.idle:
+            delay = self.idle_delay
+        else:
+            delay = self.state_delays.get(state, self.delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    @gen.coroutine
+    def sleep(self, delay):
+        '''Sleep for delay seconds, or until a remote shows up'''
+        self._wakeup.clear()
+        try:
+            yield self._wakeup.wait(timeout=datetime.timedelta(seconds=delay))
+        except gen.TimeoutError:
+            pass
@@ -1,23 +1,39 @@
 # *!* coding: utf-8 *!*
 import os
+import re
 import sys
+import hmac
+import time
+import datetime
 import logging
 import urllib.parse
-import pathlib
 
+import tornado.httpclient
 import tornado.ioloop
 import tornado.options
 import tornado.web
+import tornado.websocket
 import tornado.autoreload
 from tornado import gen
-
-import json
-
-from .mpc_client import (mpc_command, vlc_to_mpc, send_command_request,
-                         send_get_request)
-from .mpc_status import StatusPoller
-
-from .auth import basic_auth
+from tornado import locks
+from tornado.queues import QueueFull
+from tornado.iostream import StreamClosedError
+from tornado.log import access_log
+
+from .encoding import dumps
+from .mpc_client import vlc_to_mpc, send_command_request, CommandError
+from .players import PlayerRegistry
+
+from .auth import basic_auth, session_secret
+from .breaker import CircuitOpen, is_outage
+from .admin import admin_routes
+from .static_cache import StaticAssetCache
+from . import art
+from . import browse
+from . import library
+from . import metrics
+from . import multiprocess
+from . import tracing
 from . import config
 # from debug import PassThroughHandler
 
@@ -25,89 +41,223 @@ from . import config
 logger = logging.getLogger(__name__)
 server_root = os.path.abspath(os.path.dirname(__file__))
 vlc_static_root = os.path.join(server_root, 'vlc_static')
+static_assets = StaticAssetCache(vlc_static_root)
 
 
 def json_response(handler, res):
     handler.clear()
     handler.set_status(200)
     handler.set_header("Content-Type", "text/json;charset=UTF-8")
-    handler.write(json.dumps(res, ensure_ascii=False).encode('utf-8'))
+    handler.write(dumps(res))
+
+
+def cached_json_response(handler, encoded):
+    '''Send pre-encoded json, or a 304 if the client already has it'''
+    cached_response(handler, encoded, "text/json;charset=UTF-8")
+
+
+def cached_response(handler, encoded, content_type):
+    '''Send something with body/gzipped/etag (EncodedJson, StaticAsset)'''
+    tracing.begin(getattr(handler, 'request_trace', None), 'write')
+    handler.clear()
+    handler.set_status(200)
+    handler.set_header("Content-Type", content_type)
+    handler.set_header("Etag", encoded.etag)
+    handler.set_header("Vary", "Accept-Encoding")
+
+    if handler.check_etag_header():
+        handler.set_status(304)
+    elif encoded.accepts_gzip(handler.request):
+        handler.set_header("Content-Encoding", "gzip")
+        handler.write(encoded.gzipped)
+    else:
+        handler.write(encoded.body)
+
+
+def auth_func(user, password):
+    authenticated = hmac.compare_digest(password.encode('utf-8'),
+                                        config.vlc_password.encode('utf-8'))
+    logger.debug('Auth attempt %r (authenticated=%s)', user, authenticated)
+    return authenticated
 
 
+@basic_auth(auth_func=auth_func)
 class VlcStatusHandler(tornado.web.RequestHandler):
+    def initialize(self, player):
+        self.player = player
+        self.poller = player.poller
+
     @gen.coroutine
     def get(self):
         logger.debug('------ FULL URI %s', self.request.uri)
+        trace = self.request_trace
+        self.poller.touch()
         vlc_command = self.get_argument('command', '')
+        command_sent = None
 
-        try:
-            cmd_func = vlc_to_mpc[vlc_command]
-        except KeyError:
-            pass
-        else:
-            logger.debug('     - vlc %s -> mpc %s', vlc_command, mpc_command)
+        cmd_func = None
+        if vlc_command:
+            try:
+                cmd_func = vlc_to_mpc[vlc_command]
+            except KeyError:
+                raise tornado.web.HTTPError(400, 'Unknown command %r',
+                                            vlc_command)
+
+        if cmd_func is not None and self.player.forward is not None:
+            # poller (and command queue) live in another process
+            try:
+                response = yield self.player.forward_command(
+                    self.request.query)
+            except tornado.httpclient.HTTPError as ex:
+                if ex.response is None:
+                    raise
+                raise tornado.web.HTTPError(ex.code)
+            self.set_header("Content-Type", "text/json;charset=UTF-8")
+            self.write(response.body)
+            return
+
+        if cmd_func is not None:
+            logger.debug('     - vlc %s -> mpc %s', vlc_command, cmd_func)
             kw = dict(value=self.get_argument('val', default=0),
                       input_=self.get_argument('input', default=''),
+                      poller=self.poller,
                       )
 
             if kw['input_']:
                 kw['input_'] = uri_to_filename(kw['input_'])
 
             try:
-                command_dict = cmd_func(**kw)
+                with tracing.span(trace, 'vlc_to_mpc'):
+                    request = cmd_func(**kw)
+            except CommandError as ex:
+                raise tornado.web.HTTPError(400, '%s: %s', vlc_command, ex)
             except Exception as ex:
                 logger.error('Command failed (%s)', cmd_func, exc_info=ex)
             else:
-                if 'url' in command_dict:
-                    yield send_get_request(**command_dict)
+                try:
+                    player = self.player
+                    started = time.monotonic()
+                    with tracing.span(trace, 'mpc_command'):
+                        yield send_command_request(request, host=player.host,
+                                                   port=player.port)
+                except QueueFull as ex:
+                    logger.warning('Dropped %s: %s', vlc_command, ex)
+                except CircuitOpen as ex:
+                    logger.warning('Not sending %s: %s', vlc_command, ex)
+                except Exception as ex:
+                    if not is_outage(ex):
+                        raise
+                    # the reply is the last known status, marked stale
+                    logger.warning('Sending %s failed: %s', vlc_command, ex)
+                else:
+                    command_sent = time.monotonic()
+                    metrics.command_seconds.observe(
+                        command_sent - started, player=player.name,
+                        command=vlc_command)
+
+        try:
+            with tracing.span(trace, 'mpc_fetch'):
+                if command_sent is not None:
+                    yield self.poller.refresh_since(command_sent)
                 else:
-                    yield send_command_request(command_dict)
+                    yield self.poller.refresh()
+        except Exception as ex:
+            logger.debug('Status refresh failed; sending last known status',
+                         exc_info=ex)
 
-        global status_poller
-        json_response(self, status_poller.status)
+        age = self.poller.age
+        if age != float('inf'):
+            metrics.status_age_seconds.observe(age, player=self.player.name)
+        with tracing.span(trace, 'json_encode'):
+            encoded = self.poller.encoded('status')
+        cached_json_response(self, encoded)
 
 
+@basic_auth(auth_func=auth_func)
 class VlcPlaylistHandler(tornado.web.RequestHandler):
+    def initialize(self, player):
+        self.player = player
+        self.poller = player.poller
+
     @gen.coroutine
     def get(self):
-        global status_poller
-        json_response(self, status_poller.playlist)
+        self.poller.touch()
+        with tracing.span(self.request_trace, 'json_encode'):
+            encoded = self.poller.encoded('playlist')
+        cached_json_response(self, encoded)
 
 
-def get_file_info(fn):
-    try:
-        stat = os.stat(fn)
-    except Exception:
-        return None
-
-    name = os.path.split(fn)[1]
-    if not name:
-        name = fn
-
-    return {'type': 'dir' if os.path.isdir(fn) else 'file',
-            'path': os.path.abspath(fn),
-            'name': name,
-            'access_time': stat.st_atime,
-            'creation_time': stat.st_ctime,
-            'modification_time': stat.st_mtime,
-            'uid': stat.st_uid,
-            'gid': stat.st_gid,
-            'mode': stat.st_mode,
-            'size': stat.st_size,
-            'uri': pathlib.Path(fn).as_uri(),
-            }
+@basic_auth(auth_func=auth_func)
+class AuthStaticHandler(tornado.web.StaticFileHandler):
+    pass
 
 
-def auth_func(user, password):
-    authenticated = (password == config.vlc_password)
-    logger.debug('Auth attempt %r %r (authenticated=%s)',
-                 user, password, authenticated)
-    return authenticated
+@basic_auth(auth_func=auth_func)
+class ArtHandler(tornado.web.StaticFileHandler):
+    '''Cover art of the playing file, served from art.cache'''
 
+    def initialize(self, player):
+        self.player = player
+        self.root = '/'
+        self.default_filename = None
+        self.art_image = None
 
-@basic_auth(auth_func=auth_func)
-class AuthStaticHandler(tornado.web.StaticFileHandler):
-    pass
+    @gen.coroutine
+    def get(self, include_body=True):
+        self.player.poller.touch()
+        filepath = self.player.poller.mpc_status.get('filepath')
+        if filepath:
+            # the media's disk may be slow (or asleep); keep it off the loop
+            self.art_image = yield browse.executor.submit(art.lookup,
+                                                          filepath)
+        if self.art_image is None:
+            raise tornado.web.HTTPError(404)
+        yield super().get(self.art_image.path, include_body)
+
+    def head(self):
+        return self.get(include_body=False)
+
+    @classmethod
+    def get_absolute_path(cls, root, path):
+        return path
+
+    def validate_absolute_path(self, root, absolute_path):
+        # found and stat()ed by art.lookup
+        return absolute_path
+
+    def get_content(self, abspath, start=None, end=None):
+        data = self.art_image.data
+        if data is None:
+            # too big to cache: tornado's chunked reads
+            return tornado.web.StaticFileHandler.get_content(abspath, start,
+                                                             end)
+        if start is None:
+            start = 0
+        if end is None:
+            end = len(data)
+        return (data[i:min(i + config.art_chunk_size, end)]
+                for i in range(start, end, config.art_chunk_size))
+
+    def get_content_version(self, abspath):
+        return self.art_image.etag.strip('"')
+
+    def compute_etag(self):
+        return self.art_image.etag
+
+    def get_content_size(self):
+        return self.art_image.size
+
+    def get_modified_time(self):
+        # whole seconds and aware, like StaticFileHandler's own
+        return datetime.datetime.fromtimestamp(
+            self.art_image.mtime_ns // 10 ** 9, datetime.timezone.utc)
+
+    def get_cache_time(self, path, modified, mime_type):
+        return 0
+
+    def set_extra_headers(self, path):
+        # the image changes with the playing file, at the same url
+        self.set_header("Cache-Control", "no-cache")
 
 
 @basic_auth(auth_func=auth_func)
@@ -115,8 +265,55 @@ class RootHandler(tornado.web.RequestHandler):
     @gen.coroutine
     def get(self):
         logger.debug('root handler request %s', self.request)
-        with open(os.path.join(vlc_static_root, "index.html"), 'rt') as f:
-            self.write(f.read())
+        asset = static_assets.get("index.html")
+        if asset is None:
+            raise tornado.web.HTTPError(404)
+        cached_response(self, asset, "text/html; charset=UTF-8")
+        self.set_header("Cache-Control", config.static_cache_control)
+
+
+@basic_auth(auth_func=auth_func)
+class StatusWebSocket(tornado.websocket.WebSocketHandler):
+    '''Status snapshot on connect, then merge-patch deltas as it changes'''
+
+    def initialize(self, player):
+        self.player = player
+        self.poller = player.poller
+
+    def open(self):
+        broadcaster = self.player.broadcaster
+        self.subscriber = broadcaster.subscribe(self.write_message,
+                                                self.close)
+
+    def on_close(self):
+        self.player.broadcaster.unsubscribe(self.subscriber)
+
+
+@basic_auth(auth_func=auth_func)
+class StatusEventStream(tornado.web.RequestHandler):
+    '''StatusWebSocket's messages as server-sent events'''
+
+    def initialize(self, player):
+        self.player = player
+        self.poller = player.poller
+
+    @gen.coroutine
+    def get(self):
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.closed = locks.Event()
+
+        broadcaster = self.player.broadcaster
+        subscriber = broadcaster.subscribe(self.send_event, self.closed.set)
+        yield self.closed.wait()
+        broadcaster.unsubscribe(subscriber)
+
+    def send_event(self, message):
+        self.write(b'data: ' + message + b'\n\n')
+        return self.flush()
+
+    def on_connection_close(self):
+        self.closed.set()
 
 
 def uri_to_filename(uri):
@@ -134,31 +331,25 @@ def uri_to_filename(uri):
     return local_path_bytes.decode('utf-8', errors='ignore')
 
 
+@basic_auth(auth_func=auth_func)
 class VlcBrowseHandler(tornado.web.RequestHandler):
-    def path_list(self, local_path):
-        if local_path.endswith('~') or not local_path:
-            global status_poller
-            try:
-                status_poller.mpc_status['filedir']
-            except KeyError:
-                local_path = os.path.expanduser('~')
-
-        if local_path in ('c:/..', 'Volumes', 'media'):
-            if sys.platform in ('win32', ):
-                drives = ['{}:/'.format(letter) for letter in
-                          'ABCDEFGHIJKLMNOPQRSTUVWXYZ']
-                return [get_file_info(drive) for drive in drives]
-
-            local_path = '/'
+    def initialize(self, player):
+        self.player = player
+        self.poller = player.poller
 
-        logger.debug('local path is %r', local_path)
+    def _int_argument(self, name, default=None):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
 
-        if not os.path.exists(local_path):
-            print("Path doesn't exist, using default")
-            local_path = config.default_path
+        try:
+            number = int(value)
+        except ValueError:
+            number = -1
 
-        return [get_file_info(os.path.join(local_path, fn))
-                for fn in sorted(os.listdir(local_path))]
+        if number < 0:
+            raise tornado.web.HTTPError(400, 'Bad %s: %r', name, value)
+        return number
 
     @gen.coroutine
     def get(self):
@@ -166,21 +357,179 @@ class VlcBrowseHandler(tornado.web.RequestHandler):
         local_path = uri_to_filename(uri)
         logger.debug('local path %s', local_path)
 
-        file_info = self.path_list(local_path)
+        if local_path.endswith('~') or not local_path:
+            if 'filedir' not in self.poller.mpc_status:
+                local_path = os.path.expanduser('~')
+
+        fields = browse.parse_fields(self.get_argument('fields', ''))
+        if self.get_argument('stream', '') in ('1', 'true'):
+            yield self.stream_list(local_path, fields)
+            return
+
+        offset = self._int_argument('offset', 0)
+        limit = self._int_argument('limit')
+        cursor = self.get_argument('cursor', None)
+        paged = (offset or limit is not None or cursor is not None)
+        if paged and 'name' not in fields:
+            # pages are cut by name
+            fields += ('name', )
+
+        file_info = yield browse.executor.submit(browse.path_list,
+                                                 local_path, fields)
         # TODO something less lazy
+        metrics.browse_entries.observe(len(file_info))
         file_info = [info for info in file_info
                      if info is not None]
 
-        res = {'element': file_info}
+        if not paged:
+            json_response(self, {'element': file_info})
+            return
+
+        try:
+            elements, next_cursor = browse.page(file_info, offset=offset,
+                                                limit=limit, cursor=cursor)
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Bad cursor: %r', cursor)
+
+        res = {'element': elements,
+               'total': len(file_info),
+               }
+        if next_cursor is not None:
+            res['next'] = next_cursor
         json_response(self, res)
 
+    @gen.coroutine
+    def stream_list(self, local_path, fields):
+        '''Chunked browse.json, sending entries as they're read'''
+        batches = browse.iter_path_list(local_path, fields)
+        self.set_header("Content-Type", "text/json;charset=UTF-8")
+        self.write(b'{"element": [')
+        separator = b''
+        try:
+            while True:
+                batch = yield browse.executor.submit(next, batches, None)
+                if batch is None:
+                    break
+
+                self.write(separator + b','.join(dumps(info)
+                                                 for info in batch))
+                separator = b','
+                yield self.flush()
+        except StreamClosedError:
+            logger.debug('Browse client went away mid-listing')
+            return
+        finally:
+            batches.close()
+
+        self.write(b']}')
 
-def make_app():
-    return tornado.web.Application([
+
+@basic_auth(auth_func=auth_func)
+class VlcLibraryHandler(tornado.web.RequestHandler):
+    '''Search the media library: ?search=words[&limit=n]; without search,
+    the index's stats'''
+
+    def initialize(self, player):
+        self.player = player
+
+    @gen.coroutine
+    def get(self):
+        query = self.get_argument('search', '')
+        if not query.strip():
+            stats = yield library.executor.submit(library.index.stats)
+            json_response(self, {'library': stats})
+            return
+
+        limit = self.get_argument('limit', None)
+        try:
+            limit = None if limit is None else max(1, int(limit))
+        except ValueError:
+            raise tornado.web.HTTPError(400, 'Bad limit: %r', limit)
+
+        elements = yield library.executor.submit(library.index.search,
+                                                 query, limit)
+        json_response(self, {'element': elements})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    '''Prometheus text format dump of vlchc.metrics'''
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.render())
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    '''200 if every player's status is recent enough, else 503'''
+
+    def initialize(self, players):
+        self.players = players
+
+    def get(self):
+        res = {}
+        for player in self.players:
+            age = player.poller.age
+            res[player.name] = {
+                'reachable': age <= config.health_max_status_age,
+                'status_age': None if age == float('inf') else age,
+                'stale': player.poller.status.stale,
+            }
+
+        healthy = all(info['reachable'] for info in res.values())
+        json_response(self, {'healthy': healthy, 'players': res})
+        if not healthy:
+            self.set_status(503)
+
+
+def log_request(handler):
+    '''tornado's access log line, request latency per handler and the
+    request's trace'''
+    tracing.finish(handler)
+    request_time = handler.request.request_time()
+    metrics.request_seconds.observe(request_time,
+                                    handler=type(handler).__name__)
+
+    status = handler.get_status()
+    if status < 400:
+        log_method = access_log.info
+    elif status < 500:
+        log_method = access_log.warning
+    else:
+        log_method = access_log.error
+    log_method("%d %s %.2fms", status, handler._request_summary(),
+               1000.0 * request_time)
+
+
+def player_routes(player, prefix=''):
+    kwargs = dict(player=player)
+    return [
+        (prefix + r"/requests/status.json", VlcStatusHandler, kwargs),
+        (prefix + r"/requests/playlist.json", VlcPlaylistHandler, kwargs),
+        (prefix + r"/requests/browse.json", VlcBrowseHandler, kwargs),
+        (prefix + r"/requests/library.json", VlcLibraryHandler, kwargs),
+        (prefix + r"/requests/status.ws", StatusWebSocket, kwargs),
+        (prefix + r"/requests/status.events", StatusEventStream, kwargs),
+        (prefix + r"/art", ArtHandler, kwargs),
+    ]
+
+
+def make_app(players, default=None, *, cookie_secret=None):
+    '''Every player under /players/<name>/, and the default player (the
+    first one unless specified) at the root'''
+    if cookie_secret is None:
+        cookie_secret = session_secret()
+    if default is None:
+        default = players.default
+
+    routes = player_routes(default)
+    for player in players:
+        name = re.escape(urllib.parse.quote(player.name))
+        routes.extend(player_routes(player, '/players/' + name))
+
+    return tornado.web.Application(routes + admin_routes() + [
+        (r"/metrics", MetricsHandler),
+        (r"/health", HealthHandler, dict(players=players)),
         # (r"(?P<url>.*)", PassThroughHandler),
-        (r"/requests/status.json", VlcStatusHandler),
-        (r"/requests/playlist.json", VlcPlaylistHandler),
-        (r"/requests/browse.json", VlcBrowseHandler),
         (r"/.*", RootHandler),
 
         # vlc version unrecognized with this: :(
@@ -189,19 +538,37 @@ def make_app():
 
         # pass-through for debugging
         # (r"/.*", PassThroughHandler),
-    ]
+    ],
+        cookie_secret=cookie_secret,
+        log_function=log_request,
     )
 
 
-if __name__ == "__main__":
-    app = make_app()
-    app.listen(config.vlc_port)
+def start_serving(io_loop):
+    '''Caches and watchers for a process serving the web interface'''
+    static_assets.preload()
+    browse.cache.start_watching(io_loop)
 
-    status_poller = StatusPoller()
 
+if __name__ == "__main__":
     tornado.options.parse_command_line()
+    if config.workers:
+        multiprocess.serve(make_app, config.workers, startup=start_serving)
+        sys.exit(0)
+
+    players = PlayerRegistry.from_config()
+
+    cookie_secret = session_secret()
+    make_app(players, cookie_secret=cookie_secret).listen(config.vlc_port)
+    for player in players:
+        if player.vlc_port not in (None, config.vlc_port):
+            make_app(players, default=player,
+                     cookie_secret=cookie_secret).listen(player.vlc_port)
+
     ioloop = tornado.ioloop.IOLoop.instance()
-    ioloop.spawn_callback(status_poller.run)
+    start_serving(ioloop)
+    library.index.start(ioloop)
+    players.start()
     try:
         ioloop.start()
     except KeyboardInterrupt:
@@ -0,0 +1,97 @@
+import os
+import gzip
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class StaticAsset:
+    '''One file's bytes, gzipped bytes and etag'''
+    __slots__ = ('path', 'mtime', 'checked', 'body', 'gzipped', 'etag',
+                 'content_type')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime
+            self.body = f.read()
+
+        self.path = path
+        self.checked = time.monotonic()
+        self.etag = '"{}"'.format(hashlib.sha1(self.body).hexdigest())
+        self.content_type = (mimetypes.guess_type(path)[0] or
+                             'application/octet-stream')
+
+        gzipped = gzip.compress(self.body, compresslevel=9)
+        # not worth it for tiny or already-compressed files
+        self.gzipped = gzipped if len(gzipped) < len(self.body) else None
+
+    def accepts_gzip(self, request):
+        return (self.gzipped is not None and
+                'gzip' in request.headers.get('Accept-Encoding', ''))
+
+
+class StaticAssetCache:
+    '''Files under root, kept in memory and reloaded when their mtime
+    changes (checked at most every check_interval seconds per file)'''
+
+    def __init__(self, root, *, check_interval=None):
+        if check_interval is None:
+            check_interval = config.static_check_interval
+
+        self.root = os.path.abspath(root)
+        self.check_interval = check_interval
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def absolute_path(self, rel_path):
+        path = os.path.abspath(os.path.join(self.root, rel_path))
+        if os.path.commonpath([path, self.root]) != self.root:
+            return None
+        return path
+
+    def preload(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for fn in filenames:
+                self.get_absolute(os.path.join(dirpath, fn))
+        logger.debug('Loaded %d static files from %s', len(self._assets),
+                     self.root)
+
+    def get(self, rel_path):
+        '''Asset for a path relative to root, or None if there isn't one'''
+        path = self.absolute_path(rel_path)
+        if path is None:
+            return None
+        return self.get_absolute(path)
+
+    def get_absolute(self, path):
+        asset = self._assets.get(path)
+        if asset is not None:
+            now = time.monotonic()
+            if now - asset.checked < self.check_interval:
+                return asset
+
+            asset.checked = now
+            try:
+                if os.stat(path).st_mtime == asset.mtime:
+                    return asset
+            except OSError:
+                pass
+            logger.debug('Reloading static file %s', path)
+
+        try:
+            asset = StaticAsset(path)
+        except OSError:
+            with self._lock:
+                self._assets.pop(path, None)
+            return None
+
+        with self._lock:
+            self._assets[path] = asset
+        return asset
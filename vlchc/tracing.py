@@ -0,0 +1,119 @@
+'''Per-request span tracing, logged as one json line per request
+
+Off unless config.trace_requests (or /admin/trace) turns it on; while off,
+start() returns None and span(None, ...) hands back a shared no-op context
+manager, so traced code costs an attribute lookup and a call.
+'''
+import time
+import logging
+
+from .encoding import dumps
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+enabled = config.trace_requests
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.name, self.started, time.perf_counter())
+        return False
+
+
+class Trace:
+    '''Spans of one request: (name, start, end) in perf_counter seconds'''
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.spans = []
+        self._open = {}
+
+    def record(self, name, started, ended):
+        self.spans.append((name, started, ended))
+
+    def begin(self, name):
+        '''Open a span that ends when the request finishes (e.g. 'write')'''
+        self._open[name] = time.perf_counter()
+
+    def end(self, name):
+        started = self._open.pop(name, None)
+        if started is not None:
+            self.record(name, started, time.perf_counter())
+
+    def finish(self):
+        for name in list(self._open):
+            self.end(name)
+
+        ended = time.perf_counter()
+        handler = self.handler
+        request = handler.request
+        ms = 1000.0
+        return {
+            'handler': type(handler).__name__,
+            'method': request.method,
+            'uri': request.uri,
+            'status': handler.get_status(),
+            'total_ms': round(ms * (ended - self.started), 3),
+            'spans': [{'name': name,
+                       'start_ms': round(ms * (started - self.started), 3),
+                       'duration_ms': round(ms * (ended - started), 3),
+                       }
+                      for name, started, ended in self.spans],
+        }
+
+
+def start(handler):
+    '''Begin tracing handler's request; handler.request_trace is the Trace,
+    or None when tracing is off'''
+    trace = Trace(handler) if enabled else None
+    handler.request_trace = trace
+    return trace
+
+
+def span(trace, name):
+    '''Context manager timing a span of trace (no-op if trace is None)'''
+    if trace is None:
+        return _no_span
+    return _Span(trace, name)
+
+
+def begin(trace, name):
+    if trace is not None:
+        trace.begin(name)
+
+
+def finish(handler):
+    '''Log the handler's trace, if it has one'''
+    trace = getattr(handler, 'request_trace', None)
+    if trace is not None:
+        handler.request_trace = None
+        logger.info('%s', dumps(trace.finish()).decode('utf-8'))
+
+
+def set_enabled(value):
+    global enabled
+    enabled = bool(value)